@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import pbio.misc.logging_utils as logging_utils
+
+logger = logging.getLogger(__name__)
+
+metrics = [
+    'wall_time',
+    'cpu_time',
+    'peak_rss',
+    'read_bytes',
+    'write_bytes',
+    'output_bytes'
+]
+
+time_metrics = ['wall_time', 'cpu_time']
+
+default_threshold = 0.2
+default_min_time = 5
+default_min_bytes = 100 * 2**20
+
+
+def get_manifest_files(paths):
+    """ This function expands the directories in paths to the (json)
+        manifests they contain.
+    """
+    manifest_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            manifest_files.extend(sorted(glob.glob(os.path.join(path, '*.json'))))
+        else:
+            manifest_files.append(path)
+
+    return manifest_files
+
+
+def get_steps(manifest, prefix=None):
+    """ This function flattens the steps of a manifest, including those of
+        the manifests of the drivers called as steps. Each step is keyed by the
+        driver(s) which called it and its program, with the occurrence of the
+        program, if it is called more than once.
+
+        Yields:
+            dict: the key and the metrics of each step (which was run and
+                completed), and of the whole driver
+    """
+    driver = manifest['program']
+    if prefix is not None:
+        driver = "{} > {}".format(prefix, driver)
+
+    total = {'step': "{} (total)".format(driver)}
+    total.update({metric: manifest['total'].get(metric) for metric in metrics})
+    total['output_bytes'] = sum(s.get('output_bytes', 0) for s in manifest['steps'])
+    yield total
+
+    occurrences = {}
+    for step in manifest['steps']:
+        program = step['program']
+        occurrences[program] = occurrences.get(program, 0) + 1
+
+        if 'manifest' in step:
+            yield from get_steps(step['manifest'], driver)
+            continue
+
+        if (step['status'] != 'completed') or (not step['called']) or step['skipped']:
+            continue
+
+        key = "{} > {}".format(driver, program)
+        if occurrences[program] > 1:
+            key = "{} #{}".format(key, occurrences[program])
+
+        record = {'step': key}
+        record.update({metric: step.get(metric) for metric in metrics})
+        yield record
+
+
+def read_manifests(paths):
+    """ This function reads the manifests, and gives the metrics of all of
+        their steps.
+
+        Returns:
+            pd.DataFrame: the name of the run (sample, condition or genome),
+                the step and its metrics
+    """
+    records = []
+    for manifest_file in get_manifest_files(paths):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+        for record in get_steps(manifest):
+            record['name'] = manifest['name']
+            record['manifest'] = manifest_file
+            records.append(record)
+
+    columns = ['name', 'step', 'manifest'] + metrics
+    records = pd.DataFrame(records, columns=columns)
+    records[metrics] = records[metrics].astype(float)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script compares the run manifests
+        written by the drivers (prepare-rpbp-genome, run-rpbp-pipeline, create-orf-profiles
+        and predict-translated-orfs, with --manifest) of a set of baseline runs and of a set
+        of new runs, e.g., before and after a change of the code or of the environment. For
+        each sample (or condition, or genome) and step, the median of each metric (wall time,
+        CPU time, peak memory, I/O and output size) is compared, and it is flagged as a
+        regression if the new median exceeds the baseline by more than the threshold. Skipped
+        and failed steps are not included.""")
+
+    parser.add_argument('baseline', help="""The (json) manifests of the baseline runs, or
+        directories containing them""", nargs='+')
+
+    parser.add_argument('--runs', help="""The (json) manifests of the new runs, or
+        directories containing them""", nargs='+', required=True)
+
+    parser.add_argument('--threshold', help="""The relative increase of a metric which is
+        flagged as a regression""", type=float, default=default_threshold)
+
+    parser.add_argument('--min-time', help="""The minimum absolute increase (in seconds)
+        of the wall or CPU time which is flagged as a regression""", type=float,
+                        default=default_min_time)
+
+    parser.add_argument('--min-bytes', help="""The minimum absolute increase (in bytes) of
+        the peak memory, I/O or output size which is flagged as a regression""", type=float,
+                        default=default_min_bytes)
+
+    parser.add_argument('--out', help="""If given, the comparison of all steps and metrics
+        is written to this (csv) file.""", default=None)
+
+    parser.add_argument('--fail-on-regression', help="""If this flag is given, the script
+        exits with a non-zero status if any regression is flagged.""", action='store_true')
+
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args()
+    logging_utils.update_logging(args)
+
+    msg = "Reading run manifests"
+    logger.info(msg)
+
+    baseline = read_manifests(args.baseline)
+    runs = read_manifests(args.runs)
+
+    msg = "Number of manifests: {} (baseline), {} (new runs)".format(
+        baseline['manifest'].nunique(), runs['manifest'].nunique())
+    logger.info(msg)
+
+    keys = ['name', 'step']
+    baseline_medians = baseline.groupby(keys)[metrics].median()
+    runs_medians = runs.groupby(keys)[metrics].median()
+
+    only_baseline = baseline_medians.index.difference(runs_medians.index)
+    only_runs = runs_medians.index.difference(baseline_medians.index)
+    if (len(only_baseline) > 0) or (len(only_runs) > 0):
+        msg = ("Steps which are not in both sets of runs (not compared). Only in the "
+               "baseline: {}. Only in the new runs: {}".format(len(only_baseline), len(only_runs)))
+        logger.warning(msg)
+
+    medians = baseline_medians.join(runs_medians, how='inner', lsuffix='_baseline',
+                                    rsuffix='_new')
+
+    comparisons = []
+    for metric in metrics:
+        comparison = pd.DataFrame(index=medians.index)
+        comparison['metric'] = metric
+        comparison['baseline'] = medians[metric + '_baseline']
+        comparison['new'] = medians[metric + '_new']
+        comparison['difference'] = comparison['new'] - comparison['baseline']
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            comparison['relative_difference'] = (comparison['difference'] /
+                                                 comparison['baseline'])
+
+        min_difference = args.min_time if metric in time_metrics else args.min_bytes
+        comparison['is_regression'] = (
+            (comparison['new'] > comparison['baseline'] * (1 + args.threshold)) &
+            (comparison['difference'] > min_difference)
+        )
+
+        # metrics which are not known for either run are not compared
+        m_known = comparison['baseline'].notnull() & comparison['new'].notnull()
+        comparisons.append(comparison[m_known])
+
+    comparisons = pd.concat(comparisons).reset_index()
+
+    regressions = comparisons[comparisons['is_regression']]
+    for row in regressions.itertuples():
+        msg = ("Regression: {} ({}), {}: {:.6g} (baseline), {:.6g} (new), "
+               "{:+.1%}".format(row.step, row.name, row.metric, row.baseline, row.new,
+                                row.relative_difference))
+        logger.warning(msg)
+
+    msg = "Number of steps compared: {}. Number of regressions: {}".format(
+        len(medians), len(regressions))
+    logger.info(msg)
+
+    if args.out is not None:
+        msg = "Writing the comparison to disk"
+        logger.info(msg)
+        comparisons.to_csv(args.out, index=False)
+
+    if args.fail_on_regression and (len(regressions) > 0):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,6 @@ import itertools
 import logging
 import yaml
 
-import pysam
-
 import pbio.utils.bio as bio
 import pbio.misc.utils as utils
 import pbio.ribo.ribo_filenames as filenames
@@ -37,6 +35,9 @@ def main():
     args = parser.parse_args()
     utils.update_logging(args)
 
+    # pysam is only imported once the arguments are parsed
+    import pysam
+
     config = yaml.load(open(args.config), Loader=yaml.FullLoader)
 
     note = config.get('note', None)
@@ -11,7 +11,6 @@ import scipy.stats
 
 import pbio.utils.bio as bio
 import pbio.utils.bed_utils as bed_utils
-import pbio.utils.mygene_utils as mygene_utils
 import pbio.misc.math_utils as math_utils
 import pbio.misc.parallel as parallel
 import pbio.misc.utils as utils
@@ -20,8 +19,6 @@ import pbio.misc.pandas_utils as pandas_utils
 import pbio.ribo.ribo_utils as ribo_utils
 import pbio.ribo.ribo_filenames as filenames
 
-import pyensembl
-
 
 # TODO: this script causes several SettingWithCopyWarnings. This is expected, so
 # we will ignore it for now.
@@ -270,6 +267,11 @@ def main():
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
+    # pyensembl and mygene are only imported once the arguments are parsed
+    import pyensembl
+
+    import pbio.utils.mygene_utils as mygene_utils
+
     msg = "Loading ensembl database"
     logger.info(msg)
 
@@ -1,11 +1,6 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
-import matplotlib.pyplot as plt
-import seaborn as sns; sns.set(style='white')
 import numpy as np
 import pandas as pd
 
@@ -60,6 +55,12 @@ def main():
 
     args = parser.parse_args()
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns; sns.set(style='white')
+
     metagene_profile = pd.read_csv(args.metagene_profile)
 
     m_length = metagene_profile['length'] == args.length
@@ -14,7 +14,6 @@ import pbio.ribo.ribo_utils as ribo_utils
 
 
 import pbio.utils.bio as bio
-import pbio.utils.bam_utils as bam_utils
 import pbio.utils.fastx_utils as fastx_utils
 import pbio.misc.logging_utils as logging_utils
 import pbio.misc.parallel as parallel
@@ -27,6 +26,9 @@ logger = logging.getLogger(__name__)
 default_num_cpus = 2
 
 def get_counts(name_data, config, args):
+    # pysam is only imported by the processes which count the reads
+    import pbio.utils.bam_utils as bam_utils
+
     name, data = name_data
     msg = "processing {}...".format(name)
     logger.info(msg)
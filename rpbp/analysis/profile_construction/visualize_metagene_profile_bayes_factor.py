@@ -1,10 +1,6 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import logging
@@ -33,6 +29,11 @@ def main():
 
     args = parser.parse_args()
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
     bayes_factors = pd.read_csv(args.bayes_factors)
 
     mask_length = bayes_factors['length'] == args.length
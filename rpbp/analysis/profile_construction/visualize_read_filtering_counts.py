@@ -1,18 +1,11 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
 import yaml
 import logging
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
-import seaborn as sns; sns.set(style='white')
 
-import pbio.misc.mpl_utils as mpl_utils
 import pbio.misc.logging_utils as logging_utils
 
 import pbio.ribo.ribo_utils as ribo_utils
@@ -101,6 +94,15 @@ def main():
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mtick
+    import seaborn as sns; sns.set(style='white')
+
+    import pbio.misc.mpl_utils as mpl_utils
+
     
     if args.without_rrna:
         msg = "Using the default without rrna field order"
@@ -1,11 +1,8 @@
 #! /usr/bin/env python3
 
 import argparse
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 
-import pbio.misc.mpl_utils as mpl_utils
 import pbio.misc.math_utils as math_utils
 
 import pickle
@@ -37,6 +34,12 @@ def main():
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    import pbio.misc.mpl_utils as mpl_utils
+
     msg = "Reading model pickle file"
     logger.info(msg)
     model_pkl = pickle.load(open(args.pkl, 'rb'))
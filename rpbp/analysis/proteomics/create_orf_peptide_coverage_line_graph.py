@@ -1,15 +1,9 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-matplotlib.rc('text', usetex=True)
-
 import argparse
 import logging
 import re
 
-import matplotlib.pyplot as plt
-import matplotlib.ticker
 import numpy as np
 import pandas as pd
 
@@ -95,6 +89,13 @@ def main():
     args = parser.parse_args()
     utils.update_logging(args)
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    matplotlib.rc('text', usetex=True)
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker
+
     msg = "Reading predictions"
     logging.info(msg)
     rpbp_peptide_matches = pd.read_csv(args.rpbp_peptide_matches)
@@ -4,8 +4,6 @@ import argparse
 import pandas as pd
 import logging
 
-import pybedtools
-
 import pbio.utils.bio as bio
 import pbio.misc.utils as utils
 
@@ -34,6 +32,9 @@ def main():
     args = parser.parse_args()
     utils.update_logging(args)
 
+    # pybedtools is only imported once the arguments are parsed
+    import pybedtools
+
     programs = ['closestBed']
     utils.check_programs_exist(programs)
 
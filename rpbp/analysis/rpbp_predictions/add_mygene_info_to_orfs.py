@@ -6,7 +6,6 @@ import collections
 import pandas as pd
 
 import pbio.utils.bed_utils as bed_utils
-import pbio.utils.mygene_utils as mygene_utils
 import pbio.misc.logging_utils as logging_utils
 import pbio.misc.parallel as parallel
 import pbio.misc.utils as utils
@@ -85,6 +84,9 @@ def main():
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
+    # mygene is only imported once the arguments are parsed
+    import pbio.utils.mygene_utils as mygene_utils
+
     convert_ids = not args.do_not_convert_ids
 
     msg = "Reading the bed file"
@@ -0,0 +1,203 @@
+#! /usr/bin/env python3
+
+import argparse
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+import pbio.utils.bed_utils as bed_utils
+import pbio.misc.logging_utils as logging_utils
+
+from rpbp.defaults import translation_options
+
+logger = logging.getLogger(__name__)
+
+default_fields = [
+    'bayes_factor_mean',
+    'bayes_factor_var',
+    'p_translated_mean',
+    'p_background_mean',
+    'chi_square_p'
+]
+
+default_max_standardized_diff = 0.5
+
+
+def get_differences(a, b):
+    """ This function calculates the element-wise difference of two series,
+        treating identical values (including infinite ones) as no difference.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+
+    with np.errstate(invalid='ignore'):
+        diff = np.where(a == b, 0, a - b)
+
+    # both nan is also not a difference
+    m_both_nan = np.isnan(a) & np.isnan(b)
+    diff[m_both_nan] = 0
+
+    return diff
+
+
+def get_bf_likelihood(bf_mean, bf_var, min_bf_mean):
+    """ This function calculates P(bf > min_bf_mean) for each ORF, using the
+        estimated mean and variance of the (log) Bayes factor.
+    """
+    with np.errstate(invalid='ignore'):
+        scale = np.sqrt(bf_var)
+    return scipy.stats.norm.sf(min_bf_mean, bf_mean, scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script compares two Bayes factor files
+        (BED12+) created by estimate-orf-bayes-factors for the same ORFs, e.g., to validate
+        alternative model variants or sampling options against the default models. For each
+        field, it reports the maximum and mean absolute differences. The difference in the
+        Bayes factor means is also standardized by the estimated Bayes factor standard
+        deviations, and the number of ORFs whose prediction status (P(bf > min_bf_mean) >
+        min_bf_likelihood) differs is reported. The script exits with a non-zero status if
+        the ORFs do not match or if any of the given tolerances is exceeded.""")
+
+    parser.add_argument('bayes_factors_a', help="The first Bayes factor file (BED12+)")
+
+    parser.add_argument('bayes_factors_b', help="The second Bayes factor file (BED12+)")
+
+    parser.add_argument('--fields', help="The fields to compare", nargs='+',
+                        default=default_fields)
+
+    parser.add_argument('--max-abs-diff', help="""If given, the maximum absolute
+        difference allowed for any of the fields.""", type=float, default=None)
+
+    parser.add_argument('--max-standardized-diff', help="""The maximum absolute difference
+        of the Bayes factor means, divided by the square root of the sum of their variances,
+        allowed for any ORF.""", type=float, default=default_max_standardized_diff)
+
+    parser.add_argument('--min-bf-mean', help="""The minimum Bayes' factor mean used to
+        decide if an ORF is predicted as translated""",
+                        type=float, default=translation_options['min_bf_mean'])
+
+    parser.add_argument('--min-bf-likelihood', help="""The threshold on the likelihood of
+        translation used to decide if an ORF is predicted as translated""",
+                        type=float, default=translation_options['min_bf_likelihood'])
+
+    parser.add_argument('--max-prediction-differences', help="""The maximum number of ORFs
+        whose prediction status is allowed to differ""", type=int, default=None)
+
+    parser.add_argument('--out', help="""If given, the per-ORF differences are written
+        to this (csv.gz) file.""", default=None)
+
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args()
+    logging_utils.update_logging(args)
+
+    msg = "Reading Bayes factor files"
+    logger.info(msg)
+
+    bf_a = bed_utils.read_bed(args.bayes_factors_a)
+    bf_b = bed_utils.read_bed(args.bayes_factors_b)
+
+    is_ok = True
+
+    ids_a = set(bf_a['id'])
+    ids_b = set(bf_b['id'])
+
+    if ids_a != ids_b:
+        msg = ("The files do not contain the same ORFs. Only in the first file: {}. "
+               "Only in the second file: {}".format(len(ids_a - ids_b), len(ids_b - ids_a)))
+        logger.error(msg)
+        is_ok = False
+
+    fields = ['id'] + args.fields
+    bf = bf_a[fields].merge(bf_b[fields], on='id', suffixes=('_a', '_b'))
+
+    msg = "Number of ORFs in both files: {}".format(len(bf))
+    logger.info(msg)
+
+    differences = pd.DataFrame()
+    differences['id'] = bf['id']
+
+    for field in args.fields:
+        diff = get_differences(bf[field + '_a'], bf[field + '_b'])
+        differences[field] = diff
+
+        abs_diff = np.abs(diff[~np.isnan(diff)])
+        max_abs_diff = 0
+        mean_abs_diff = 0
+        if len(abs_diff) > 0:
+            max_abs_diff = np.max(abs_diff)
+            mean_abs_diff = np.mean(abs_diff)
+
+        num_nan = np.sum(np.isnan(diff))
+
+        msg = ("{}: max. abs. difference: {:.6g}, mean abs. difference: {:.6g}, "
+               "only defined in one file: {}".format(field, max_abs_diff, mean_abs_diff, num_nan))
+        logger.info(msg)
+
+        if (args.max_abs_diff is not None) and ((max_abs_diff > args.max_abs_diff) or (num_nan > 0)):
+            msg = "{}: the maximum absolute difference is exceeded".format(field)
+            logger.error(msg)
+            is_ok = False
+
+    bf_fields = ['bayes_factor_mean', 'bayes_factor_var']
+    if all(f in args.fields for f in bf_fields):
+
+        diff = differences['bayes_factor_mean']
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.sqrt(bf['bayes_factor_var_a'] + bf['bayes_factor_var_b'])
+            standardized_diff = np.where(diff == 0, 0, diff / scale)
+
+        differences['bayes_factor_mean_standardized'] = standardized_diff
+
+        finite_diff = np.abs(standardized_diff[np.isfinite(standardized_diff)])
+        max_standardized_diff = 0
+        if len(finite_diff) > 0:
+            max_standardized_diff = np.max(finite_diff)
+
+        msg = "bayes_factor_mean: max. standardized difference: {:.6g}".format(max_standardized_diff)
+        logger.info(msg)
+
+        if max_standardized_diff > args.max_standardized_diff:
+            msg = "The maximum standardized difference of the Bayes factor means is exceeded"
+            logger.error(msg)
+            is_ok = False
+
+        # and check which ORFs would be predicted differently
+        predictions = []
+        for suffix in ['_a', '_b']:
+            likelihood = get_bf_likelihood(bf['bayes_factor_mean' + suffix],
+                                           bf['bayes_factor_var' + suffix],
+                                           args.min_bf_mean)
+            predictions.append(likelihood > args.min_bf_likelihood)
+
+        m_prediction_differs = predictions[0] != predictions[1]
+        differences['prediction_differs'] = m_prediction_differs
+
+        msg = ("Number of ORFs predicted as translated: {} (first file), {} (second file). "
+               "Number of ORFs whose prediction differs: {}".format(sum(predictions[0]),
+                                                                   sum(predictions[1]),
+                                                                   sum(m_prediction_differs)))
+        logger.info(msg)
+
+        if ((args.max_prediction_differences is not None) and
+                (sum(m_prediction_differs) > args.max_prediction_differences)):
+            msg = "The maximum number of prediction differences is exceeded"
+            logger.error(msg)
+            is_ok = False
+
+    if args.out is not None:
+        msg = "Writing the differences to disk"
+        logger.info(msg)
+        differences.to_csv(args.out, index=False)
+
+    if not is_ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,10 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
 import logging
 import os
 import yaml
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pbio.utils.bio as bio
 import pbio.misc.utils as utils
@@ -54,6 +50,11 @@ def main():
     args = parser.parse_args()
     utils.update_logging(args)
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
     config = yaml.load(open(args.config), Loader=yaml.FullLoader)
     note = config.get('note', None)
 
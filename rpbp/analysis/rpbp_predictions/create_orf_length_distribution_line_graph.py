@@ -1,11 +1,6 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-matplotlib.rc('text', usetex=True)
-
 import argparse
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import scipy.stats
@@ -49,6 +44,12 @@ def main():
     
     args = parser.parse_args()
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    matplotlib.rc('text', usetex=True)
+    import matplotlib.pyplot as plt
+
     orfs = bed_utils.read_bed(args.orfs)
 
     if args.use_groups:
@@ -1,16 +1,10 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns; sns.set(style='white')
 
 import pbio.utils.bed_utils as bed_utils
-import pbio.misc.mpl_utils as mpl_utils
 import pbio.ribo.ribo_utils as ribo_utils
 
 import logging
@@ -44,6 +38,14 @@ def main():
     logging_utils.add_logging_options(parser)
     args = parser.parse_args()
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns; sns.set(style='white')
+
+    import pbio.misc.mpl_utils as mpl_utils
+
     msg = "Reading bed file"
     logger.info(msg)
 
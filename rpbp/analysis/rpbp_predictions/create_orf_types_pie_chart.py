@@ -1,11 +1,7 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 import pbio.utils.bed_utils as bed_utils
@@ -40,6 +36,11 @@ def main():
     
     args = parser.parse_args()
 
+    # the plotting modules are only imported once the arguments are parsed
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
     orfs = bed_utils.read_bed(args.orfs)
 
     strands = ['+', '-']
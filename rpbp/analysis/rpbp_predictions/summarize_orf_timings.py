@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+import pbio.misc.logging_utils as logging_utils
+
+import rpbp.translation_prediction.estimate_orf_bayes_factors as estimate_orf_bayes_factors
+
+logger = logging.getLogger(__name__)
+
+default_orf_type_field = 'orf_type'
+
+# the (left-closed) bins of the ORF lengths (nt); the last bin is open
+default_length_bins = [0, 100, 300, 1000, 3000, 10000]
+
+
+def get_length_bins(orf_lens, length_bins):
+    """ This function assigns each ORF length to its bin, [b_i, b_{i+1}), with
+        the last bin extending to infinity.
+    """
+    bins = list(length_bins) + [np.inf]
+    return pd.cut(orf_lens, bins=bins, right=False)
+
+
+def get_cost_breakdown(timings, by):
+    """ This function sums the time spent in each phase, and the diagnostics of
+        each model, for each group of ORFs.
+
+        Args:
+            timings (pd.DataFrame): the timings written by
+                estimate-orf-bayes-factors --write-timings
+
+            by (list of strings): the fields by which the ORFs are grouped
+
+        Returns:
+            pd.DataFrame: the number of ORFs, the summed costs and the mean and
+                fraction of the total wall time of each group
+    """
+    cost_fields = [f for f in estimate_orf_bayes_factors.timing_fields if f in timings]
+    diagnostic_fields = [
+        c for c in timings.columns if c.endswith('_n_leapfrog') or c.endswith('_n_divergent')
+    ]
+
+    groups = timings.groupby(by, observed=True)
+
+    breakdown = groups[cost_fields + diagnostic_fields].sum()
+    breakdown.insert(0, 'num_orfs', groups.size())
+
+    breakdown['mean_wall_time'] = breakdown['wall_time'] / breakdown['num_orfs']
+    breakdown['wall_time_fraction'] = breakdown['wall_time'] / timings['wall_time'].sum()
+
+    breakdown = breakdown.sort_values('wall_time', ascending=False)
+    return breakdown
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script summarizes the per-ORF timings
+        written by estimate-orf-bayes-factors --write-timings (e.g., for all shards of a run).
+        It prints the total time spent in each phase, and the cost breakdown by ORF type and
+        by ORF type and length bin.""")
+
+    parser.add_argument('timings', help="The timings files (tsv)", nargs='+')
+
+    parser.add_argument('--length-bins', help="""The lower bounds of the ORF length bins
+        (nt). The last bin includes all longer ORFs.""", type=int, nargs='+',
+                        default=default_length_bins)
+
+    parser.add_argument('--orf-type-field', default=default_orf_type_field)
+
+    parser.add_argument('--out', help="""If given, the breakdown by ORF type and length
+        bin is written to this (csv.gz) file.""", default=None)
+
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args()
+    logging_utils.update_logging(args)
+
+    msg = "Reading the timings"
+    logger.info(msg)
+
+    timings = pd.concat([pd.read_csv(t, sep='\t') for t in args.timings], ignore_index=True)
+
+    # the timings of a resumed run may include ORFs which were processed again
+    timings = timings.drop_duplicates(subset=['id'], keep='last')
+    timings['length_bin'] = get_length_bins(timings['orf_len'], args.length_bins)
+
+    num_workers = timings['worker'].nunique()
+    print("Number of ORFs: {}, number of workers: {}".format(len(timings), num_workers))
+
+    print("\nTotal time (s) in each phase:")
+    phases = timings[[f for f in estimate_orf_bayes_factors.timing_fields if f in timings]]
+    print(phases.sum().to_string())
+
+    print("\nCost by ORF type:")
+    by_type = get_cost_breakdown(timings, [args.orf_type_field])
+    print(by_type.to_string())
+
+    print("\nCost by ORF type and length (nt):")
+    by_type_length = get_cost_breakdown(timings, [args.orf_type_field, 'length_bin'])
+    print(by_type_length.to_string())
+
+    if args.out is not None:
+        msg = "Writing the breakdown to disk"
+        logger.info(msg)
+        by_type_length.to_csv(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,9 @@
 #! /usr/bin/env python3
 
-import matplotlib
-matplotlib.use('agg')
-
 import argparse
 import logging
 import sys
 
-import matplotlib.pyplot as plt
 import numpy as np
 import scipy.io
 import tqdm
@@ -61,7 +57,10 @@ def get_profile(orf, profiles, min_profile):
     return profile
 
 def plot_windows(windows, title, out):
-
+    # matplotlib is only imported by the processes which plot
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
 
     if len(windows) == 0:
         msg = "Did not find any windows for: {}".format(title)
@@ -0,0 +1,383 @@
+#! /usr/bin/env python3
+
+""" Measure the startup time of the console scripts (entry points) of rpbp.
+
+A full run of the pipeline starts many of these scripts, so the packages
+they import before they do any work (or just print --help) add up. For each
+entry point in setup.cfg, the module is imported in a new interpreter with
+"python -X importtime", and the total import time and the imported
+(third-party) packages are recorded.
+
+The startup budget is checked for each entry point: heavy packages which
+are only needed in some code paths (plotting, pystan, pysam, etc.) must not
+be imported at startup, the drivers of the pipeline must not import pandas
+or scipy, and the import time must be within the budget, and within the
+given threshold of that in a baseline (--out of a previous run).
+
+This script only uses the standard library (and pbio.misc.logging_utils),
+so it does not itself import any of the packages it checks.
+"""
+
+import argparse
+import configparser
+import csv
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import pbio.misc.logging_utils as logging_utils
+
+logger = logging.getLogger(__name__)
+
+# the packages which no entry point imports at startup
+deferred_packages = [
+    'matplotlib',
+    'seaborn',
+    'pystan',
+    'pyensembl',
+    'mygene',
+    'pysam',
+    'pybedtools',
+    'statsmodels',
+    'sklearn'
+]
+
+# the drivers, which mostly call other programs, do not import these either
+light_entry_points = [
+    'prepare-rpbp-genome',
+    'run-rpbp-pipeline',
+    'run-all-rpbp-instances',
+    'create-orf-profiles',
+    'create-base-genome-profile',
+    'predict-translated-orfs',
+    'benchmark-rpbp-startup'
+]
+
+light_deferred_packages = ['pandas', 'scipy']
+
+# the maximum import time (seconds) of the drivers and of the other scripts
+default_max_light_import_time = 0.5
+default_max_import_time = 2.0
+
+default_repeats = 3
+default_threshold = 0.2
+default_min_time = 0.05
+
+fields = [
+    'entry_point',
+    'module',
+    'status',
+    'import_time',
+    'wall_time',
+    'num_modules',
+    'packages'
+]
+
+
+def get_default_setup_cfg():
+    """ This function gives the setup.cfg of the source tree which contains
+        this package.
+    """
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, 'setup.cfg')
+
+
+def get_entry_points(setup_cfg):
+    """ This function reads the console scripts from setup.cfg or, if it
+        does not exist (e.g., for an installed package), from the installed
+        distribution.
+
+        Returns:
+            list of tuples: the name and the module of each entry point
+    """
+    if not os.path.exists(setup_cfg):
+        msg = "Could not find {}. Using the installed entry points.".format(setup_cfg)
+        logger.warning(msg)
+
+        import pkg_resources
+        console_scripts = pkg_resources.get_entry_map('rpbp').get('console_scripts', {})
+        return [(name, ep.module_name) for name, ep in sorted(console_scripts.items())]
+
+    config = configparser.ConfigParser()
+    config.read(setup_cfg)
+
+    entry_points = []
+    for line in config['options.entry_points']['console_scripts'].splitlines():
+        line = line.strip()
+        if (len(line) == 0) or line.startswith('#'):
+            continue
+
+        name, target = [s.strip() for s in line.split('=', 1)]
+        module = target.split(':')[0]
+        entry_points.append((name, module))
+
+    return entry_points
+
+
+def parse_importtime(output):
+    """ This function parses the output of "python -X importtime".
+
+        Returns:
+            list of tuples: the self and cumulative time (microseconds), the
+                nesting depth and the name of each imported module, in the
+                order of the output (i.e., a module after its imports)
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+
+        try:
+            self_time = int(fields[0])
+            cumulative_time = int(fields[1])
+        except ValueError:
+            # the header
+            continue
+
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((self_time, cumulative_time, depth, name.strip()))
+
+    return imports
+
+
+def get_importers(imports):
+    """ This function finds the module which first imported each top-level
+        package, i.e., the next module in the output with a smaller depth
+        which is not part of the package.
+
+        Returns:
+            dict: the importer of each package (None if imported at startup)
+    """
+    importers = {}
+    for i, (_, _, depth, name) in enumerate(imports):
+        package = name.split('.')[0]
+        if package in importers:
+            continue
+
+        importer = None
+        for _, _, parent_depth, parent in imports[i+1:]:
+            if parent_depth >= depth:
+                continue
+
+            if parent.split('.')[0] != package:
+                importer = parent
+                break
+
+            depth = parent_depth
+
+        importers[package] = importer
+
+    return importers
+
+
+def measure_startup(module, python, repeats):
+    """ This function imports the module in new interpreters.
+
+        Returns:
+            dict: the (minimum) total import time and wall time (seconds), the
+                number of imported modules, and the importer of each package,
+                or the error
+    """
+    cmd = [python, '-X', 'importtime', '-c', 'import {}'.format(module)]
+
+    import_times = []
+    wall_times = []
+    imports = []
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        wall_times.append(time.perf_counter() - start_time)
+
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            error = lines[-1] if len(lines) > 0 else "exit code {}".format(result.returncode)
+            return {'status': 'failed', 'error': error}
+
+        imports = parse_importtime(result.stderr)
+        import_times.append(sum(i[0] for i in imports) / 1e6)
+
+    record = {
+        'status': 'ok',
+        'import_time': min(import_times),
+        'wall_time': min(wall_times),
+        'num_modules': len(imports),
+        'importers': get_importers(imports)
+    }
+    return record
+
+
+def read_baseline(filename):
+    """ This function reads the import times from a previous --out file.
+    """
+    with open(filename) as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        return {
+            row['entry_point']: float(row['import_time']) for row in reader
+            if row['status'] == 'ok'
+        }
+
+
+def check_budget(name, record, baseline, args):
+    """ This function checks the startup of the entry point against the
+        budget and the baseline.
+
+        Returns:
+            list of strings: the violations
+    """
+    if record['status'] != 'ok':
+        return ["could not be imported: {}".format(record['error'])]
+
+    violations = []
+
+    packages = list(deferred_packages)
+    max_import_time = args.max_import_time
+    if name in light_entry_points:
+        packages += light_deferred_packages
+        max_import_time = args.max_light_import_time
+
+    for package in packages:
+        if package in record['importers']:
+            msg = "imports {} at startup (imported by {})".format(package,
+                                                                  record['importers'][package])
+            violations.append(msg)
+
+    import_time = record['import_time']
+    if import_time > max_import_time:
+        msg = "import time {:.3f}s exceeds the budget of {:.3f}s".format(import_time,
+                                                                         max_import_time)
+        violations.append(msg)
+
+    if name in baseline:
+        baseline_time = baseline[name]
+        if ((import_time > baseline_time * (1 + args.threshold)) and
+                (import_time - baseline_time > args.min_time)):
+            msg = "import time {:.3f}s exceeds the baseline of {:.3f}s".format(import_time,
+                                                                               baseline_time)
+            violations.append(msg)
+
+    return violations
+
+
+def parse_arguments(argv=None):
+    """ This function parses the command line arguments of the script (or
+        argv, if given, without the program name).
+
+        Returns:
+            argparse.Namespace: the parsed arguments
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script measures the startup (import)
+        time of each console script of rpbp with "python -X importtime", and checks it
+        against the startup budget: heavy packages (plotting, pystan, pysam, etc.) are not
+        imported at startup, the drivers of the pipeline do not import pandas or scipy, and
+        the import time is within the budget and within the threshold of the baseline. The
+        script exits with a non-zero status if the budget of any entry point is exceeded.""")
+
+    parser.add_argument('--entry-points', help="""The entry points to measure. Default: all
+        of the entry points in setup.cfg.""", nargs='+', default=None)
+
+    parser.add_argument('--setup-cfg', help="""The setup.cfg with the entry points. If it
+        does not exist, the installed entry points are used.""", default=get_default_setup_cfg())
+
+    parser.add_argument('--python', help="The python interpreter", default=sys.executable)
+
+    parser.add_argument('--repeats', help="""The number of times each module is imported;
+        the minimum time is used.""", type=int, default=default_repeats)
+
+    parser.add_argument('--max-light-import-time', help="""The maximum import time (in
+        seconds) of the drivers of the pipeline""", type=float,
+                        default=default_max_light_import_time)
+
+    parser.add_argument('--max-import-time', help="""The maximum import time (in seconds) of
+        the other entry points""", type=float, default=default_max_import_time)
+
+    parser.add_argument('--baseline', help="""The output (--out) of a previous run. If
+        given, an increase of the import time of an entry point by more than the threshold
+        is also a violation.""", default=None)
+
+    parser.add_argument('--threshold', help="""The relative increase of the import time
+        over the baseline which is a violation""", type=float, default=default_threshold)
+
+    parser.add_argument('--min-time', help="""The minimum absolute increase (in seconds) of
+        the import time over the baseline which is a violation""", type=float,
+                        default=default_min_time)
+
+    parser.add_argument('--out', help="""If given, the startup time of each entry point is
+        written to this (tsv) file, e.g., to use it as a baseline.""", default=None)
+
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    logging_utils.update_logging(args)
+
+    entry_points = get_entry_points(args.setup_cfg)
+    if args.entry_points is not None:
+        missing = set(args.entry_points) - set(name for name, _ in entry_points)
+        if len(missing) > 0:
+            msg = "Unknown entry points: {}".format(sorted(missing))
+            raise ValueError(msg)
+
+        entry_points = [(name, module) for name, module in entry_points
+                        if name in args.entry_points]
+
+    baseline = {}
+    if args.baseline is not None:
+        baseline = read_baseline(args.baseline)
+
+    records = []
+    num_violations = 0
+
+    for name, module in entry_points:
+        record = measure_startup(module, args.python, args.repeats)
+        record['entry_point'] = name
+        record['module'] = module
+        records.append(record)
+
+        if record['status'] == 'ok':
+            msg = "{}: import time: {:.3f}s, wall time: {:.3f}s, modules: {}".format(
+                name, record['import_time'], record['wall_time'], record['num_modules'])
+            logger.info(msg)
+
+        for violation in check_budget(name, record, baseline, args):
+            msg = "{}: {}".format(name, violation)
+            logger.error(msg)
+            num_violations += 1
+
+    msg = "Number of entry points: {}. Number of budget violations: {}".format(
+        len(records), num_violations)
+    logger.info(msg)
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, delimiter='\t',
+                                    extrasaction='ignore')
+            writer.writeheader()
+
+            for record in records:
+                row = dict(record)
+                row['packages'] = ','.join(sorted(record.get('importers', {})))
+                for field in ['import_time', 'wall_time']:
+                    if field in row:
+                        row[field] = "{:.4f}".format(row[field])
+                writer.writerow(row)
+
+    if num_violations > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
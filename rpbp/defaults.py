@@ -30,6 +30,17 @@ default_mem = '2G'
 
 default_num_groups = 100  # currently cannot be overridden
 
+# the resources requested by each step of the pipeline, when the samples
+# are run locally by run-all-rpbp-instances, as fractions of --num-cpus and
+# --mem (at least one CPU is requested): STAR needs the memory to create the
+# profiles, the Bayes factors need the CPUs, but not much memory, and the
+# selection of the predictions (and their sequences) is light
+local_job_resources = {
+    'profiles': {'num_cpus': 1.0, 'mem': 1.0},
+    'bayes_factors': {'num_cpus': 1.0, 'mem': 0.25},
+    'predictions': {'num_cpus': 0.0, 'mem': 0.1}
+}
+
 
 # default: Rp-Bp (genome index creation, ORF identification)
 # overridden via config file
@@ -115,6 +126,13 @@ translation_options = {
     'seed': 8675309,
     'chains': 2,
     'translation_iterations': 500,
+    'translation_warmup': None,  # if None, half of translation_iterations
+    'orf_batch_max_length': 0,  # ORF with length <= batch-max-length are fit in batches, 0 ignore option
+    'orf_batch_size': 100,  # the maximum number of ORFs in each batch
+    'num_shards': 1,  # the number of (local) shards for estimating the Bayes factors
+    'model_selection': 'full',  # full, map or pilot; how the best model of each class is chosen
+    'model_selection_pilot_iterations': 50,  # the iterations of the (single) pilot chain
+    'model_selection_audit_rate': 0.05,  # the fraction of ORFs for which all models are fit anyway
     'orf_types': [],  # predict only these, if empty predict all types
     'min_bf_mean': 5,
     'min_bf_likelihood': 0.5,
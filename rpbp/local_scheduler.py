@@ -0,0 +1,184 @@
+""" A simple scheduler which runs jobs (commands) as local processes, as many
+at once as a global CPU and memory budget allows.
+
+Each job requests a number of CPUs and an amount of memory, and it may
+depend on other jobs. A job is started as soon as all of its dependencies
+have finished and the resources it requests are free. Ready jobs are started
+by priority, then in the order they were added. If a job fails, the jobs
+which depend on it are not run, but the others continue.
+"""
+
+import collections
+import logging
+import shlex
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+# the number of seconds between checks of the running jobs
+default_poll_interval = 1
+
+memory_units = {
+    'K': 2**10,
+    'M': 2**20,
+    'G': 2**30,
+    'T': 2**40
+}
+
+
+def parse_mem(mem):
+    """ This function parses an amount of memory in the format of --mem,
+        e.g., 2G or 500M (without a unit, in megabytes, as for SLURM).
+
+        Returns:
+            int: the amount of memory, in bytes
+    """
+    mem = str(mem).strip().upper()
+    if mem.endswith('B'):
+        mem = mem[:-1]
+
+    unit = 'M'
+    if (len(mem) > 0) and (mem[-1] in memory_units):
+        unit = mem[-1]
+        mem = mem[:-1]
+
+    try:
+        return int(float(mem) * memory_units[unit])
+    except ValueError:
+        msg = "Could not parse the amount of memory: {}".format(mem)
+        raise ValueError(msg)
+
+
+def format_mem(mem):
+    """ This function formats an amount of memory (bytes) in gigabytes.
+    """
+    return "{:.1f}G".format(mem / memory_units['G'])
+
+
+job = collections.namedtuple('job', 'name,cmd,num_cpus,mem,dependencies,priority,order')
+
+
+class LocalScheduler(object):
+    """ This class runs the jobs added with add_job under the given budget,
+        see the module description.
+    """
+    def __init__(self, num_cpus, mem, poll_interval=default_poll_interval):
+        self.num_cpus = num_cpus
+        self.mem = mem
+        self.poll_interval = poll_interval
+        self.jobs = collections.OrderedDict()
+
+    def add_job(self, name, cmd, num_cpus=1, mem=0, dependencies=[], priority=0):
+        """ This function adds a job. Jobs which request more than the budget
+            are limited to the budget, so they run alone.
+
+            Args:
+                name (string): the (unique) name of the job
+
+                cmd (string): the command
+
+                num_cpus (int): the number of CPUs used by the job
+
+                mem (int): the memory (bytes) used by the job
+
+                dependencies (list of strings): the names of the (previously
+                    added) jobs which must finish before this job starts
+
+                priority (int): ready jobs with higher priority start first
+        """
+        if name in self.jobs:
+            msg = "A job with this name was already added: {}".format(name)
+            raise ValueError(msg)
+
+        missing = [d for d in dependencies if d not in self.jobs]
+        if len(missing) > 0:
+            msg = "The dependencies of {} were not added: {}".format(name, missing)
+            raise ValueError(msg)
+
+        num_cpus = min(num_cpus, self.num_cpus)
+        mem = min(mem, self.mem)
+
+        self.jobs[name] = job(name, cmd, num_cpus, mem, list(dependencies), priority,
+                              len(self.jobs))
+
+    def run(self):
+        """ This function runs all of the jobs, and waits for them to finish.
+
+            Raises:
+                subprocess.CalledProcessError: for the first failed job, once
+                    all of the other jobs have finished
+        """
+        pending = list(self.jobs.values())
+        running = {}
+        finished = set()
+        failed = collections.OrderedDict()
+        skipped = set()
+
+        free_cpus = self.num_cpus
+        free_mem = self.mem
+
+        while (len(pending) > 0) or (len(running) > 0):
+
+            # the jobs which depend on a failed (or skipped) job are not run
+            for j in list(pending):
+                if any((d in failed) or (d in skipped) for d in j.dependencies):
+                    msg = "Not running {}, because a job it depends on failed".format(j.name)
+                    logger.warning(msg)
+
+                    skipped.add(j.name)
+                    pending.remove(j)
+
+            ready = [j for j in pending if all(d in finished for d in j.dependencies)]
+            ready = sorted(ready, key=lambda j: (-j.priority, j.order))
+
+            for j in ready:
+                if (j.num_cpus > free_cpus) or (j.mem > free_mem):
+                    continue
+
+                msg = "Starting {} (CPUs: {}, memory: {}): {}".format(j.name, j.num_cpus,
+                                                                       format_mem(j.mem), j.cmd)
+                logger.info(msg)
+
+                running[j.name] = (j, subprocess.Popen(shlex.split(j.cmd)))
+                pending.remove(j)
+
+                free_cpus -= j.num_cpus
+                free_mem -= j.mem
+
+            if len(running) == 0:
+                # this cannot happen, since each job fits the budget and the
+                # dependencies were added before the jobs
+                if len(pending) > 0:
+                    msg = "Could not start any of the remaining jobs: {}".format(
+                        [j.name for j in pending])
+                    raise RuntimeError(msg)
+                break
+
+            time.sleep(self.poll_interval)
+
+            for name, (j, process) in list(running.items()):
+                ret = process.poll()
+                if ret is None:
+                    continue
+
+                del running[name]
+                free_cpus += j.num_cpus
+                free_mem += j.mem
+
+                if ret == 0:
+                    msg = "Finished {}".format(name)
+                    logger.info(msg)
+                    finished.add(name)
+                else:
+                    msg = "{} failed with exit code {}: {}".format(name, ret, j.cmd)
+                    logger.error(msg)
+                    failed[name] = (ret, j.cmd)
+
+        if len(failed) > 0:
+            msg = "Number of failed jobs: {}. Number of jobs not run: {}".format(len(failed),
+                                                                               len(skipped))
+            logger.error(msg)
+
+            ret, cmd = next(iter(failed.values()))
+            raise subprocess.CalledProcessError(ret, cmd)
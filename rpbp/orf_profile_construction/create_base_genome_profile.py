@@ -10,12 +10,8 @@ import logging
 import os
 import sys
 
-import yaml
-
 import pbio.ribo.ribo_filenames as filenames
 
-import pbio.utils.bam_utils as bam_utils
-import pbio.utils.fastx_utils as fastx_utils
 import pbio.utils.pgrm_utils as pgrm_utils
 import pbio.misc.logging_utils as logging_utils
 import pbio.misc.shell_utils as shell_utils
@@ -24,6 +20,8 @@ import pbio.misc.utils as utils
 from rpbp.defaults import default_num_cpus, default_mem, star_executable, \
     star_options, flexbar_options
 
+import rpbp.pipeline_runner as pipeline_runner
+
 logger = logging.getLogger(__name__)
 
 
@@ -64,7 +62,12 @@ def main():
     msg = "[create-base-genome-profile]: {}".format(' '.join(sys.argv))
     logger.info(msg)
 
-    config = yaml.load(open(args.config), Loader=yaml.FullLoader)
+    # the file checkers import pysam, so they are only imported once the
+    # arguments are parsed
+    import pbio.utils.bam_utils as bam_utils
+    import pbio.utils.fastx_utils as fastx_utils
+
+    config = pipeline_runner.load_config(args.config)
 
     # check that all of the necessary programs are callable
     programs = [
@@ -116,8 +119,8 @@ def main():
     file_checkers = {
         without_adapters: fastx_utils.check_fastq_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers, overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers, overwrite=args.overwrite, call=call)
 
     # Step 1: Running bowtie2 to remove rRNA alignments
 
@@ -144,9 +147,9 @@ def main():
     file_checkers = {
         without_rrna: fastx_utils.check_fastq_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers, overwrite=args.overwrite, call=call,
-                                   keep_delete_files=keep_delete_files, to_delete=to_delete)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers, overwrite=args.overwrite, call=call,
+                                       keep_delete_files=keep_delete_files, to_delete=to_delete)
 
     # Step 2: Running STAR to align rRNA-depleted reads to genome
 
@@ -194,9 +197,9 @@ def main():
     file_checkers = {
         genome_star_bam: bam_utils.check_bam_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers, overwrite=args.overwrite,
-                                   call=call, keep_delete_files=keep_delete_files, to_delete=to_delete)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers, overwrite=args.overwrite,
+                                       call=call, keep_delete_files=keep_delete_files, to_delete=to_delete)
     
     # now, we need to symlink the (genome) STAR output to that expected by the rest of the pipeline
     genome_sorted_bam = filenames.get_riboseq_bam(config['riboseq_data'],
@@ -238,9 +241,9 @@ def main():
     file_checkers = {
         unique_genome_filename: bam_utils.check_bam_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers, overwrite=args.overwrite,
-                                   call=call, keep_delete_files=keep_delete_files, to_delete=to_delete)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers, overwrite=args.overwrite,
+                                       call=call, keep_delete_files=keep_delete_files, to_delete=to_delete)
 
 
 if __name__ == '__main__':
@@ -16,7 +16,6 @@ import logging
 import sys
 import argparse
 import shlex
-import yaml
 
 
 import pbio.utils.pgrm_utils as pgrm_utils
@@ -24,12 +23,14 @@ import pbio.misc.logging_utils as logging_utils
 import pbio.misc.shell_utils as shell_utils
 import pbio.misc.utils as utils
 
-import pbio.ribo.ribo_utils as ribo_utils
 import pbio.ribo.ribo_filenames as filenames
 
 from rpbp.defaults import default_num_cpus, default_mem, star_executable, \
     metagene_options
 
+import rpbp.pipeline_runner as pipeline_runner
+import rpbp.run_manifest as run_manifest
+
 default_models_base = filenames.get_default_models_base()
 
 logger = logging.getLogger(__name__)
@@ -65,6 +66,10 @@ def main():
         This feature is implemented piecemeal. If the --do-not-call flag is given, 
         then nothing will be deleted.""", action='store_true')
 
+    parser.add_argument('--manifest', help="""The JSON run manifest, with the wall time,
+        CPU time, peak memory, I/O and output sizes of each step. If not given, this is
+        written to <riboseq_data>/manifests/<name>.create-orf-profiles.<time>.json.""", default=None)
+
     logging_utils.add_logging_options(parser)
     pgrm_utils.add_star_options(parser, star_executable)
     pgrm_utils.add_flexbar_options(parser)
@@ -74,7 +79,7 @@ def main():
     msg = "[create-orf-profiles]: {}".format(' '.join(sys.argv))
     logger.info(msg)
 
-    config = yaml.load(open(args.config), Loader=yaml.FullLoader)
+    config = pipeline_runner.load_config(args.config)
 
     # check that all of the necessary programs are callable
     programs = [
@@ -100,6 +105,12 @@ def main():
     ]
     utils.check_keys_exist(config, required_keys)
 
+    manifest = args.manifest
+    if manifest is None:
+        manifest = run_manifest.get_manifest_filename(config['riboseq_data'], args.name,
+                                                      'create-orf-profiles')
+    run_manifest.start_manifest('create-orf-profiles', args.name)
+
     note = config.get('note', None)
     models_base = config.get('models_base', default_models_base)
 
@@ -158,8 +169,8 @@ def main():
     in_files = []
     out_files = [riboseq_bam_filename]
     # we always call this, and pass --do-not-call through
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=True)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=True)
 
     # Extract the metagene profiles
 
@@ -207,9 +218,9 @@ def main():
     file_checkers = {
         metagene_profiles: utils.check_gzip_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers,
+                                       overwrite=args.overwrite, call=call)
 
     # estimate the periodicity for each offset for all read lengths
     metagene_profile_bayes_factors = filenames.get_metagene_profiles_bayes_factors(
@@ -268,9 +279,9 @@ def main():
     file_checkers = {
         metagene_profile_bayes_factors: utils.check_gzip_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers,
+                                       overwrite=args.overwrite, call=call)
     
     # select the best read lengths for constructing the signal
     periodic_offsets = filenames.get_periodic_offsets(config['riboseq_data'],
@@ -286,9 +297,12 @@ def main():
     file_checkers = {
         periodic_offsets: utils.check_gzip_file
     }
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       file_checkers=file_checkers,
+                                       overwrite=args.overwrite, call=call)
+
+    # ribo_utils imports pandas, so it is only imported when it is needed
+    import pbio.ribo.ribo_utils as ribo_utils
 
     # get the lengths and offsets which meet the required criteria from the config file
     lengths, offsets = ribo_utils.get_periodic_lengths_and_offsets(config,
@@ -302,6 +316,7 @@ def main():
                "min_metagene_profile_count, min_metagene_bf_mean, max_metagene_bf_var, "
                "and/or min_metagene_bf_likelihood. Quitting.")
         logger.critical(msg)
+        run_manifest.write_manifest(manifest)
         return
 
     lengths_str = ' '.join(lengths)
@@ -345,8 +360,10 @@ def main():
     out_files = [profiles_filename]
 
     # todo: implement a file checker for mtx files
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
+
+    run_manifest.write_manifest(manifest)
 
    
 if __name__ == '__main__':
@@ -22,6 +22,8 @@ import pbio.ribo.ribo_utils as ribo_utils
 
 from rpbp.defaults import default_num_groups
 
+import rpbp.pipeline_runner as pipeline_runner
+
 logger = logging.getLogger(__name__)
 
 # --num-exons is not used in the the Rp-Bp pipeline
@@ -147,12 +149,12 @@ def main():
     # we do not need the data frame anymore, so save some memory
     msg = "Reading exons"
     logger.info(msg)
-    exons = bed_utils.read_bed(args.exons)
+    exons = pipeline_runner.read_bed(args.exons)
 
     msg = "Reading ORFs"
     logger.info(msg)
 
-    orfs = bed_utils.read_bed(args.orfs)
+    orfs = pipeline_runner.read_bed(args.orfs)
 
     if len(args.seqname_prefix) > 0:
         orfs['seqname'] = args.seqname_prefix + orfs['seqname']
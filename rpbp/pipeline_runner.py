@@ -0,0 +1,382 @@
+""" Run the (python) steps of the pipeline in the calling process.
+
+By default, each step of the pipeline is a separate console script, which is
+called in a new process, so every step imports pandas, scipy, pystan, etc.,
+and reads the config and the (large) BED files again. Once enabled (see
+run-rpbp-pipeline --in-process), the steps which are python console scripts
+(of rpbp or pbio) are called in this process instead, with the same
+arguments. If the module of a step defines parse_arguments and run (e.g.,
+estimate-orf-bayes-factors and select-final-prediction-set), the arguments
+are parsed and passed to run, which reads the inputs and passes the parsed
+objects to the function which does the work; otherwise, the main function of
+its entry point is called. The CLIs are unchanged; they read the config, BED
+files and profiles with the functions below, which share the parsed objects
+between the steps while in-process calls are enabled, and simply read the
+files otherwise. Whether a step is skipped because its outputs exist is
+decided by shell_utils.call_if_not_exists, as for the other steps.
+
+The time spent importing each step and the reads served from the shared
+objects (with the time the original read took) are recorded, see
+log_report. All steps, whether they are called in-process or not, are also
+recorded in the run manifest of the running driver, see run_manifest.
+"""
+
+import collections
+import copy
+import importlib
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import yaml
+
+import pbio.misc.shell_utils as shell_utils
+
+import rpbp.run_manifest as run_manifest
+
+logger = logging.getLogger(__name__)
+
+# only the console scripts from these packages are called in-process
+in_process_packages = ('rpbp', 'pbio')
+
+# whether the steps are called in-process
+is_enabled = False
+
+# the parsed objects, keyed by (kind, key); each is stored with the
+# signature of its files and the time it took to read them
+shared_objects = {}
+shared_object = collections.namedtuple('shared_object', 'signature,value,read_time')
+
+# the entry points (main functions, or parse_arguments and run) of the console
+# scripts, and the time it took to import the module of each one
+entry_points = {}
+step_functions = collections.namedtuple('step_functions', 'parse_arguments,run')
+import_times = {}
+
+# the record of each in-process call, and the stack of running calls, to
+# which the reads from the shared objects are charged
+step_records = []
+running_steps = []
+
+
+def enable():
+    """ This function enables in-process calls for the rest of the process.
+    """
+    global is_enabled
+    is_enabled = True
+
+
+def get_signature(filenames):
+    """ This function identifies the current version of the files by their
+        modification time and size.
+    """
+    signature = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        signature.append((os.path.abspath(filename), stat.st_mtime_ns, stat.st_size))
+
+    return tuple(signature)
+
+
+def get_shared_object(kind, filenames, read):
+    """ This function gives the object parsed from the files by read. If
+        in-process calls are enabled, the object is kept, and it is reused
+        while the files are unchanged.
+
+        Args:
+            kind (string): the kind of object, e.g., 'bed'
+
+            filenames (list of strings): the files from which it is read
+
+            read (function): reads the object
+
+        Returns:
+            object: the (shared) object
+    """
+    if not is_enabled:
+        return read()
+
+    signature = get_signature(filenames)
+    key = (kind, tuple(s[0] for s in signature))
+
+    obj = shared_objects.get(key)
+    if (obj is not None) and (obj.signature == signature):
+        msg = "Using the shared {}: {}".format(kind, ' '.join(filenames))
+        logger.info(msg)
+
+        if len(running_steps) > 0:
+            running_steps[-1]['shared_reads'] += 1
+            running_steps[-1]['read_time_saved'] += obj.read_time
+
+        return obj.value
+
+    start_time = time.perf_counter()
+    value = read()
+    shared_objects[key] = shared_object(signature, value, time.perf_counter() - start_time)
+
+    return value
+
+
+def release(kind):
+    """ This function drops the shared objects of the given kind, e.g., when
+        the steps which use them are finished.
+    """
+    for key in [key for key in shared_objects if key[0] == kind]:
+        del shared_objects[key]
+
+
+def load_config(config_file):
+    """ This function reads the (yaml) config file.
+
+        Returns:
+            dict: the config, which the caller may modify
+    """
+    def read():
+        with open(config_file) as f:
+            return yaml.load(f, Loader=yaml.FullLoader)
+
+    config = get_shared_object('config', [config_file], read)
+
+    if is_enabled:
+        config = copy.deepcopy(config)
+
+    return config
+
+
+def read_bed(filename):
+    """ This function reads the BED file with bed_utils.read_bed.
+
+        Returns:
+            pd.DataFrame: the features, which the caller may modify
+    """
+    # pandas is only imported by the steps which read BED files
+    import pbio.utils.bed_utils as bed_utils
+
+    bed = get_shared_object('bed', [filename], lambda: bed_utils.read_bed(filename))
+
+    if is_enabled:
+        bed = bed.copy()
+
+    return bed
+
+
+def read_profiles(profile_files, num_cpus=1, release_after=False):
+    """ This function reads (and adds) the profile files, see
+        merge_replicate_orf_profiles.read_merged_profiles. The profiles are
+        large, so the shared copy is dropped with release_after, e.g., by the
+        last step which uses them.
+
+        Returns:
+            scipy.sparse.csr_matrix: the profiles, which the caller must not
+                modify
+    """
+    import rpbp.translation_prediction.merge_replicate_orf_profiles as merge_replicate_orf_profiles
+
+    profiles = get_shared_object('profiles', profile_files,
+                                 lambda: merge_replicate_orf_profiles.read_merged_profiles(
+                                     profile_files, num_cpus))
+
+    if release_after:
+        release('profiles')
+
+    return profiles
+
+
+def get_entry_point(program):
+    """ This function finds the main function of the console script, if it
+        can be called in-process, or its parse_arguments and run functions,
+        if its module defines them.
+
+        Returns:
+            function or step_functions: the entry point, or None
+    """
+    if program in entry_points:
+        return entry_points[program]
+
+    try:
+        import pkg_resources
+        console_scripts = list(pkg_resources.iter_entry_points('console_scripts', name=program))
+    except ImportError:
+        console_scripts = []
+
+    entry_point = None
+    for console_script in console_scripts:
+        if console_script.module_name.split('.')[0] not in in_process_packages:
+            continue
+
+        start_time = time.perf_counter()
+        module = importlib.import_module(console_script.module_name)
+        import_times[program] = time.perf_counter() - start_time
+
+        entry_point = module
+        for attr in console_script.attrs:
+            entry_point = getattr(entry_point, attr)
+
+        if hasattr(module, 'parse_arguments') and hasattr(module, 'run'):
+            entry_point = step_functions(module.parse_arguments, module.run)
+        break
+
+    entry_points[program] = entry_point
+    return entry_point
+
+
+def run_step(cmd, entry_point):
+    """ This function calls the console script with the arguments in cmd, as
+        if it were called from the command line: the run function with the
+        parsed arguments, or the main function, see get_entry_point.
+
+        Raises:
+            subprocess.CalledProcessError: if the script exits with an error
+    """
+    argv = shlex.split(cmd)
+
+    record = {
+        'program': argv[0],
+        'run_time': 0,
+        'shared_reads': 0,
+        'read_time_saved': 0
+    }
+    step_records.append(record)
+    running_steps.append(record)
+
+    msg = "Calling in-process: {}".format(cmd)
+    logger.info(msg)
+
+    # each script sets up its own logging, so its handlers are removed again
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    saved_argv = sys.argv
+
+    start_time = time.perf_counter()
+    try:
+        if isinstance(entry_point, step_functions):
+            args = entry_point.parse_arguments(argv[1:])
+            entry_point.run(args)
+        else:
+            sys.argv = argv
+            entry_point()
+    except SystemExit as e:
+        if e.code not in [None, 0]:
+            ret = e.code if isinstance(e.code, int) else 1
+            raise subprocess.CalledProcessError(ret, cmd)
+    finally:
+        sys.argv = saved_argv
+        record['run_time'] = time.perf_counter() - start_time
+        running_steps.pop()
+
+        for handler in list(root_logger.handlers):
+            if handler not in handlers:
+                root_logger.removeHandler(handler)
+                handler.close()
+
+
+def get_in_process_entry_point(cmd):
+    """ This function gives the entry point to call for cmd (see
+        get_entry_point), or None if it must be called in a new process.
+    """
+    if not is_enabled:
+        return None
+
+    program = shlex.split(cmd)[0]
+    return get_entry_point(program)
+
+
+def check_call(cmd, call=True, manifest=None):
+    """ This function calls cmd, in-process if possible, as
+        shell_utils.check_call. If cmd runs a driver which writes the given
+        manifest, it is included in the record of the step.
+    """
+    def run():
+        entry_point = get_in_process_entry_point(cmd)
+        if entry_point is None:
+            return run_manifest.check_call(cmd, call=call)
+
+        if not call:
+            logger.info(cmd)
+            return
+
+        run_step(cmd, entry_point)
+
+    return run_manifest.record_step(cmd, [], run, call=call, child_manifest=manifest)
+
+
+def call_if_not_exists(cmd, out_files, in_files=[], file_checkers={}, overwrite=False,
+                       call=True, keep_delete_files=False, to_delete=[]):
+    """ This function calls cmd, in-process if possible, unless the output
+        files already exist, with shell_utils.call_if_not_exists.
+    """
+    def run():
+        entry_point = get_in_process_entry_point(cmd)
+
+        # shell_utils.call_if_not_exists still decides whether the step is
+        # called (and removes to_delete); only the call itself, through
+        # shell_utils.check_call, is replaced: by the in-process call, or by
+        # run_manifest.check_call, which records the peak memory of the child
+        def check_call_in_process(step_cmd, call=True, **kwargs):
+            if not call:
+                logger.info(step_cmd)
+                return 0
+
+            run_step(step_cmd, entry_point)
+            return 0
+
+        step_check_call = run_manifest.check_call
+        if entry_point is not None:
+            step_check_call = check_call_in_process
+
+        shell_check_call = shell_utils.check_call
+        shell_utils.check_call = step_check_call
+        try:
+            return shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                                  file_checkers=file_checkers,
+                                                  overwrite=overwrite, call=call,
+                                                  keep_delete_files=keep_delete_files,
+                                                  to_delete=to_delete)
+        finally:
+            shell_utils.check_call = shell_check_call
+
+    return run_manifest.record_step(cmd, out_files, run, call=call)
+
+
+def log_report():
+    """ This function logs, for each program called in-process, the time it
+        took, the time to import it (which every call would spend starting
+        a new process, so this is a lower bound on the startup time saved),
+        and the reads served from the shared objects, with the time the
+        original reads took.
+    """
+    if len(step_records) == 0:
+        return
+
+    programs = collections.OrderedDict()
+    for record in step_records:
+        program = programs.setdefault(record['program'], collections.Counter())
+        program['calls'] += 1
+        program['run_time'] += record['run_time']
+        program['shared_reads'] += record['shared_reads']
+        program['read_time_saved'] += record['read_time_saved']
+
+    total_startup_saved = 0
+    total_read_time_saved = 0
+
+    msg = "In-process calls (times in seconds):"
+    logger.info(msg)
+
+    for program, totals in programs.items():
+        startup_saved = totals['calls'] * import_times.get(program, 0)
+
+        msg = ("{}: calls: {}, run time: {:.1f}, startup saved: {:.1f}, shared reads: {}, "
+               "I/O saved: {:.1f}".format(program, totals['calls'], totals['run_time'],
+                                           startup_saved, totals['shared_reads'],
+                                           totals['read_time_saved']))
+        logger.info(msg)
+
+        total_startup_saved += startup_saved
+        total_read_time_saved += totals['read_time_saved']
+
+    msg = "Total startup time saved: {:.1f}. Total I/O time saved: {:.1f}".format(
+        total_startup_saved, total_read_time_saved)
+    logger.info(msg)
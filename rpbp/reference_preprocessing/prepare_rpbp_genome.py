@@ -10,7 +10,6 @@ Calls:
 
 import os
 import sys
-import yaml
 import argparse
 import logging
 
@@ -19,7 +18,6 @@ import pbio.misc.shell_utils as shell_utils
 import pbio.misc.slurm as slurm
 import pbio.misc.utils as utils
 
-import pbio.utils.bed_utils as bed_utils
 import pbio.utils.pgrm_utils as pgrm_utils
 
 import pbio.ribo.ribo_filenames as filenames
@@ -27,6 +25,9 @@ import pbio.ribo.ribo_filenames as filenames
 from rpbp.defaults import default_num_cpus, default_mem, star_executable, \
     default_start_codons, default_stop_codons
 
+import rpbp.pipeline_runner as pipeline_runner
+import rpbp.run_manifest as run_manifest
+
 logger = logging.getLogger(__name__)
 
 
@@ -55,8 +56,8 @@ def get_orfs(gtf, args, config, is_annotated=False, is_de_novo=False):
                                                 logging_str))
     in_files = [gtf]
     out_files = [transcript_bed]
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
     # extract the transcript fasta
     transcript_fasta = filenames.get_transcript_fasta(config['genome_base_path'],
@@ -70,8 +71,8 @@ def get_orfs(gtf, args, config, is_annotated=False, is_de_novo=False):
                                                       logging_str))
     in_files = [transcript_bed, config['fasta']]
     out_files = [transcript_fasta]
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
     # extract ORFs from the transcripts using genomic coordinates
     orfs_genomic = filenames.get_orfs(config['genome_base_path'],
@@ -97,8 +98,8 @@ def get_orfs(gtf, args, config, is_annotated=False, is_de_novo=False):
                                                                 logging_str)
     in_files = [transcript_fasta, transcript_bed]
     out_files = [orfs_genomic]
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
     # write the ORF exons, used to label the ORFs
     exons_file = filenames.get_exons(config['genome_base_path'],
@@ -113,8 +114,8 @@ def get_orfs(gtf, args, config, is_annotated=False, is_de_novo=False):
                                                               logging_str))
     in_files = [orfs_genomic]
     out_files = [exons_file]
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
     # label the ORFs
     labeled_orfs = filenames.get_labels(config['genome_base_path'],
@@ -144,8 +145,8 @@ def get_orfs(gtf, args, config, is_annotated=False, is_de_novo=False):
     in_files = [annotated_bed, orfs_genomic, exons_file]
     #  ** this function overwrites the input file `orfs_genomic`
     out_files = [labeled_orfs]
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
 
 def main():
@@ -159,13 +160,18 @@ def main():
     parser.add_argument('--overwrite', help='''If this flag is present, existing files
         will be overwritten.''', action='store_true')
 
+    parser.add_argument('--manifest', help="""The JSON run manifest, with the wall time,
+        CPU time, peak memory, I/O and output sizes of each step. If not given, this is
+        written to <genome_base_path>/manifests/<genome_name>.prepare-rpbp-genome.<time>.json.""",
+                        default=None)
+
     slurm.add_sbatch_options(parser, num_cpus=default_num_cpus, mem=default_mem)
     logging_utils.add_logging_options(parser)
     pgrm_utils.add_star_options(parser, star_executable)
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
-    config = yaml.load(open(args.config), Loader=yaml.FullLoader)
+    config = pipeline_runner.load_config(args.config)
 
     # check required callable programs, config keys and files
     programs = ['extract-orf-coordinates',
@@ -198,6 +204,13 @@ def main():
         slurm.check_sbatch(cmd, args=args)
         return
 
+    manifest = args.manifest
+    if manifest is None:
+        manifest = run_manifest.get_manifest_filename(config['genome_base_path'],
+                                                      config['genome_name'],
+                                                      'prepare-rpbp-genome')
+    run_manifest.start_manifest('prepare-rpbp-genome', config['genome_name'])
+
     call = not args.do_not_call
 
     # the rRNA index
@@ -206,8 +219,8 @@ def main():
 
     in_files = [config['ribosomal_fasta']]
     out_files = pgrm_utils.get_bowtie2_index_files(config['ribosomal_index'])
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
     # the STAR index
     mem = utils.human2bytes(args.mem)
@@ -220,8 +233,8 @@ def main():
 
     in_files = [config['fasta']]
     out_files = pgrm_utils.get_star_index_files(config['star_index'])
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   overwrite=args.overwrite, call=call)
+    pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                       overwrite=args.overwrite, call=call)
 
     # get the ORFs
     get_orfs(config['gtf'], args, config, is_annotated=True, is_de_novo=False)
@@ -263,6 +276,9 @@ def main():
 
     # now, check if we have a de novo assembly
     if 'de_novo_gtf' in config:
+        # bed_utils imports pandas, so it is only imported when it is needed
+        import pbio.utils.bed_utils as bed_utils
+
         get_orfs(config['de_novo_gtf'], args, config, is_annotated=False, is_de_novo=True)
 
         # we need to concat the ORF and exon files
@@ -338,8 +354,8 @@ def main():
             cmd = ("awk '!/^#/' {} {} > {}".format(config['gtf'], config['de_novo_gtf'], gtf_file))
             in_files = [config['gtf'], config['de_novo_gtf']]
             out_files = [gtf_file]
-            shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                           overwrite=args.overwrite, call=call)
+            pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                               overwrite=args.overwrite, call=call)
         else:
             msg = ("Skipping concatenation due to mismatch in format specifications (GTF2/GFF3)"
                    "for reference and do novo annotations. Symlink to reference annotations created.")
@@ -362,6 +378,8 @@ def main():
         if os.path.exists(config['gtf']):
             shell_utils.create_symlink(config['gtf'], gtf_file, call)
 
+    run_manifest.write_manifest(manifest)
+
 
 if __name__ == '__main__':
     main()
@@ -14,13 +14,71 @@ import pbio.misc.shell_utils as shell_utils
 import pbio.misc.slurm as slurm
 import pbio.misc.utils as utils
 
-import pbio.ribo.ribo_utils as ribo_utils
+from rpbp.defaults import default_num_cpus, default_mem, star_executable, \
+    local_job_resources
 
-from rpbp.defaults import default_num_cpus, default_mem, star_executable
+import rpbp.local_scheduler as local_scheduler
+import rpbp.run_manifest as run_manifest
 
 logger = logging.getLogger(__name__)
 
 
+def get_job_resources(step, args):
+    """ This function gives the number of CPUs and the memory (bytes) which
+        a local job of the given step requests, see local_job_resources.
+    """
+    resources = local_job_resources[step]
+    num_cpus = max(1, int(round(resources['num_cpus'] * args.num_cpus)))
+    mem = int(resources['mem'] * local_scheduler.parse_mem(args.mem))
+    return num_cpus, mem
+
+
+def add_prediction_jobs(scheduler, job_name, predict_cmd, dependencies, args, manifest=None):
+    """ This function adds the local jobs which predict the translated ORFs of
+        a sample (or condition): the estimation of the Bayes factors, and then
+        the selection of the predictions, each with the resources of its step.
+
+        Args:
+            scheduler (local_scheduler.LocalScheduler): the scheduler
+
+            job_name (string): the name of the sample (or condition) in the
+                names of the jobs
+
+            predict_cmd (string): the call of predict-translated-orfs, without
+                --num-cpus
+
+            dependencies (list of strings): the jobs which create the profiles
+
+            args (namespace): the options of run-all-rpbp-instances
+
+            manifest (string): if given, the manifest of the run of the sample,
+                whose child manifests (see run_manifest.get_child_manifest_filename)
+                are written by the jobs, as with run-rpbp-pipeline
+
+        Returns:
+            None, but the jobs are added to the scheduler
+    """
+    bayes_factors_job = "bayes factors: {}".format(job_name)
+
+    steps = [
+        ('bayes_factors', bayes_factors_job, "--bayes-factors-only", dependencies),
+        ('predictions', "predictions: {}".format(job_name), "--predictions-only",
+         [bayes_factors_job])
+    ]
+
+    for step, step_job, step_str, step_dependencies in steps:
+        num_cpus, mem = get_job_resources(step, args)
+
+        cmd = "{} {} --num-cpus {}".format(predict_cmd, step_str, num_cpus)
+        if manifest is not None:
+            program = "predict-translated-orfs.{}".format(step.replace('_', '-'))
+            cmd = "{} --manifest {}".format(cmd, run_manifest.get_child_manifest_filename(
+                manifest, program))
+
+        scheduler.add_job(step_job, cmd, num_cpus=num_cpus, mem=mem,
+                          dependencies=step_dependencies, priority=1)
+
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      description="""This is a helper script to submit a set of
@@ -49,11 +107,25 @@ def main():
         samples will be run. This flag has no effect if --merge-replicates is not
         given.""", action='store_true')
          
+    parser.add_argument('--in-process', help="""If this flag is present, then the python
+        steps of the pipeline for each sample (or condition) are called in one process,
+        see run-rpbp-pipeline.""", action='store_true')
+
     parser.add_argument('-k', '--keep-intermediate-files', help="""If this flag is given,
         then all intermediate files will be kept; otherwise, they will be
         deleted. This feature is implemented piecemeal. If the --do-not-call flag
         is given, then nothing will be deleted.""", action='store_true')
 
+    parser.add_argument('--total-cpus', help="""Without SLURM, the samples are run as
+        local processes, as many at once as this number of CPUs allows. The profiles
+        and the predictions of each sample are separate jobs, which request --num-cpus
+        CPUs and (a fraction of) --mem. If not given, this is --num-cpus, so the jobs
+        run one after the other.""", type=int, default=None)
+
+    parser.add_argument('--total-mem', help="""Without SLURM, the amount of memory
+        shared by the local jobs (see --total-cpus), e.g., 64G. If not given, this is
+        --mem.""", default=None)
+
     slurm.add_sbatch_options(parser, num_cpus=default_num_cpus, mem=default_mem)
     logging_utils.add_logging_options(parser)
     pgrm_utils.add_star_options(parser, star_executable)
@@ -117,6 +189,10 @@ def main():
     if args.keep_intermediate_files:
         keep_intermediate_str = "--keep-intermediate-files"
 
+    in_process_str = ""
+    if args.in_process:
+        in_process_str = "--in-process"
+
     # check if we only want to create the profiles, in this case
     # we call run-rpbp-pipeline with the --profiles-only option
     profiles_only_str = ""
@@ -138,10 +214,29 @@ def main():
                "option. It will be ignored.")
         logger.warning(msg)
 
+    # ribo_utils imports pandas, so it is only imported when it is needed
+    import pbio.ribo.ribo_utils as ribo_utils
+
     # collect the job_ids in case we are using slurm and need to merge replicates
     rep_to_condition = ribo_utils.get_riboseq_replicates_reverse_map(config)
     job_ids_mapping = defaultdict(list)
 
+    # without slurm, the jobs are run by a local scheduler. The profiles and
+    # the predictions of each sample are separate jobs, so that they request
+    # the resources of each phase, and the predictions for the replicates
+    # start as soon as their profiles are created
+    scheduler = None
+    if not args.use_slurm:
+        total_cpus = args.total_cpus
+        if total_cpus is None:
+            total_cpus = args.num_cpus
+
+        total_mem = args.total_mem
+        if total_mem is None:
+            total_mem = args.mem
+
+        scheduler = local_scheduler.LocalScheduler(total_cpus, local_scheduler.parse_mem(total_mem))
+
     sample_names = sorted(config['riboseq_samples'].keys())
 
     for sample_name in sample_names:
@@ -152,7 +247,19 @@ def main():
             tmp = os.path.join(args.tmp, "{}_rpbp".format(sample_name))
             tmp_str = "--tmp {}".format(tmp)
 
-        cmd = "run-rpbp-pipeline {} {} {} --num-cpus {} {} {} {} {} {} {} {} {} {}".format(
+        # the local jobs are scheduled separately, and they write their
+        # manifests next to that of the run of the sample
+        sample_profiles_only_str = profiles_only_str
+        sample_manifest = None
+        manifest_str = ""
+        if scheduler is not None:
+            sample_profiles_only_str = "--profiles-only"
+            sample_manifest = run_manifest.get_manifest_filename(config['riboseq_data'],
+                                                                 sample_name,
+                                                                 'run-rpbp-pipeline')
+            manifest_str = "--manifest {}".format(sample_manifest)
+
+        cmd = "run-rpbp-pipeline {} {} {} --num-cpus {} {} {} {} {} {} {} {} {} {} {} {}".format(
             data, 
             args.config, 
             sample_name, 
@@ -161,18 +268,46 @@ def main():
             tmp_str, 
             do_not_call_str, 
             overwrite_str,
-            profiles_only_str,
+            sample_profiles_only_str,
             keep_intermediate_str,
+            in_process_str,
+            manifest_str,
             logging_str, 
             star_str,
             flexbar_str
         )
 
-        job_id = slurm.check_sbatch(cmd, args=args)
-        job_ids_mapping[rep_to_condition[sample_name]].append(job_id)
+        if scheduler is None:
+            job_id = slurm.check_sbatch(cmd, args=args)
+            job_ids_mapping[rep_to_condition[sample_name]].append(job_id)
+            continue
+
+        profiles_job = "profiles: {}".format(sample_name)
+        num_cpus, mem = get_job_resources('profiles', args)
+        scheduler.add_job(profiles_job, cmd, num_cpus=num_cpus, mem=mem)
+        job_ids_mapping[rep_to_condition[sample_name]].append(profiles_job)
+
+        # the predictions are made for each sample unless the profiles are
+        # only created for the merged replicates
+        if len(profiles_only_str) > 0:
+            continue
+
+        cmd = "predict-translated-orfs {} {} {} {} {} {}".format(
+            args.config,
+            sample_name,
+            do_not_call_str,
+            overwrite_str,
+            logging_str,
+            in_process_str
+        )
+
+        add_prediction_jobs(scheduler, sample_name, cmd, [profiles_job], args,
+                            manifest=sample_manifest)
 
     # now, if we are running the "standard" pipeline, we are done
     if not args.merge_replicates:
+        if scheduler is not None:
+            scheduler.run()
         return
 
     # otherwise, we need to merge the replicates for each condition
@@ -182,18 +317,27 @@ def main():
     for condition_name in sorted(riboseq_replicates.keys()):
     
         # then we predict the ORFs
-        cmd = "predict-translated-orfs {} {} --num-cpus {} {} {} {} {}".format(
+        cmd = "predict-translated-orfs {} {} {} {} {} {} {}".format(
             args.config, 
             condition_name, 
-            args.num_cpus, 
             do_not_call_str, 
             overwrite_str, 
             logging_str, 
-            merge_replicates_str
+            merge_replicates_str,
+            in_process_str
         )
 
         job_ids = job_ids_mapping[condition_name]
-        slurm.check_sbatch(cmd, args=args, dependencies=job_ids)
+
+        if scheduler is None:
+            cmd = "{} --num-cpus {}".format(cmd, args.num_cpus)
+            slurm.check_sbatch(cmd, args=args, dependencies=job_ids)
+            continue
+
+        add_prediction_jobs(scheduler, "{} (merged)".format(condition_name), cmd, job_ids, args)
+
+    if scheduler is not None:
+        scheduler.run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+""" Machine-readable records (JSON run manifests) of the runs of the drivers
+of the pipeline (prepare-rpbp-genome, run-rpbp-pipeline, create-orf-profiles
+and predict-translated-orfs).
+
+A driver starts its manifest with start_manifest, and writes it at the end
+with write_manifest. In between, each step called through pipeline_runner is
+recorded with its wall time, CPU time, peak resident memory, I/O volume and
+the size of its output files. The CPU time and I/O include those of the
+child processes (from resource.getrusage and /proc/self/io, which counts the
+I/O of the waited-for children). The peak memory of a step is the largest
+of its (in-process) peak, if the kernel allows resetting the peak (Linux
+/proc/self/clear_refs), and the peaks of the child processes it called. The
+peak of each child (with its own children) is taken from os.wait4, see wait
+and check_call; for other children, e.g., the workers of an in-process step,
+only the peak of all children so far (RUSAGE_CHILDREN) is known, which is
+used if it increased during the step. If no peak is known, it is null. If a
+step is itself a driver, its manifest is included in the step.
+
+Please see compare-run-manifests to compare the manifests of different runs.
+"""
+
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# the manifests of the running drivers; the steps are added to the last one
+manifests = []
+
+# the peak resident memory of the children waited for during each running
+# step (including the steps of in-process drivers)
+running_steps = []
+
+io_fields = ['rchar', 'wchar', 'read_bytes', 'write_bytes']
+
+
+def get_manifest_filename(base_path, name, program):
+    """ This function constructs the default name of the manifest of a run,
+        which includes the time at which the run started.
+    """
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    filename = "{}.{}.{}.json".format(name, program, timestamp)
+    return os.path.join(base_path, 'manifests', filename)
+
+
+def get_child_manifest_filename(manifest, program):
+    """ This function constructs the name of the manifest of a driver called
+        by the driver with the given manifest.
+    """
+    base, ext = os.path.splitext(manifest)
+    return "{}.{}{}".format(base, program, ext)
+
+
+def read_proc_io():
+    """ This function reads the I/O counters of this process (and its waited-for
+        children) from /proc/self/io.
+
+        Returns:
+            dict: the counters, or None if they are not available
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+        return {field: int(counters[field]) for field in io_fields}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    """ This function resets the peak resident memory (VmHWM) of this process.
+
+        Returns:
+            bool: whether the peak could be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss():
+    """ This function gives the peak resident memory (bytes) of this process
+        since it was last reset, or None if it is not available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_rss_unit():
+    """ This function gives the unit (bytes) of ru_maxrss: kilobytes on Linux,
+        but bytes on macOS.
+    """
+    return 1 if sys.platform.startswith('darwin') else 1024
+
+
+def wait(process):
+    """ This function waits for the child process (subprocess.Popen), as
+        process.wait, and adds its peak resident memory, with that of its
+        own children, to the running steps.
+
+        Returns:
+            int: the return code of the process
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait()
+
+    _, status, usage = os.wait4(process.pid, 0)
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    peak_rss = usage.ru_maxrss * get_rss_unit()
+    for step in running_steps:
+        step['children_peak_rss'] = max(step['children_peak_rss'] or 0, peak_rss)
+
+    return process.returncode
+
+
+def check_call(cmd, call=True, raise_on_error=True):
+    """ This function calls cmd in a shell, as shell_utils.check_call, and
+        waits for it with wait, so its peak memory is recorded with the
+        running steps.
+
+        Returns:
+            int: the return code of cmd
+
+        Raises:
+            subprocess.CalledProcessError: if cmd exits with an error and
+                raise_on_error is True
+    """
+    logger.info(cmd)
+
+    if not call:
+        return 0
+
+    ret = wait(subprocess.Popen(cmd, shell=True))
+    if (ret != 0) and raise_on_error:
+        raise subprocess.CalledProcessError(ret, cmd)
+
+    return ret
+
+
+def get_usage():
+    """ This function takes a snapshot of the (cumulative) resource usage of
+        this process and its children.
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = (self_usage.ru_utime + self_usage.ru_stime +
+                children_usage.ru_utime + children_usage.ru_stime)
+
+    usage = {
+        'time': time.perf_counter(),
+        'cpu_time': cpu_time,
+        'children_max_rss': children_usage.ru_maxrss * get_rss_unit(),
+        'io': read_proc_io()
+    }
+    return usage
+
+
+def get_usage_record(before, after, is_peak_reset, children_peak_rss=None):
+    """ This function gives the wall time, CPU time, peak memory and I/O
+        between two snapshots from get_usage. children_peak_rss is the peak
+        of the children waited for in between, if any, see wait.
+    """
+    peaks = [children_peak_rss]
+    if is_peak_reset:
+        peaks.append(get_peak_rss())
+
+    # the peak of all children so far only belongs to this step if it grew
+    if after['children_max_rss'] > before['children_max_rss']:
+        peaks.append(after['children_max_rss'])
+
+    peaks = [p for p in peaks if p is not None]
+
+    record = {
+        'wall_time': after['time'] - before['time'],
+        'cpu_time': after['cpu_time'] - before['cpu_time'],
+        'peak_rss': max(peaks) if len(peaks) > 0 else None
+    }
+
+    for field in io_fields:
+        record[field] = None
+        if (before['io'] is not None) and (after['io'] is not None):
+            record[field] = after['io'][field] - before['io'][field]
+
+    return record
+
+
+def get_mtime(filename):
+    """ This function gives the modification time of the file, or None.
+    """
+    if os.path.exists(filename):
+        return os.path.getmtime(filename)
+    return None
+
+
+def start_manifest(program, name):
+    """ This function starts recording the steps of a driver.
+
+        Args:
+            program (string): the name of the driver
+
+            name (string): the name of the sample, condition or genome
+    """
+    manifest = {
+        'program': program,
+        'name': name,
+        'argv': list(sys.argv),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'start_time': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'steps': [],
+        'usage_before': get_usage(),
+        'is_peak_reset': reset_peak_rss()
+    }
+    manifests.append(manifest)
+
+
+def record_step(cmd, out_files, run, call=True, child_manifest=None):
+    """ This function calls run, and adds the record of the step to the
+        manifest of the running driver, if any.
+
+        Args:
+            cmd (string): the command of the step
+
+            out_files (list of strings): the output files of the step
+
+            run (function): calls the step
+
+            call (bool): whether the step is actually called
+
+            child_manifest (string): the manifest written by the step, if it
+                is also a driver
+    """
+    if len(manifests) == 0:
+        return run()
+
+    manifest = manifests[-1]
+
+    mtimes = [get_mtime(out_file) for out_file in out_files]
+    is_peak_reset = reset_peak_rss()
+    before = get_usage()
+
+    running_step = {'children_peak_rss': None}
+    running_steps.append(running_step)
+
+    status = 'failed'
+    try:
+        ret = run()
+        status = 'completed'
+        return ret
+    finally:
+        after = get_usage()
+        running_steps.remove(running_step)
+
+        # the manifests of in-process drivers which failed are dropped
+        while manifests[-1] is not manifest:
+            manifests.pop()
+
+        # the step was skipped if all of its outputs already existed and
+        # were not changed
+        is_skipped = (len(out_files) > 0) and all(
+            (mtime is not None) and (mtime == get_mtime(out_file))
+            for mtime, out_file in zip(mtimes, out_files))
+
+        step = {
+            'program': os.path.basename(cmd.split()[0]),
+            'cmd': cmd,
+            'status': status,
+            'called': call,
+            'skipped': is_skipped
+        }
+        step.update(get_usage_record(before, after, is_peak_reset,
+                                     running_step['children_peak_rss']))
+
+        step['outputs'] = {
+            out_file: os.path.getsize(out_file) for out_file in out_files
+            if os.path.exists(out_file)
+        }
+        step['output_bytes'] = sum(step['outputs'].values())
+
+        if (child_manifest is not None) and os.path.exists(child_manifest):
+            with open(child_manifest) as f:
+                step['manifest'] = json.load(f)
+
+        manifest['steps'].append(step)
+
+
+def write_manifest(filename):
+    """ This function completes the manifest of the running driver, with its
+        total resource usage, and writes it.
+    """
+    manifest = manifests.pop()
+
+    before = manifest.pop('usage_before')
+    is_peak_reset = manifest.pop('is_peak_reset')
+    total = get_usage_record(before, get_usage(), is_peak_reset)
+
+    # the peaks of the steps were reset in the meantime
+    step_peaks = [s['peak_rss'] for s in manifest['steps'] if s['peak_rss'] is not None]
+    if total['peak_rss'] is not None:
+        step_peaks.append(total['peak_rss'])
+
+    total['peak_rss'] = max(step_peaks) if len(step_peaks) > 0 else None
+    manifest['total'] = total
+    manifest['end_time'] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+
+    dirname = os.path.dirname(filename)
+    if len(dirname) > 0:
+        os.makedirs(dirname, exist_ok=True)
+
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    msg = "Wrote the run manifest: {}".format(filename)
+    logger.info(msg)
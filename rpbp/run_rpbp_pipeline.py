@@ -12,8 +12,6 @@ import logging
 import shlex
 import sys
 
-import yaml
-
 import pbio.utils.pgrm_utils as pgrm_utils
 import pbio.misc.logging_utils as logging_utils
 import pbio.misc.shell_utils as shell_utils
@@ -22,6 +20,9 @@ import pbio.misc.utils as utils
 
 from rpbp.defaults import default_num_cpus, default_mem, star_executable
 
+import rpbp.pipeline_runner as pipeline_runner
+import rpbp.run_manifest as run_manifest
+
 logger = logging.getLogger(__name__)
 
 
@@ -45,11 +46,22 @@ def main():
     parser.add_argument('--profiles-only', help="""If this flag is present, then only 
         the ORF profiles will be created""", action='store_true')
          
+    parser.add_argument('--in-process', help="""If this flag is present, then the python
+        steps of the pipeline (e.g., create-orf-profiles, estimate-orf-bayes-factors) are
+        called in this process rather than in new processes, and they share the config,
+        ORFs, exons and profiles once they are read. The time saved is logged at the end.""",
+                        action='store_true')
+
     parser.add_argument('-k', '--keep-intermediate-files', help="""If this flag is given,
         then all intermediate files will be kept; otherwise, they will be
         deleted. This feature is implemented piecemeal. If the --do-not-call flag
         is given, then nothing will be deleted.""", action='store_true')
 
+    parser.add_argument('--manifest', help="""The JSON run manifest, with the wall time,
+        CPU time, peak memory, I/O and output sizes of each step, including the manifests
+        of create-orf-profiles and predict-translated-orfs. If not given, this is written
+        to <riboseq_data>/manifests/<name>.run-rpbp-pipeline.<time>.json.""", default=None)
+
     slurm.add_sbatch_options(parser, num_cpus=default_num_cpus, mem=default_mem)
     logging_utils.add_logging_options(parser)
     pgrm_utils.add_star_options(parser, star_executable)
@@ -57,7 +69,10 @@ def main():
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
-    config = yaml.load(open(args.config), Loader=yaml.FullLoader)
+    if args.in_process:
+        pipeline_runner.enable()
+
+    config = pipeline_runner.load_config(args.config)
 
     # check that all of the necessary programs are callable
     programs = [
@@ -96,6 +111,12 @@ def main():
         slurm.check_sbatch(cmd, args=args)
         return
 
+    manifest = args.manifest
+    if manifest is None:
+        manifest = run_manifest.get_manifest_filename(config['riboseq_data'], args.name,
+                                                      'run-rpbp-pipeline')
+    run_manifest.start_manifest('run-rpbp-pipeline', args.name)
+
     # handle all option strings to call programs
     logging_str = logging_utils.get_logging_options_string(args)
     star_str = pgrm_utils.get_star_options_string(args)
@@ -122,7 +143,11 @@ def main():
 
     mem_str = "--mem {}".format(shlex.quote(args.mem))
 
-    cmd = ("create-orf-profiles {} {} {} --num-cpus {} {} {} {} {} {} {} {} {}".format(
+    # the manifests of the drivers are included in ours
+    profiles_manifest = run_manifest.get_child_manifest_filename(manifest, 'create-orf-profiles')
+    predict_manifest = run_manifest.get_child_manifest_filename(manifest, 'predict-translated-orfs')
+
+    cmd = ("create-orf-profiles {} {} {} --num-cpus {} {} {} {} {} {} {} {} {} --manifest {}".format(
         args.raw_data,
         args.config,
         args.name,
@@ -134,22 +159,31 @@ def main():
         logging_str,
         tmp_str,
         star_str,
-        flexbar_str))
+        flexbar_str,
+        profiles_manifest))
 
-    shell_utils.check_call(cmd)
+    pipeline_runner.check_call(cmd, manifest=profiles_manifest)
 
     # check if we only want to create the profiles
     if args.profiles_only:
+        run_manifest.write_manifest(manifest)
+        pipeline_runner.log_report()
         return
 
     # then we predict the ORFs
-    cmd = ("predict-translated-orfs {} {} --num-cpus {} {} {} {}".format(args.config,
-                                                                         args.name,
-                                                                         args.num_cpus,
-                                                                         do_not_call_str,
-                                                                         overwrite_str,
-                                                                         logging_str))
-    shell_utils.check_call(cmd)
+    cmd = ("predict-translated-orfs {} {} --num-cpus {} {} {} {} --manifest {}".format(
+        args.config,
+        args.name,
+        args.num_cpus,
+        do_not_call_str,
+        overwrite_str,
+        logging_str,
+        predict_manifest))
+
+    pipeline_runner.check_call(cmd, manifest=predict_manifest)
+
+    run_manifest.write_manifest(manifest)
+    pipeline_runner.log_report()
 
 
 if __name__ == '__main__':
@@ -1,20 +1,34 @@
 #! /usr/bin/env python3
 
 import argparse
+import collections
+import gzip
+import hashlib
+import heapq
+import json
+import os
 import pickle
 import logging
+import queue
+import resource
+import shutil
 import sys
+import tempfile
+import time
 
-import ctypes
 import multiprocessing
 
 import numpy as np
 import pandas as pd
 import scipy.io
+import scipy.sparse
+import scipy.stats
+import tqdm
 
 import pbio.utils.bed_utils as bed_utils
 import pbio.misc.logging_utils as logging_utils
-import pbio.misc.parallel as parallel
+import pbio.misc.math_utils as math_utils
+import pbio.misc.pandas_utils as pandas_utils
 import pbio.misc.slurm as slurm
 import pbio.misc.utils as utils
 
@@ -24,291 +38,1667 @@ import pbio.ribo.ribo_utils as ribo_utils
 
 from rpbp.defaults import default_num_cpus, default_num_groups, translation_options
 
+import rpbp.pipeline_runner as pipeline_runner
+
 logger = logging.getLogger(__name__)
 
-# we will use global variables to share the (read-only) scipy.sparse.csr_matrix
-# across the child processes.
+# the (read-only) scipy.sparse.csr_matrix is written to binary files which
+# are memory-mapped by each worker, so the profiles are not copied into the
+# child processes. The worker globals are only set by the pool initializer,
+# so this works with all multiprocessing start methods.
+profiles = None
+
+# the (optional) profiles smoothed by smooth-orf-profiles, shared in the same way
+smoothed_profiles = None
+
+translated_models = None
+untranslated_models = None
+batched_translated_models = None
+batched_untranslated_models = None
+args = None
+
+# the step size and inverse metric adapted for each model on the previous ORF
+# of similar length, only used with --reuse-adaptation
+adaptation_cache = {}
+
+# for each model class, the number of ORFs for which all models were fit to
+# audit the approximate model selection, and the number of those for which
+# the approximate choice differed, since the last group was returned
+model_selection_audit = {}
+
+# the time each worker spent loading the models, charged to the first ORF it
+# processes, only used with --write-timings
+model_load_time = None
+
+# Not passed as arguments, unlikely to be required
+
+default_orf_num_field = 'orf_num'
+default_orf_type_field = 'orf_type'
+
+# the stable key of each ORF, used to derive its random seed
+default_orf_key_field = 'id'
+
+# the (temporary) column with the batch of each short ORF, -1 for the others
+batch_id_field = 'batch_id'
+
+# the models do not allow scales smaller than this in their hyperparameters
+min_initial_scale = 0.1
+
+# the cost of an ORF when balancing the shards is its length plus this
+# value, which accounts for the fixed overhead of sampling
+default_orf_cost_overhead = 300
+
+# Stan seeds must be less than this
+max_seed = 2**31 - 1
+
+# the number of work items (per CPU) which are submitted beyond the next item
+# to write, which bounds the number of results in the reorder buffer
+default_reorder_window_per_cpu = 4
+
+# the fields added to each ORF, in the order in which they are written
+bayes_factor_fields = [
+    'p_translated_mean',
+    'p_translated_var',
+    'p_background_mean',
+    'p_background_var',
+    'translated_location_mean',
+    'translated_location_var',
+    'translated_scale_mean',
+    'translated_scale_var',
+    'background_location_mean',
+    'background_location_var',
+    'background_scale_mean',
+    'background_scale_var',
+    'bayes_factor_mean',
+    'bayes_factor_var',
+    'chi_square_p',
+    'x_1_sum',
+    'x_2_sum',
+    'x_3_sum',
+    'profile_sum'
+]
+
+# the phases of the per-ORF timings (in seconds), see --write-timings
+timing_fields = [
+    'model_load_time',
+    'profile_time',
+    'smoothing_time',
+    'selection_time',
+    'sampling_time',
+    'extraction_time',
+    'wall_time'
+]
+
+# the options which change the Bayes factors (or the ORFs which are processed);
+# the checkpoint is only resumed if these, and the input files, are unchanged
+checkpoint_options = [
+    'chi_square_only',
+    'use_sufficient_statistics',
+    'batch_max_length',
+    'batch_size',
+    'orf_types',
+    'orf_type_field',
+    'min_length',
+    'max_length',
+    'min_profile',
+    'fraction',
+    'reweighting_iterations',
+    'seed',
+    'chains',
+    'iterations',
+    'warmup',
+    'init_from_moments',
+    'model_selection',
+    'pilot_iterations',
+    'model_selection_audit_rate',
+    'reuse_adaptation',
+    'num_orfs',
+    'orf_num_field'
+]
+
+# --num-orfs is not used in the the Rp-Bp pipeline
+# --resume is given by predict-translated-orfs, unless --overwrite is given
+# --checkpoint and --keep-checkpoint are not used in the Rp-Bp pipeline
+
+
+def get_checkpoint_filename(out):
+    """ This function constructs the default name of the checkpoint file
+        used to keep the results of completed batches for the given output.
+    """
+    return "{}.checkpoint.tsv".format(out)
+
+
+def get_checkpoint_fingerprint_filename(checkpoint):
+    """ This function constructs the name of the (json) file with the
+        fingerprint of the run which wrote the checkpoint.
+    """
+    return "{}.json".format(checkpoint)
+
+
+def get_checkpoint_fingerprint(args):
+    """ This function calculates a fingerprint of the options in
+        checkpoint_options and of the input files (the profiles, regions,
+        smoothed profiles and models, by their path, modification time and
+        size), so results of a run with other options or inputs are not
+        resumed.
+    """
+    files = list(args.profiles) + [args.regions] + list(args.translated_models or [])
+    files.extend(args.untranslated_models or [])
+
+    if args.smoothed_profiles is not None:
+        files.append(args.smoothed_profiles)
+
+    if is_batched(args):
+        files.extend(args.batched_translated_models)
+        files.extend(args.batched_untranslated_models)
+
+    fingerprint = {option: getattr(args, option) for option in checkpoint_options}
+    fingerprint['files'] = pipeline_runner.get_signature(files)
+
+    fingerprint = json.dumps(fingerprint, sort_keys=True, default=str)
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def is_checkpoint_compatible(checkpoint, fingerprint):
+    """ This function checks whether the checkpoint was written by a run with
+        the given fingerprint (see get_checkpoint_fingerprint).
+    """
+    fingerprint_file = get_checkpoint_fingerprint_filename(checkpoint)
+    if not os.path.exists(fingerprint_file):
+        return False
+
+    with open(fingerprint_file) as f:
+        checkpoint_fingerprint = json.load(f).get('fingerprint')
+
+    return checkpoint_fingerprint == fingerprint
+
+
+def write_checkpoint_fingerprint(checkpoint, fingerprint):
+    """ This function writes the fingerprint of this run next to the checkpoint.
+    """
+    with open(get_checkpoint_fingerprint_filename(checkpoint), 'w') as f:
+        json.dump({'fingerprint': fingerprint}, f)
+
+
+def remove_checkpoint(checkpoint):
+    """ This function removes the checkpoint and its fingerprint, if they exist.
+    """
+    for filename in [checkpoint, get_checkpoint_fingerprint_filename(checkpoint)]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def truncate_checkpoint(checkpoint):
+    """ This function removes a trailing, partially written line from the
+        checkpoint, e.g., if the process was killed while appending a batch.
+
+        Args:
+            checkpoint (string): the path to the checkpoint file
+
+        Returns:
+            None, but the file is truncated in place after the last newline
+    """
+    with open(checkpoint, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+
+        # read backwards until we find the last complete line
+        block_size = 4096
+        pos = size
+        while pos > 0:
+            start = max(0, pos - block_size)
+            f.seek(start)
+            block = f.read(pos - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return
+            pos = start
+
+        # there is not even a complete header
+        f.truncate(0)
+
+
+def get_timings_filename(out):
+    """ This function constructs the name of the file to which the per-ORF
+        timings are written for the given output.
+    """
+    return "{}.timings.tsv".format(out)
+
+
+def get_timing_fields(args):
+    """ This function gives the columns of the timings: the phases, followed
+        by the number of leapfrog steps and divergent transitions of each of
+        the translated and untranslated models.
+    """
+    fields = list(timing_fields)
+
+    num_models = {
+        'translated': len(args.translated_models),
+        'untranslated': len(args.untranslated_models)
+    }
+
+    if is_batched(args):
+        num_models['translated'] = max(num_models['translated'],
+                                       len(args.batched_translated_models))
+        num_models['untranslated'] = max(num_models['untranslated'],
+                                         len(args.batched_untranslated_models))
+
+    for model_name in ['translated', 'untranslated']:
+        for i in range(num_models[model_name]):
+            fields.append("{}_{}_n_leapfrog".format(model_name, i))
+            fields.append("{}_{}_n_divergent".format(model_name, i))
+
+    return fields
+
+
+def add_timing(timings, field, value):
+    """ This function adds value to the field of timings, unless timings is None.
+    """
+    if timings is not None:
+        timings[field] = timings.get(field, 0) + value
+
+
+def get_partial_filename(out):
+    """ This function constructs the name of the file to which the output is
+        streamed; it is renamed to out once it is complete.
+    """
+    return "{}.partial".format(out)
+
+
+def open_bed_stream(out, compress):
+    """ This function opens a (text) stream for a bed12+ file. Each flush of
+        a compressed stream ends a deflate block, so the partial file can be
+        read, e.g., with zcat, while it is written.
+    """
+    if compress:
+        return gzip.open(out, 'wt')
+
+    return open(out, 'w')
+
+
+class OrderedBedWriter(object):
+    """ This class writes the results of each work item to a bed12+ stream in
+        the order of the items, even though they complete out of order. The
+        items which complete early are kept in a reorder buffer until all of
+        the previous items have been written. The buffer is only bounded if
+        the items are submitted with imap_windowed.
+    """
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+        self.next_item = 0
+        self.pending = {}
+        self.is_header_written = False
+
+    def add(self, item_index, bfs):
+        """ This function adds the results of the item, and writes all of the
+            items which are now ready.
+        """
+        self.pending[item_index] = bfs
+
+        while self.next_item in self.pending:
+            bfs = self.pending.pop(self.next_item)
+            self.write(bfs)
+            self.next_item += 1
+
+    def write(self, bfs):
+        # the first column of the header starts with '#', as in bed_utils.write_bed
+        header = False
+        if not self.is_header_written:
+            header = list(self.columns)
+            if not header[0].startswith('#'):
+                header[0] = '#' + header[0]
+
+        if (len(bfs) > 0) or not self.is_header_written:
+            bfs = bfs.reindex(columns=self.columns)
+            bfs.to_csv(self.f, sep='\t', index=False, header=header)
+            self.f.flush()
+            self.is_header_written = True
+
+    def close(self):
+        """ This function writes the header, if nothing was written, and checks
+            that all items were written.
+        """
+        if len(self.pending) > 0:
+            msg = "Not all of the items were written. Missing: {}".format(self.next_item)
+            raise ValueError(msg)
+
+        if not self.is_header_written:
+            self.write(pd.DataFrame(columns=self.columns))
+
+
+def imap_windowed(pool, func, items, writer, window):
+    """ This function calls func on the items in the pool, as
+        pool.imap_unordered, but an item is only submitted once its index is
+        less than window items beyond the next item the writer waits for. Thus,
+        if an early item is slow, at most window results wait in the reorder
+        buffer of the writer, rather than all of the later results.
+
+        Args:
+            pool (multiprocessing.Pool): the pool
+
+            func (function): called on each item, it returns the item index
+                first
+
+            items (list of tuples): the item index and the item, in order
+
+            writer (OrderedBedWriter): the writer of the results, which must be
+                given each result before the next one is requested
+
+            window (int): the maximum number of items submitted beyond
+                writer.next_item
+
+        Yields:
+            the results of func, in the order in which they complete
+    """
+    results = queue.Queue()
+    items = collections.deque(items)
+    num_running = 0
+
+    while (len(items) > 0) or (num_running > 0):
+        while (len(items) > 0) and (items[0][0] < writer.next_item + window):
+            pool.apply_async(func, (items.popleft(),), callback=results.put,
+                             error_callback=results.put)
+            num_running += 1
+
+        result = results.get()
+        num_running -= 1
+
+        if isinstance(result, BaseException):
+            raise result
+
+        yield result
+
+
+def read_checkpoint(checkpoint, usecols=None):
+    """ This function reads the results of all batches written to the
+        checkpoint so far. It returns None if the checkpoint does not exist
+        or if it does not contain any complete line.
+    """
+    if not os.path.exists(checkpoint) or os.path.getsize(checkpoint) == 0:
+        return None
+
+    return pd.read_csv(checkpoint, sep='\t', usecols=usecols)
+
+
+def append_to_checkpoint(bfs, checkpoint):
+    """ This function appends the results of one batch to the checkpoint.
+        The header is only written if the file is empty. The file is flushed
+        to disk before returning, so the batch survives a node failure.
+    """
+    write_header = not os.path.exists(checkpoint) or os.path.getsize(checkpoint) == 0
+    with open(checkpoint, 'a') as f:
+        bfs.to_csv(f, sep='\t', index=False, header=write_header)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def get_all_chi_square_values(orfs, profiles, orf_num_field=default_orf_num_field):
+    """ This function calculates the frame counts and the chi-square p-value
+        for all ORFs at once, directly from the (csr) profiles matrix. It gives
+        the same values as get_bayes_factor with args.chi_square_only, i.e.,
+        the chi-square p-value is only calculated for ORFs with more reads in
+        the first frame than in each of the others; all other fields are -inf.
+
+        Args:
+            orfs (pd.DataFrame): a set of orfs. The columns must include:
+                orf_num
+                orf_len
+
+            profiles (scipy.sparse.csr_matrix): the ORF profiles
+
+            orf_num_field (string): the name of the orf_num column
+
+        Returns:
+            pd.DataFrame: the orfs, with the fields in bayes_factor_fields
+    """
+    # sometimes the orf_len is off...
+    m_orf_len = orfs['orf_len'] % 3 == 0
+    if not m_orf_len.all():
+        msg = ("Found {} ORFs whose length was not 0 mod 3. Skipping. orf_ids: {}".format(
+            sum(~m_orf_len), ','.join(orfs.loc[~m_orf_len, 'id'].astype(str))))
+        logger.warning(msg)
+
+    bfs = orfs[m_orf_len].copy()
+
+    orf_nums = bfs[orf_num_field].values
+    orf_lens = bfs['orf_len'].values
+
+    # the frame of each position is its column index modulo 3; only positions
+    # within each ORF are counted, as in the dense profiles
+    orf_profiles = profiles[orf_nums].tocoo()
+    m_in_orf = orf_profiles.col < orf_lens[orf_profiles.row]
+
+    rows = orf_profiles.row[m_in_orf]
+    frames = orf_profiles.col[m_in_orf] % 3
+    counts = orf_profiles.data[m_in_orf]
+
+    frame_sums = np.bincount(3*rows + frames, weights=counts, minlength=3*len(bfs))
+    frame_sums = frame_sums.reshape(len(bfs), 3)
+    profile_sums = frame_sums.sum(axis=1)
+
+    # the chi-square test against a uniform distribution over the frames
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = profile_sums / 3
+        chisq = ((frame_sums - expected[:, np.newaxis])**2).sum(axis=1) / expected
+        chi_square_p = scipy.stats.chi2.sf(chisq, 2)
+
+    # and make sure we have more reads in x_1 than each of the others
+    m_frame = (frame_sums[:, 0] >= frame_sums[:, 1]) & (frame_sums[:, 0] >= frame_sums[:, 2])
+    chi_square_p = np.where(m_frame, chi_square_p, float('-inf'))
+
+    for field in bayes_factor_fields:
+        bfs[field] = float('-inf')
+
+    bfs['chi_square_p'] = chi_square_p
+    bfs['x_1_sum'] = frame_sums[:, 0]
+    bfs['x_2_sum'] = frame_sums[:, 1]
+    bfs['x_3_sum'] = frame_sums[:, 2]
+    bfs['profile_sum'] = profile_sums
+
+    return bfs
+
+
+def get_sufficient_statistics_data(x_1, x_2, x_3):
+    """ This function constructs the input for the sufficient statistics
+        variants of the translated and untranslated models. For normal
+        likelihoods, the log density only depends on the number of
+        observations, their sum and their sum of squares in each frame.
+
+        Args:
+            x_1, x_2, x_3 (np.arrays): the (smoothed) profile in each frame
+
+        Returns:
+            dict: the data for Stan
+    """
+    data = {
+        "T": len(x_1),
+        "x_1_sum": np.sum(x_1),
+        "x_2_sum": np.sum(x_2),
+        "x_3_sum": np.sum(x_3),
+        "x_1_sq_sum": np.dot(x_1, x_1),
+        "x_2_sq_sum": np.dot(x_2, x_2),
+        "x_3_sq_sum": np.dot(x_3, x_3)
+    }
+    return data
+
+
+def get_initial_values(x_1, x_2, x_3):
+    """ This function calculates initial values for the parameters of the
+        translated and untranslated models from the moments of the (smoothed)
+        frames. These are the same empirical values the models use for their
+        hyperparameters, so they are close to the posterior modes.
+
+        Args:
+            x_1, x_2, x_3 (np.arrays): the (smoothed) signal in each frame
+
+        Returns:
+            dict: the initial values for the translated models
+
+            dict: the initial values for the untranslated models
+    """
+    background = np.concatenate([x_2, x_3])
+    everything = np.concatenate([x_1, x_2, x_3])
+
+    translated_init = {
+        'background_location': np.mean(background),
+        'background_scale': max(np.std(background), min_initial_scale),
+        'signal_location': np.mean(x_1),
+        'signal_scale': max(np.std(x_1), min_initial_scale)
+    }
+
+    # the untranslated models use positive_ordered[1] for the scale
+    untranslated_init = {
+        'background_location': np.mean(everything),
+        'background_scale': [max(np.std(everything), min_initial_scale)]
+    }
+
+    return translated_init, untranslated_init
+
+
+def get_orf_seed(seed, orf_key):
+    """ This function derives the random seed for an ORF (or a batch of ORFs)
+        from the global seed and the key of the ORF, so the results for the
+        ORF do not depend on which other ORFs are processed with it, nor on
+        the worker or shard which processes it.
+
+        Args:
+            seed (int): the global seed
+
+            orf_key (object): the key of the ORF, i.e., its id (rather than its
+                orf_num, which depends on the other ORFs); its string
+                representation is used
+
+        Returns:
+            int: the seed for this ORF
+    """
+    key = "{}:{}".format(seed, orf_key).encode()
+    digest = hashlib.sha256(key).digest()
+    orf_seed = int.from_bytes(digest[:8], byteorder='little') % max_seed
+    return orf_seed
+
+
+def get_batch_seed(seed, orf_keys):
+    """ This function derives the random seed for a batch of ORFs from the
+        keys of its ORFs, in the order in which they are fit, see get_orf_seed.
+    """
+    return get_orf_seed(seed, ','.join(str(orf_key) for orf_key in orf_keys))
+
+
+def sample(model, data, args, init=None, model_key=None, seed=None, iterations=None,
+           chains=None):
+    """ This function samples from the model with the MCMC options in args.
+
+        Args:
+            model (pystan.StanModel): the model
+
+            data (dict): the data for the model
+
+            args (namespace): a namespace (presumably from argparse) which includes the following:
+                seed (int): random seed for initializing MCMC
+                chains (int): the number of MCMC chains
+                iterations (int): the number of iterations for each chain
+                warmup (int): the number of warmup iterations for each chain, or
+                    None for half of the iterations
+                init_from_moments (bool): whether to use init
+                reuse_adaptation (bool): whether to start the adaptation from
+                    that of the previous fit with the same model_key
+
+            init (dict): the initial values for all chains
+
+            model_key (hashable): the key of the cached adaptation
+
+            seed (int): the random seed. If None, args.seed is used.
+
+            iterations, chains (ints): if given, these override args.iterations
+                and args.chains, e.g., for a pilot chain. If iterations is
+                given, half of them are used for warmup.
+
+        Returns:
+            pystan.StanFit4Model: the fit
+    """
+    if seed is None:
+        seed = args.seed
+
+    warmup = args.warmup
+    if iterations is None:
+        iterations = args.iterations
+    else:
+        warmup = None
+
+    if chains is None:
+        chains = args.chains
+
+    kwargs = {
+        'data': data,
+        'iter': iterations,
+        'chains': chains,
+        'n_jobs': 1,
+        'seed': seed,
+        'refresh': 0
+    }
+
+    if warmup is not None:
+        kwargs['warmup'] = warmup
+
+    if args.init_from_moments and (init is not None):
+        kwargs['init'] = [init] * chains
+
+    use_cache = args.reuse_adaptation and (model_key is not None)
+    if use_cache and (model_key in adaptation_cache):
+        stepsize, inv_metric = adaptation_cache[model_key]
+        kwargs['control'] = {
+            'stepsize': stepsize,
+            'inv_metric': inv_metric
+        }
+
+    fit = model.sampling(**kwargs)
+
+    if use_cache:
+        adaptation_cache[model_key] = (fit.get_stepsize()[0], fit.get_inv_metric()[0])
+
+    return fit
+
+
+def get_sampler_diagnostics(fit):
+    """ This function counts the leapfrog steps (of all chains, including the
+        warmup) and the divergent transitions (after the warmup) of the fit.
+    """
+    n_leapfrog = sum(
+        np.sum(params['n_leapfrog__']) for params in fit.get_sampler_params(inc_warmup=True)
+    )
+
+    n_divergent = sum(
+        np.sum(params['divergent__']) for params in fit.get_sampler_params(inc_warmup=False)
+    )
+
+    return int(n_leapfrog), int(n_divergent)
+
+
+def get_adaptation_key(model_class, model_index, T):
+    """ This function bins the ORFs by (the order of magnitude of) their
+        length, so the adaptation is only reused between similar ORFs.
+    """
+    return (model_class, model_index, int(T).bit_length())
+
+
+def get_bayes_factor_arrays(num_orfs):
+    """ This function allocates the arrays of the fields in
+        bayes_factor_fields for num_orfs ORFs, with all values set to -inf.
+
+        Returns:
+            dict: a mapping from each field to its array
+    """
+    bf_arrays = {
+        field: np.full(num_orfs, float('-inf')) for field in bayes_factor_fields
+    }
+    return bf_arrays
+
+
+def get_base_bayes_factor(profile, args, bf_arrays, i, smoothed_profile=None, timings=None):
+    """ This function calculates the counts and chi-square value for a single
+        ORF profile and, if the models should be fit to it, smoothes the profile.
+
+        Args:
+            profile (np.array): the (dense) profile for this ORF
+
+            bf_arrays (dict): the arrays of the fields, see get_bayes_factor_arrays
+
+            i (int): the position of this ORF in bf_arrays
+
+            smoothed_profile (np.array): the (dense) smoothed profile for this
+                ORF. If None, the profile is smoothed here.
+
+            timings (dict): if given, the time spent smoothing is added to it
+
+            args (namespace): a namespace (presumably from argparse) which includes the following:
+                chi_square_only (bool): whether only the chi-square value is required
+                fraction (float): the fraction of signal to use in LOWESS
+                reweighting_iterations (int): the number of reweighting iterations in LOWESS
+
+        Returns:
+            np.array: the smoothed profile, or None if the models should not
+                be fit to this ORF. The counts and chi-square p-value are set
+                in bf_arrays; the estimated values are left as -inf.
+    """
+    profile_sum = np.sum(profile)
+    
+    # split the signal based on frame
+    x_1 = profile[0::3]
+    x_2 = profile[1::3]
+    x_3 = profile[2::3]
+    T = len(x_1)
+   
+    x_1_sum = np.sum(x_1)
+    x_2_sum = np.sum(x_2)
+    x_3_sum = np.sum(x_3)
+
+    bf_arrays['x_1_sum'][i] = x_1_sum
+    bf_arrays['x_2_sum'][i] = x_2_sum
+    bf_arrays['x_3_sum'][i] = x_3_sum
+    bf_arrays['profile_sum'][i] = profile_sum
+
+    # check if something odd happens with the length
+    # this should already be checked before calling the function.
+    if (T != len(x_2)) or (T != len(x_3)):
+        return None
+
+    # and make sure we have more reads in x_1 than each of the others
+    if (x_1_sum < x_2_sum) or (x_1_sum < x_3_sum):
+        return None
+
+    # chi-square values
+    f_obs = [x_1_sum, x_2_sum, x_3_sum]
+    chisq, chi_square_p = scipy.stats.chisquare(f_obs)
+    bf_arrays['chi_square_p'][i] = chi_square_p
+ 
+    # check if we only wanted the chi square value
+    if args.chi_square_only:
+        return None
+     
+    # now, smooth the signals, unless they were already smoothed
+    if smoothed_profile is None:
+        start_time = time.perf_counter()
+        smoothed_profile = ribo_utils.smooth_profile(profile,
+                                                     reweighting_iterations=args.reweighting_iterations,
+                                                     fraction=args.fraction)
+        add_timing(timings, 'smoothing_time', time.perf_counter() - start_time)
+
+    return smoothed_profile
+
+
+def combine_moments(moments):
+    """ This function combines the number of values, mean and sum of squared
+        deviations from the mean (M2) of several sets of values into those of
+        their union, as in the parallel variant of Welford's algorithm.
+
+        Args:
+            moments (list of tuples): the (n, mean, M2) of each set. The means
+                and M2 may be np.arrays, which are combined elementwise.
+
+        Returns:
+            tuple: the (n, mean, M2) of all of the values
+    """
+    n, mean, m2 = 0, 0.0, 0.0
+    for n_b, mean_b, m2_b in moments:
+        total = n + n_b
+        delta = mean_b - mean
+        mean = mean + delta * (n_b / total)
+        m2 = m2 + m2_b + delta**2 * (n * n_b / total)
+        n = total
+
+    return n, mean, m2
+
+
+def get_posterior_summaries(fit, pars, axis=None):
+    """ This function calculates the mean and variance of the (post-warmup)
+        draws of each parameter directly from the draws of each chain kept by
+        the fit (fit.sim), rather than with fit.extract, which copies and
+        permutes the draws of all chains. The moments of each chain are
+        calculated in a single pass and combined (see combine_moments).
+
+        Args:
+            fit (pystan.StanFit4Model): the fit
+
+            pars (list of strings): the parameters, which must be scalars or
+                vectors
+
+            axis (int): 0 to calculate the summaries of each element of a
+                vector parameter. If None, the summaries are over all values.
+
+        Returns:
+            dict: a mapping from each parameter to its (mean, variance)
+    """
+    sim = fit.sim
+
+    summaries = {}
+    for par in pars:
+        # the (flat) names of the elements of the parameter, e.g., x[1], x[2]
+        names = [
+            name for name in sim['fnames_oi'] if (name == par) or name.startswith(par + '[')
+        ]
+
+        moments = []
+        for chain, warmup in zip(sim['samples'], sim['warmup2']):
+            draws = [np.asarray(chain['chains'][name])[warmup:] for name in names]
+            chain_means = np.array([np.mean(d) for d in draws])
+            chain_m2 = np.array([np.sum((d - m)**2) for d, m in zip(draws, chain_means)])
+            moments.append((len(draws[0]), chain_means, chain_m2))
+
+        n, means, m2 = combine_moments(moments)
+
+        # and then over the elements
+        if axis is None:
+            n, means, m2 = combine_moments(zip([n] * len(names), means, m2))
+
+        summaries[par] = (means, m2 / n)
+
+    return summaries
+
+
+def get_model_summaries(models, data, args, pars, init=None, model_class=None, T=None,
+                        axis=None, seed=None, timings=None, model_name=None,
+                        model_indices=None):
+    """ This function fits each of the models and summarizes its posterior.
+        Each fit is released as soon as it has been summarized, so the draws
+        of at most one model are kept in memory.
+
+        Args:
+            models (list of pystan.StanModels): the models
+
+            data, args, init, seed: see sample
+
+            pars, axis: see get_posterior_summaries
+
+            model_class (string), T (int): used for the key of the cached
+                adaptation. If model_class is None, the adaptation is not reused.
+
+            timings (dict): if given, the time spent sampling and extracting
+                the summaries, and the diagnostics of each model (prefixed by
+                model_name, see get_timing_fields), are added to it
+
+            model_indices (list of ints): the index of each of the models in its
+                class, if models is a subset of the class
+
+        Returns:
+            list of dicts: the summaries of each model
+    """
+    if model_indices is None:
+        model_indices = range(len(models))
+
+    model_summaries = []
+    for i, model in zip(model_indices, models):
+        model_key = None
+        if model_class is not None:
+            model_key = get_adaptation_key(model_class, i, T)
+
+        start_time = time.perf_counter()
+        fit = sample(model, data, args, init=init, model_key=model_key, seed=seed)
+        add_timing(timings, 'sampling_time', time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        model_summaries.append(get_posterior_summaries(fit, pars, axis=axis))
+        add_timing(timings, 'extraction_time', time.perf_counter() - start_time)
+
+        if timings is not None:
+            n_leapfrog, n_divergent = get_sampler_diagnostics(fit)
+            add_timing(timings, "{}_{}_n_leapfrog".format(model_name, i), n_leapfrog)
+            add_timing(timings, "{}_{}_n_divergent".format(model_name, i), n_divergent)
+
+        del fit
+
+    return model_summaries
+
+
+def get_model_scores(models, data, args, init=None, seed=None):
+    """ This function scores each of the models with a cheap approximation of
+        its mean lp__, used to choose the model which is fit with the full
+        sampling.
+
+        Args:
+            models, data, args, init, seed: see get_model_summaries. args also
+                includes the following:
+                model_selection (string): "map" for the log density at the MAP
+                    estimate, or "pilot" for the mean lp__ of a short chain
+                pilot_iterations (int): the number of iterations of the pilot chain
+
+        Returns:
+            list of floats: the score of each model, or None if the
+                approximation failed for any model
+    """
+    if seed is None:
+        seed = args.seed
+
+    scores = []
+    for model in models:
+        try:
+            if args.model_selection == 'map':
+                optimizing_init = 'random'
+                if args.init_from_moments and (init is not None):
+                    optimizing_init = init
+
+                optimum = model.optimizing(data=data, init=optimizing_init, seed=seed,
+                                           as_vector=False)
+                scores.append(optimum['value'])
+            else:
+                fit = sample(model, data, args, init=init, seed=seed,
+                             iterations=args.pilot_iterations, chains=1)
+                scores.append(get_posterior_summaries(fit, ['lp__'])['lp__'][0])
+                del fit
+
+        except RuntimeError as e:
+            msg = "The model selection failed. Fitting all models. Error: {}".format(e)
+            logger.debug(msg)
+            return None
+
+    return scores
+
+
+def get_best_model_summaries(models, data, args, pars, init=None, model_class=None, T=None,
+                             seed=None, timings=None):
+    """ This function fits the models of a class and summarizes the one with
+        the highest mean lp__. With --model-selection map or pilot, the models
+        are first ranked with get_model_scores, and only the best of them is
+        fit, except for a random (but reproducible, based on the seed) fraction
+        of the ORFs, --model-selection-audit-rate, for which all of the models
+        are fit to check the approximate choice (see model_selection_audit).
+
+        Args:
+            see get_model_summaries
+
+        Returns:
+            dict: the summaries of the best model
+    """
+    if seed is None:
+        seed = args.seed
+
+    model_indices = list(range(len(models)))
+
+    approximate_choice = None
+    if (args.model_selection != 'full') and (len(models) > 1):
+        start_time = time.perf_counter()
+        scores = get_model_scores(models, data, args, init=init, seed=seed)
+        add_timing(timings, 'selection_time', time.perf_counter() - start_time)
+
+        if scores is not None:
+            approximate_choice = int(np.argmax(scores))
+
+            random_state = np.random.RandomState(seed)
+            is_audited = random_state.uniform() < args.model_selection_audit_rate
+
+            if not is_audited:
+                model_indices = [approximate_choice]
+
+    model_summaries = get_model_summaries([models[i] for i in model_indices], data, args,
+                                          pars, init=init, model_class=model_class, T=T,
+                                          seed=seed, timings=timings, model_name=model_class,
+                                          model_indices=model_indices)
+
+    # now, choose the best model, based on mean likelihood
+    best = int(np.argmax([m['lp__'][0] for m in model_summaries]))
+
+    if (approximate_choice is not None) and (len(model_indices) > 1):
+        audit = model_selection_audit.setdefault(model_class, [0, 0])
+        audit[0] += 1
+        audit[1] += int(model_indices[best] != approximate_choice)
+
+    return model_summaries[best]
+
+
+def set_posterior_summaries(bf_arrays, i, translated_summaries, background_summaries):
+    """ This function sets the means and variances of the estimated values,
+        and the resulting Bayes' factor, of the ORF at position i in bf_arrays.
+
+        Args:
+            bf_arrays (dict): the arrays of the fields, see get_bayes_factor_arrays
+
+            i (int): the position of the ORF in bf_arrays
+
+            translated_summaries, background_summaries (dicts): the (mean,
+                variance) of the lp__, background_location and background_scale
+                of the best translated and untranslated models, respectively
+
+        Returns:
+            None, but bf_arrays is updated
+    """
+    summaries = [
+        ('p_translated', translated_summaries['lp__']),
+        ('p_background', background_summaries['lp__']),
+        ('translated_location', translated_summaries['background_location']),
+        ('translated_scale', translated_summaries['background_scale']),
+        ('background_location', background_summaries['background_location']),
+        ('background_scale', background_summaries['background_scale'])
+    ]
+
+    for name, (mean, var) in summaries:
+        bf_arrays[name + '_mean'][i] = mean
+        bf_arrays[name + '_var'][i] = var
+
+    # the (log of) the Bayes factor is the difference between two normals:
+    # (the best translated model) - (the best background model)
+    #
+    # thus, it is also a normal whose mean is the difference of the two means
+    # and whose variance is the sum of the two variances
+    t_mean, t_var = translated_summaries['lp__']
+    b_mean, b_var = background_summaries['lp__']
+
+    bf_arrays['bayes_factor_mean'][i] = t_mean - b_mean
+    bf_arrays['bayes_factor_var'][i] = t_var + b_var
+
+
+def get_bayes_factor(profile, translated_models, untranslated_models, args, bf_arrays, i,
+                     smoothed_profile=None, seed=None, timings=None):
+    """ This function calculates the Bayes' factor for a single ORF profile. 
+
+        Args:
+            profile (np.array): the (dense) profile for this ORF
+
+            bf_arrays (dict): the arrays of the fields, see get_bayes_factor_arrays
+
+            i (int): the position of this ORF in bf_arrays
+
+            smoothed_profile (np.array): see get_base_bayes_factor
+
+            seed (int): the random seed for this ORF. If None, args.seed is used.
+
+            timings (dict): if given, the time spent in each phase, and the
+                diagnostics of each model, are added to it
+
+            translated_models (list of pystan.StanModel): the models which explain translation
+
+            untranslated_models (list of pystan.StanModel): the models which account for background
+
+            args (namespace): a namespace (presumably from argparse) which includes the following:
+                seed (int): random seed for initializing MCMC
+                chains (int): the number of MCMC chains
+                iterations (int): the number of iterations for each chain
+                use_sufficient_statistics (bool): whether the models take the
+                    sufficient statistics of each frame rather than the profile
+
+        Returns:
+            None, but the following fields of the ORF are set in bf_arrays:
+            
+                the mean and variance for each of the following estimated values:
+                    bayes_factor
+                    p_translated
+                    p_background
+                    translated_location
+                    translated_scale
+                    background_location
+                    background_scale
+
+                the chi-square p-value, and the counts of each frame
+    """
+    smoothed_profile = get_base_bayes_factor(profile, args, bf_arrays, i,
+                                             smoothed_profile=smoothed_profile,
+                                             timings=timings)
+
+    if smoothed_profile is None:
+        return
+
+    # split the signal based on frame
+    x_1 = smoothed_profile[0::3]
+    x_2 = smoothed_profile[1::3]
+    x_3 = smoothed_profile[2::3]
+    T = len(x_1)
+    nonzero_x_1 = np.count_nonzero(x_1)
+
+    # construct the input for Stan
+    if args.use_sufficient_statistics:
+        data = get_sufficient_statistics_data(x_1, x_2, x_3)
+    else:
+        data = {
+            "x_1": x_1,
+            "x_2": x_2,
+            "x_3": x_3,
+            "T": T,
+            "nonzero_x_1": nonzero_x_1
+        }
+
+    translated_init, untranslated_init = get_initial_values(x_1, x_2, x_3)
+
+    # summarize the parameters of interest
+    pars = ['lp__', 'background_location', 'background_scale']
+
+    # choose the best model of each class
+    m_translated = get_best_model_summaries(translated_models, data, args, pars,
+                                            init=translated_init, model_class='translated',
+                                            T=T, seed=seed, timings=timings)
+
+    m_background = get_best_model_summaries(untranslated_models, data, args, pars,
+                                            init=untranslated_init, model_class='untranslated',
+                                            T=T, seed=seed, timings=timings)
+
+    # select the best sampling results
+    set_posterior_summaries(bf_arrays, i, m_translated, m_background)
+
+
+def get_batched_bayes_factors(smoothed_profiles, bf_arrays, indices, translated_models,
+                              untranslated_models, args, seed=None, timings=None):
+    """ This function calculates the Bayes' factors for a batch of (short) ORF
+        profiles with a single sampling call per model. The batched models
+        have independent parameters for each ORF, and they give the
+        contribution of each ORF to lp__ as orf_lp; thus, the estimates match
+        those of get_bayes_factor, up to the Monte Carlo error.
+
+        Args:
+            smoothed_profiles (list of np.arrays): the smoothed profiles, as
+                given by get_base_bayes_factor
+
+            bf_arrays (dict): the arrays of the fields, see get_bayes_factor_arrays
+
+            indices (list of ints): the position of each ORF in bf_arrays
+
+            translated_models (list of pystan.StanModel): the batched models
+                which explain translation
+
+            untranslated_models (list of pystan.StanModel): the batched models
+                which account for background
+
+            args (namespace): see get_bayes_factor
+
+            seed (int): the random seed for this batch. If None, args.seed is used.
+
+            timings (dict): if given, the time spent in each phase, and the
+                diagnostics of each model, for the whole batch are added to it
+
+        Returns:
+            None, but the fields of each ORF are set in bf_arrays
+    """
+    # split the signals based on frame, and concatenate them
+    x_1 = [smoothed_profile[0::3] for smoothed_profile in smoothed_profiles]
+    x_2 = [smoothed_profile[1::3] for smoothed_profile in smoothed_profiles]
+    x_3 = [smoothed_profile[2::3] for smoothed_profile in smoothed_profiles]
+
+    T = np.array([len(x) for x in x_1])
+    start = np.cumsum(T) - T + 1
+
+    data = {
+        "N": len(smoothed_profiles),
+        "T": T,
+        "start": start,
+        "total_T": np.sum(T),
+        "x_1": np.concatenate(x_1),
+        "x_2": np.concatenate(x_2),
+        "x_3": np.concatenate(x_3)
+    }
+
+    # the batched models have a vector of parameters, rather than
+    # positive_ordered[1], for the untranslated scale
+    inits = [get_initial_values(*x) for x in zip(x_1, x_2, x_3)]
+    translated_init = {
+        par: np.array([init[0][par] for init in inits]) for par in inits[0][0]
+    }
+    untranslated_init = {
+        'background_location': np.array([init[1]['background_location'] for init in inits]),
+        'background_scale': np.array([init[1]['background_scale'][0] for init in inits])
+    }
+
+    # the dimensions of the batched models depend on the size of the batch,
+    # so the adaptation is not reused; also, the best model is chosen for
+    # each ORF, so all of the models are always fit (see get_best_model_summaries)
+    pars = ['orf_lp', 'background_location', 'background_scale']
+
+    m_translated = get_model_summaries(translated_models, data, args, pars,
+                                       init=translated_init, axis=0, seed=seed,
+                                       timings=timings, model_name='translated')
+
+    m_background = get_model_summaries(untranslated_models, data, args, pars,
+                                       init=untranslated_init, axis=0, seed=seed,
+                                       timings=timings, model_name='untranslated')
+
+    # now, choose the best model of each class for each ORF
+    m_translated_means = [m['orf_lp'][0] for m in m_translated]
+    m_background_means = [m['orf_lp'][0] for m in m_background]
+
+    max_translated_means = np.argmax(m_translated_means, axis=0)
+    max_background_means = np.argmax(m_background_means, axis=0)
+
+    def get_orf_summaries(summaries, i):
+        orf_summaries = {
+            par: (mean[i], var[i]) for par, (mean, var) in summaries.items()
+        }
+        orf_summaries['lp__'] = orf_summaries.pop('orf_lp')
+        return orf_summaries
+
+    for i, index in enumerate(indices):
+        t_summaries = get_orf_summaries(m_translated[max_translated_means[i]], i)
+        b_summaries = get_orf_summaries(m_background[max_background_means[i]], i)
+
+        set_posterior_summaries(bf_arrays, index, t_summaries, b_summaries)
+
+
+def write_profile_arrays(profiles, profiles_dir, name='profiles'):
+    """ This function writes the internal arrays of the (csr) profiles matrix
+        as binary numpy files, so they can be memory-mapped by the workers.
+
+        Args:
+            profiles (scipy.sparse.csr_matrix): the ORF profiles
 
-# see: http://stackoverflow.com/questions/1675766/
-# how-to-combine-pool-map-with-array-shared-memory-in-python-multiprocessing
-profiles_data = 0
-profiles_indices = 0
-profiles_indptr = 0
-profiles_shape = 0
+            profiles_dir (string): the directory in which the files are written
 
-translated_models = 0
-untranslated_models = 0
-args = 0
+            name (string): the prefix of the files
 
-# Not passed as arguments, unlikely to be required
+        Returns:
+            tuple: the filenames of the data, indices and indptr arrays, and
+                the shape of the matrix
+    """
+    profile_arrays = {
+        'data': profiles.data,
+        'indices': profiles.indices,
+        'indptr': profiles.indptr
+    }
 
-default_orf_num_field = 'orf_num'
-default_orf_type_field = 'orf_type'
+    filenames = []
+    for array_name in ['data', 'indices', 'indptr']:
+        filename = os.path.join(profiles_dir, "{}.{}.npy".format(name, array_name))
+        np.save(filename, profile_arrays[array_name])
+        filenames.append(filename)
 
-# --num-orfs is not used in the the Rp-Bp pipeline
+    return tuple(filenames), profiles.shape
 
 
-def get_bayes_factor(profile, translated_models, untranslated_models, args):
-    """ This function calculates the Bayes' factor for a single ORF profile. 
+def read_profile_arrays(profile_filenames, shape):
+    """ This function memory-maps the arrays written by write_profile_arrays
+        and wraps them in a csr_matrix without copying them.
+    """
+    data, indices, indptr = [
+        np.load(filename, mmap_mode='r') for filename in profile_filenames
+    ]
 
-        Args:
-            profile (np.array): the (dense) profile for this ORF
+    profiles = scipy.sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    return profiles
 
-            translated_models (list of pystan.StanModel): the models which explain translation
 
-            untranslated_models (list of pystan.StanModel): the models which account for background
+def init_worker(profile_filenames, profiles_shape, worker_args,
+                smoothed_profile_filenames=None):
+    """ This function initializes each worker process: it attaches the shared
+        profiles and loads the models once, rather than once per group of ORFs.
+    """
+    global profiles, smoothed_profiles, translated_models, untranslated_models, args
+    global batched_translated_models, batched_untranslated_models, model_load_time
 
-            args (namespace): a namespace (presumably from argparse) which includes the following:
-                seed (int): random seed for initializing MCMC
-                chains (int): the number of MCMC chains
-                iterations (int): the number of iterations for each chain
+    args = worker_args
+    profiles = read_profile_arrays(profile_filenames, profiles_shape)
 
-        Returns:
-            pd.Series: a series containing:
-            
-                the mean and variance for each of the following estimated values:
-                    bayes_factor
-                    p_translated
-                    p_background
-                    translated_location
-                    translated_scale
-                    background_location
-                    background_scale
+    if smoothed_profile_filenames is not None:
+        smoothed_profiles = read_profile_arrays(smoothed_profile_filenames, profiles_shape)
 
-                the chi-square p-value
-    """
-    profile_sum = sum(profile)
-    
-    # split the signal based on frame
-    x_1 = profile[0::3]
-    x_2 = profile[1::3]
-    x_3 = profile[2::3]
-    T = len(x_1)
-   
-    x_1_sum = sum(x_1)
-    x_2_sum = sum(x_2)
-    x_3_sum = sum(x_3)
-
-    ret = {
-        "p_translated_mean": float('-inf'),
-        "p_translated_var": float('-inf'),
-        "p_background_mean": float('-inf'),
-        "p_background_var": float('-inf'),
-        "translated_location_mean": float('-inf'),
-        "translated_location_var": float('-inf'),
-        "translated_scale_mean": float('-inf'),
-        "translated_scale_var": float('-inf'),
-        "background_location_mean": float('-inf'),
-        "background_location_var": float('-inf'),
-        "background_scale_mean": float('-inf'),
-        "background_scale_var": float('-inf'),
-        "bayes_factor_mean": float('-inf'),
-        "bayes_factor_var": float('-inf'),
-        "chi_square_p": float('-inf'),
-        "x_1_sum": x_1_sum,
-        "x_2_sum": x_2_sum,
-        "x_3_sum": x_3_sum,
-        "profile_sum": profile_sum
-    }
-    ret = pd.Series(ret)
+    start_time = time.perf_counter()
 
-    # check if something odd happens with the length
-    # this should already be checked before calling the function.
-    if (T != len(x_2)) or (T != len(x_3)):
-        return ret
+    if not args.chi_square_only:
+        translated_models = [pickle.load(open(tm, 'rb')) for tm in args.translated_models]
+        untranslated_models = [pickle.load(open(bm, 'rb')) for bm in args.untranslated_models]
 
-    # and make sure we have more reads in x_1 than each of the others
-    if (x_1_sum < x_2_sum) or (x_1_sum < x_3_sum):
-        return ret
+    if is_batched(args):
+        batched_translated_models = [
+            pickle.load(open(tm, 'rb')) for tm in args.batched_translated_models
+        ]
+        batched_untranslated_models = [
+            pickle.load(open(bm, 'rb')) for bm in args.batched_untranslated_models
+        ]
 
-    # chi-square values
-    f_obs = [x_1_sum, x_2_sum, x_3_sum]
-    chisq, chi_square_p = scipy.stats.chisquare(f_obs)
-    ret['chi_square_p'] = chi_square_p
- 
-    # check if we only wanted the chi square value
-    if args.chi_square_only:
-        return ret
-     
-    # now, smooth the signals
-    smoothed_profile = ribo_utils.smooth_profile(profile,
-                                                 reweighting_iterations=args.reweighting_iterations,
-                                                 fraction=args.fraction)
+    model_load_time = time.perf_counter() - start_time
 
-    # split the signal based on frame
-    x_1 = smoothed_profile[0::3]
-    x_2 = smoothed_profile[1::3]
-    x_3 = smoothed_profile[2::3]
-    nonzero_x_1 = np.count_nonzero(x_1)
 
-    # construct the input for Stan
-    data = {
-        "x_1": x_1,
-        "x_2": x_2,
-        "x_3": x_3,
-        "T": T,
-        "nonzero_x_1": nonzero_x_1
-    }
+def is_batched(args):
+    """ This function checks whether short ORFs should be fit with the batched models.
+    """
+    return ((not args.chi_square_only) and (args.batch_max_length > 0) and
+            (args.batched_translated_models is not None) and
+            (args.batched_untranslated_models is not None))
 
-    m_translated = [tm.sampling(data=data, iter=args.iterations, chains=args.chains, n_jobs=1,
-                                seed=args.seed, refresh=0) for tm in translated_models]
-    
-    m_background = [bm.sampling(data=data, iter=args.iterations, chains=args.chains, n_jobs=1,
-                                seed=args.seed, refresh=0) for bm in untranslated_models]
 
-    # extract the parameters of interest
-    m_translated_ex = [m.extract(pars=['lp__', 'background_location', 'background_scale'])
-                       for m in m_translated]
+def get_all_bayes_factors_item(item):
+    """ This function calculates the Bayes' factors of the regions of a work
+        item, given as (item index, orfs), and keeps the index, so the items
+        can be written in order. The timings of the ORFs are None, unless
+        --write-timings is given. The audit of the model selection is the
+        model_selection_audit of this item.
+    """
+    item_index, orfs = item
+    bfs, orf_timings = get_all_bayes_factors_args(orfs)
 
-    m_background_ex = [m.extract(pars=['lp__', 'background_location', 'background_scale'])
-                       for m in m_background]
+    selection_audit = dict(model_selection_audit)
+    model_selection_audit.clear()
 
-    # now, choose the best model of each class,  based on mean likelihood
-    m_translated_means = [np.mean(m_ex['lp__']) for m_ex in m_translated_ex]
-    m_background_means = [np.mean(m_ex['lp__']) for m_ex in m_background_ex]
+    return item_index, bfs, orf_timings, selection_audit
 
-    max_translated_mean = np.argmax(m_translated_means)
-    max_background_mean = np.argmax(m_background_means)
 
-    # select the best sampling results
-    m_translated_ex = m_translated_ex[max_translated_mean]
-    m_background_ex = m_background_ex[max_background_mean]
+def get_work_items(regions, num_groups):
+    """ This function splits the regions into work items: the groups of the
+        regions which are not batched, in the order of the regions, followed
+        by each batch of short ORFs (see get_batch_ids). This order is also
+        the order of the output, see get_output_positions.
+    """
+    work_items = []
 
-    # extract the relevant means and variances
-    ret['p_translated_mean'] = np.mean(m_translated_ex['lp__'])
-    ret['p_translated_var'] = np.var(m_translated_ex['lp__'])
+    # each batch of short ORFs is a group by itself, so its ORFs are always fit together
+    batched_regions = None
+    if batch_id_field in regions:
+        m_batched = regions[batch_id_field] >= 0
+        batched_regions = regions[m_batched]
+        regions = regions[~m_batched]
 
-    ret['p_background_mean'] = np.mean(m_background_ex['lp__'])
-    ret['p_background_var'] = np.var(m_background_ex['lp__'])
+    if len(regions) > 0:
+        work_items.extend([
+            group for group_index, group in pandas_utils.split_df(regions, num_groups)
+        ])
 
-    ret['translated_location_mean'] = np.mean(m_translated_ex['background_location'])
-    ret['translated_location_var'] = np.var(m_translated_ex['background_location'])
+    if batched_regions is not None:
+        work_items.extend([
+            group for batch_id, group in batched_regions.groupby(batch_id_field)
+        ])
 
-    ret['translated_scale_mean'] = np.mean(m_translated_ex['background_scale'])
-    ret['translated_scale_var'] = np.var(m_translated_ex['background_scale'])
+    return work_items
 
-    ret['background_location_mean'] = np.mean(m_background_ex['background_location'])
-    ret['background_location_var'] = np.var(m_background_ex['background_location'])
 
-    ret['background_scale_mean'] = np.mean(m_background_ex['background_scale'])
-    ret['background_scale_var'] = np.var(m_background_ex['background_scale'])
+def get_output_positions(regions):
+    """ This function gives the position of each region in the order of the
+        work items (see get_work_items), i.e., in the output written without
+        shards: the regions which are not batched, in the order of the
+        regions, followed by the batches, in the order of their ids.
 
-    # the (log of) the Bayes factor is the difference between two normals:
-    # (the best translated model) - (the best background model)
-    #
-    # thus, it is also a normal whose mean is the difference of the two means
-    # and whose variance is the sum of the two variances
-    ret['bayes_factor_mean'] = ret['p_translated_mean'] - ret['p_background_mean']
-    ret['bayes_factor_var'] = ret['p_translated_var'] + ret['p_background_var']
-    
-    return ret
+        Returns:
+            np.array: the position of each region
+    """
+    batch_ids = np.full(len(regions), -1, dtype=int)
+    if batch_id_field in regions:
+        batch_ids = regions[batch_id_field].values
 
+    m_batched = batch_ids >= 0
+    order = np.lexsort((np.arange(len(regions)), batch_ids, m_batched))
+
+    positions = np.empty(len(regions), dtype=int)
+    positions[order] = np.arange(len(regions))
+
+    return positions
+
+
+def get_all_bayes_factors_args(orfs):
 
-def get_all_bayes_factors(orfs, args):
     """ This function calculates the Bayes' factor term for each region in regions. See the
-        description of the script for the Bayes' factor calculations.
+        description of the script for the Bayes' factor calculations. It uses the profiles,
+        models and arguments set up by init_worker.
 
         Args:
             orfs (pd.DataFrame) : a set of orfs. The columns must include:
                 orf_num
                 exon_lengths
-
-            args (namespace) : a namespace containing the models and profiles filenames
             
         Returns:
-            pandas.Series: the Bayes' factors (and other estimated quantities) for each region
-    """
+            pd.DataFrame: the regions, with the Bayes' factors (and other estimated
+                quantities) for each region
 
-    # read in the signals and sequences
-    logger.debug("Reading profiles")
-    profiles = scipy.io.mmread(args.profiles).tocsr()
-    
-    logger.debug("Reading models")
-    translated_models = [pickle.load(open(tm, 'rb')) for tm in args.translated_models]
-    untranslated_models = [pickle.load(open(bm, 'rb')) for bm in args.untranslated_models]
+            pd.DataFrame: the timings of each region (see get_orf_timings), or
+                None if --write-timings is not given
+    """
 
     logger.debug("Applying on regions")
-    bfs = []
-    for idx, row in orfs.iterrows():
-        orf_num = row[args.orf_num_field]
-        orf_len = row['orf_len']
+
+    # the batches are assigned in main, so they do not depend on the groups
+    batch_ids = None
+    if batch_id_field in orfs:
+        batch_ids = orfs[batch_id_field].values
+        orfs = orfs.drop(columns=[batch_id_field])
+
+    # the results are written directly into one array per field, indexed by
+    # the position of the ORF in this group, and joined to the regions at the end
+    num_orfs = len(orfs)
+    bf_arrays = get_bayes_factor_arrays(num_orfs)
+    m_valid = np.ones(num_orfs, dtype=bool)
+
+    # the time spent in each phase for each ORF, if requested
+    row_timings = [None] * num_orfs
+
+    orf_nums = orfs[args.orf_num_field].values
+    orf_keys = orfs[default_orf_key_field].values
+    orf_lens = orfs['orf_len'].values
+
+    # the short ORFs which are fit with the batched models, as
+    # batch_id -> list of (position, orf key, smoothed profile)
+    batches = {}
+
+    for i in range(num_orfs):
+        orf_num = orf_nums[i]
+        orf_key = orf_keys[i]
+        orf_len = orf_lens[i]
+
+        orf_start_time = time.perf_counter()
+        timings = None
+        if args.write_timings:
+            timings = {}
 
         # sometimes the orf_len is off...
         if orf_len % 3 != 0:
-            msg = "Found an ORF whose length was not 0 mod 3. Skipping. orf_id: {}".format(row['id'])
+            msg = "Found an ORF whose length was not 0 mod 3. Skipping. orf_id: {}".format(orf_key)
             logger.warning(msg)
+            m_valid[i] = False
             continue
 
+        start_time = time.perf_counter()
         profile = utils.to_dense(profiles, orf_num, float, length=orf_len)
 
-        row_bf = get_bayes_factor(profile, translated_models, untranslated_models, args)
-        row = row.append(row_bf)
+        smoothed_profile = None
+        if smoothed_profiles is not None:
+            smoothed_profile = utils.to_dense(smoothed_profiles, orf_num, float, length=orf_len)
 
-        bfs.append(row)
+        add_timing(timings, 'profile_time', time.perf_counter() - start_time)
 
-    bfs = pd.DataFrame(bfs)
-    
-    return bfs
+        if (batch_ids is not None) and (batch_ids[i] >= 0):
+            smoothed_profile = get_base_bayes_factor(profile, args, bf_arrays, i,
+                                                     smoothed_profile=smoothed_profile,
+                                                     timings=timings)
+            if smoothed_profile is not None:
+                batch = batches.setdefault(batch_ids[i], [])
+                batch.append((i, orf_key, smoothed_profile))
+        else:
+            seed = get_orf_seed(args.seed, orf_key)
+            get_bayes_factor(profile, translated_models, untranslated_models, args, bf_arrays, i,
+                             smoothed_profile=smoothed_profile, seed=seed, timings=timings)
 
+        add_timing(timings, 'wall_time', time.perf_counter() - orf_start_time)
 
-def get_all_bayes_factors_args(orfs):
+        row_timings[i] = timings
 
-    """ This function calculates the Bayes' factor term for each region in regions. See the
-        description of the script for the Bayes' factor calculations.
+    for batch_id in sorted(batches):
+        batch_indices, batch_orf_keys, batch_profiles = zip(*batches[batch_id])
+
+        batch_start_time = time.perf_counter()
+        batch_timings = None
+        if args.write_timings:
+            batch_timings = {}
+
+        seed = get_batch_seed(args.seed, batch_orf_keys)
+        get_batched_bayes_factors(batch_profiles, bf_arrays, batch_indices,
+                                  batched_translated_models, batched_untranslated_models,
+                                  args, seed=seed, timings=batch_timings)
+
+        add_timing(batch_timings, 'wall_time', time.perf_counter() - batch_start_time)
+
+        # the cost of the batch is shared equally by its ORFs
+        if batch_timings is not None:
+            for j in batch_indices:
+                for field, value in batch_timings.items():
+                    add_timing(row_timings[j], field, value / len(batch_indices))
+
+    bfs = orfs.copy()
+    for field in bayes_factor_fields:
+        bfs[field] = bf_arrays[field]
+
+    bfs = bfs[m_valid]
+
+    orf_timings = None
+    if args.write_timings:
+        valid_timings = [row_timings[i] for i in np.where(m_valid)[0]]
+        valid_batch_ids = None
+        if batch_ids is not None:
+            valid_batch_ids = batch_ids[m_valid]
+
+        orf_timings = get_orf_timings(bfs, valid_timings, valid_batch_ids)
+
+    return bfs, orf_timings
+
+
+def get_orf_timings(bfs, row_timings, batch_ids=None):
+    """ This function collects the timings of each ORF of a group, along with
+        the fields used to break down the cost (see summarize-orf-timings).
+        The time the worker spent loading the models is charged to the first
+        ORF it processes.
 
         Args:
-            orfs (pd.DataFrame) : a set of orfs. The columns must include:
-                orf_num
-                exon_lengths
+            bfs (pd.DataFrame): the (valid) ORFs of the group, with their
+                Bayes' factors
+
+            row_timings (list of dicts): the timings of each ORF, as given by
+                get_bayes_factor (and get_batched_bayes_factors)
+
+            batch_ids (np.array): the batch of each ORF, or None if no ORFs
+                are batched
 
-            args (namespace) : a namespace containing the models and profiles filenames
-            
         Returns:
-            pandas.Series: the Bayes' factors (and other estimated quantities) for each region
+            pd.DataFrame: the timings of each ORF, with the columns of
+                get_timing_fields
     """
+    global model_load_time
 
-    # read in the signals and sequences
-    # logger.debug("Reading profiles")
-    # profiles = scipy.io.mmread(args.profiles).tocsr()
-    
-    # logger.debug("Reading models")
-    # translated_models = [pickle.load(open(tm, 'rb')) for tm in args.translated_models]
-    # untranslated_models = [pickle.load(open(bm, 'rb')) for bm in args.untranslated_models]
+    orf_fields = [args.orf_num_field, default_orf_key_field, args.orf_type_field,
+                  'orf_len', 'profile_sum']
+    orf_timings = bfs[orf_fields].reset_index(drop=True)
 
-    # this is code to initialize a csc matrix using the internal numpy arrays
-    # csr is basically the same
-    # b = scipy.sparse.csc_matrix((a.data, a.indices, a.indptr), shape=a.shape, copy=False)
-    profiles = scipy.sparse.csr_matrix((profiles_data, profiles_indices, profiles_indptr),
-                                       shape=profiles_shape, copy=False)
+    if batch_ids is None:
+        batch_ids = np.full(len(orf_timings), -1)
 
-    logger.debug("Applying on regions")
-    bfs = []
-    for idx, row in orfs.iterrows():
-        orf_num = row[args.orf_num_field]
-        orf_len = row['orf_len']
+    orf_timings[batch_id_field] = batch_ids
+    orf_timings['worker'] = os.getpid()
 
-        # sometimes the orf_len is off...
-        if orf_len % 3 != 0:
-            msg = "Found an ORF whose length was not 0 mod 3. Skipping. orf_id: {}".format(row['id'])
-            logger.warning(msg)
-            continue
+    phase_timings = pd.DataFrame(row_timings, index=orf_timings.index)
+    phase_timings = phase_timings.reindex(columns=get_timing_fields(args)).fillna(0)
 
-        profile = utils.to_dense(profiles, orf_num, float, length=orf_len)
+    if (model_load_time is not None) and (len(phase_timings) > 0):
+        phase_timings.loc[0, 'model_load_time'] = model_load_time
+        model_load_time = None
 
-        row_bf = get_bayes_factor(profile, translated_models, untranslated_models, args)
-        row = row.append(row_bf)
+    orf_timings = pd.concat([orf_timings, phase_timings], axis=1)
+    return orf_timings
 
-        bfs.append(row)
 
-    bfs = pd.DataFrame(bfs)
-    return bfs
+def parse_shard(shard):
+    """ This function parses a shard given as "i/N", for 1 <= i <= N.
+    """
+    try:
+        shard, num_shards = [int(s) for s in shard.split('/')]
+    except ValueError:
+        msg = "Could not parse the shard: {}. It must be given as i/N.".format(shard)
+        raise ValueError(msg)
 
+    if (num_shards < 1) or (shard < 1) or (shard > num_shards):
+        msg = "Invalid shard: {}/{}. It must satisfy 1 <= i <= N.".format(shard, num_shards)
+        raise ValueError(msg)
 
-def main():
-    global profiles_data, profiles_indices, profiles_indptr, profiles_shape
-    global translated_models, untranslated_models
-    global args
+    return shard, num_shards
+
+
+def get_shard_filename(out, shard, num_shards):
+    """ This function constructs the name of the output file for a shard by
+        adding the shard to the name of the (complete) output file.
+    """
+    base, ext = out, ""
+    for e in ['.bed.gz', '.bed']:
+        if out.endswith(e):
+            base, ext = out[:-len(e)], e
+            break
+
+    return "{}.shard-{}-of-{}{}".format(base, shard, num_shards, ext)
+
+
+def get_shard_sidecar_filename(out):
+    """ This function constructs the name of the (json) file which describes
+        the shard written to out.
+    """
+    return "{}.shard.json".format(out)
+
+
+def get_batch_ids(regions, batch_max_length, batch_size):
+    """ This function assigns the short ORFs to batches of (at most)
+        batch_size ORFs of similar length, sorted by length and id. The
+        batches only depend on the (filtered) regions, so each ORF is always
+        fit with the same other ORFs, regardless of the groups, the number of
+        CPUs or the shards.
 
+        Args:
+            regions (pd.DataFrame): the (filtered) regions, with a default index
+
+            batch_max_length (int): the maximum length of the batched ORFs
+
+            batch_size (int): the maximum number of ORFs in each batch
+
+        Returns:
+            np.array: the batch of each region, or -1 if it is not batched
+    """
+    batch_ids = np.full(len(regions), -1, dtype=int)
+
+    m_batch = (regions['orf_len'] <= batch_max_length) & ((regions['orf_len'] % 3) == 0)
+    short_regions = regions[m_batch].sort_values(['orf_len', default_orf_key_field],
+                                                 kind='mergesort')
+
+    batch_ids[short_regions.index.values] = np.arange(len(short_regions)) // batch_size
+    return batch_ids
+
+
+def get_shard_assignments(regions, num_shards, orf_num_field=default_orf_num_field,
+                          batch_ids=None):
+    """ This function partitions the regions into shards with (roughly) equal
+        costs, greedily assigning the most costly remaining unit to the least
+        loaded shard. Each unit is a single region, or a whole batch of short
+        regions. The partition only depends on the regions (and num_shards),
+        so every shard computes the same one.
+
+        Args:
+            regions (pd.DataFrame): the (filtered) regions
+
+            num_shards (int): the number of shards
+
+            batch_ids (np.array): the batch of each region, from get_batch_ids
+
+        Returns:
+            np.array: the (0-based) shard of each region
+    """
+    units = np.arange(len(regions))
+    if batch_ids is not None:
+        # the batch ids are less than the number of regions
+        units = np.where(batch_ids >= 0, batch_ids, len(regions) + units)
+
+    units = pd.Series(units)
+
+    # the cost of a unit is the total length of its regions, plus the overhead
+    # of a single sampling call
+    orf_lens = pd.Series(regions['orf_len'].values)
+    unit_costs = orf_lens.groupby(units).sum() + default_orf_cost_overhead
+
+    orf_nums = pd.Series(regions[orf_num_field].values)
+    unit_orf_nums = orf_nums.groupby(units).min()
+
+    # the most costly first, ties broken by orf_num
+    order = np.lexsort((unit_orf_nums.values, -unit_costs.values))
+
+    loads = [(0, shard) for shard in range(num_shards)]
+    unit_assignments = np.zeros(len(unit_costs), dtype=int)
+
+    for i in order:
+        load, shard = heapq.heappop(loads)
+        unit_assignments[i] = shard
+        heapq.heappush(loads, (load + unit_costs.values[i], shard))
+
+    unit_assignments = pd.Series(unit_assignments, index=unit_costs.index)
+    assignments = unit_assignments.reindex(units).values
+
+    return assignments
+
+
+def get_shard(regions, shard, num_shards, orf_num_field=default_orf_num_field):
+    """ This function selects the regions of the shard and describes the shard
+        for merge-orf-bayes-factors.
+
+        Returns:
+            pd.DataFrame: the regions of this shard
+
+            dict: the description of the shard, including the orf_nums which
+                must be in its output and their positions in the output
+                without shards (see get_output_positions), as well as a
+                fingerprint of all of the filtered regions
+    """
+    orf_nums = regions[orf_num_field].values
+
+    fingerprint = hashlib.sha256(','.join(str(orf_num) for orf_num in orf_nums).encode())
+
+    batch_ids = None
+    if batch_id_field in regions:
+        batch_ids = regions[batch_id_field].values
+
+    assignments = get_shard_assignments(regions, num_shards, orf_num_field, batch_ids=batch_ids)
+    m_shard = assignments == (shard - 1)
+
+    # the ORFs whose length is not 0 mod 3 are skipped
+    m_frame = (regions['orf_len'] % 3) == 0
+    region_indices = np.where(m_shard & m_frame)[0]
+    output_positions = get_output_positions(regions)[region_indices]
+
+    shard_sidecar = {
+        'shard': shard,
+        'num_shards': num_shards,
+        'fingerprint': fingerprint.hexdigest(),
+        'orf_nums': [int(orf_num) for orf_num in orf_nums[region_indices]],
+        'region_indices': [int(i) for i in region_indices],
+        'output_positions': [int(p) for p in output_positions]
+    }
+
+    regions = regions[m_shard].reset_index(drop=True)
+
+    return regions, shard_sidecar
+
+
+def write_shard_sidecar(shard_sidecar, out):
+    """ This function writes the description of the shard next to out. It is
+        written last, so its presence means the shard is complete.
+    """
+    if shard_sidecar is None:
+        return
+
+    with open(get_shard_sidecar_filename(out), 'w') as f:
+        json.dump(shard_sidecar, f)
+
+
+def parse_arguments(argv=None):
+    """ This function parses the command line arguments of the script (or
+        argv, if given, without the program name).
+
+        Returns:
+            argparse.Namespace: the parsed arguments
+    """
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      description="""This script uses Hamiltonian MCMC with Stan 
         to estimate translation parameters for a set of regions (presumably ORFs). Roughly, it takes 
@@ -318,7 +1708,9 @@ def main():
         The script first smoothes the profiles using LOWESS. It then calculates both the Bayes' factor 
         (using the smoothed profile) and chi2 value (using the raw counts) for each ORF.""")
 
-    parser.add_argument('profiles', help="The ORF profiles (counts) (mtx)")
+    parser.add_argument('profiles', help="""The ORF profiles (counts) (mtx). If several
+        files are given (presumably, one for each replicate from a condition), their
+        profiles are added when they are read.""", nargs='+')
 
     parser.add_argument('regions', help="The regions (ORFs) for which predictions will be made (BED12+)")
     
@@ -332,6 +1724,27 @@ def main():
 
     parser.add_argument('--untranslated-models', help="The models to use as H_u (pkl)", nargs='+')
 
+    parser.add_argument('--use-sufficient-statistics', help="""If this flag is present, then
+        the sufficient statistics (sum and sum of squares of each frame) of the smoothed
+        profiles are given to the models, rather than the profiles. The models must be the
+        corresponding variants, e.g., translated_sufficient_statistics.""", action='store_true')
+
+    parser.add_argument('--batched-translated-models', help="""The batched variants
+        of the models to use as H_t for short ORFs (pkl), e.g., translated_batched""",
+                        nargs='+', default=None)
+
+    parser.add_argument('--batched-untranslated-models', help="""The batched variants
+        of the models to use as H_u for short ORFs (pkl), e.g., untranslated_batched""",
+                        nargs='+', default=None)
+
+    parser.add_argument('--batch-max-length', help="""ORFs with length at most this value
+        are fit in batches with the batched models, rather than one at a time. This
+        amortizes the per-call overhead of sampling, which dominates for short ORFs.
+        0 disables batching.""", type=int, default=translation_options['orf_batch_max_length'])
+
+    parser.add_argument('--batch-size', help="The maximum number of ORFs in each batch",
+                        type=int, default=translation_options['orf_batch_size'])
+
     # filtering options
     parser.add_argument('--orf-types', help="If values are given, then only orfs with those types are processed.",
                         nargs='*', default=translation_options['orf_types'])
@@ -348,6 +1761,15 @@ def main():
         value will not be processed.""", type=float, default=translation_options['orf_min_profile_count_pre'])
 
     # smoothing options
+    parser.add_argument('--write-merged-profiles', help="""If several profile files
+        are given, the merged profiles are also written to this (mtx.gz) file.""",
+                        default=None)
+
+    parser.add_argument('--smoothed-profiles', help="""The ORF profiles smoothed by
+        smooth-orf-profiles (mtx). If given, the profiles are not smoothed again, so
+        --fraction and --reweighting-iterations must match those used to create them.""",
+                        default=None)
+
     parser.add_argument('--fraction', help="The fraction of signal to use in LOWESS",
                         type=float, default=translation_options['smoothing_fraction'])
 
@@ -358,12 +1780,46 @@ def main():
                         type=int, default=translation_options['smoothing_reweighting_iterations'])
 
     # MCMC options
-    parser.add_argument('-s', '--seed', help="The random seeds to use for inference",
+    parser.add_argument('-s', '--seed', help="""The random seed to use for inference. The
+        seed of each ORF is derived from this value and its id, so the results do not
+        depend on the grouping of the ORFs, the number of CPUs, nor the shards (unless
+        --reuse-adaptation is given).""",
                         type=int, default=translation_options['seed'])
     parser.add_argument('-c', '--chains', help="The number of MCMC chains to use", type=int,
                         default=translation_options['chains'])
     parser.add_argument('-i', '--iterations', help="The number of MCMC iterations to use for each chain",
                         type=int, default=translation_options['translation_iterations'])
+    parser.add_argument('-w', '--warmup', help="""The number of warmup iterations for each
+        chain. If not given, half of the iterations are used for warmup.""", type=int,
+                        default=translation_options['translation_warmup'])
+
+    parser.add_argument('--init-from-moments', help="""If this flag is present, then the
+        chains are initialized from the means and standard deviations of the smoothed
+        frames, rather than randomly. This allows fewer warmup iterations.""",
+                        action='store_true')
+
+    parser.add_argument('--model-selection', help="""How the best translated and
+        untranslated models are chosen, if there is more than one of either. "full" fits
+        all of the models and keeps the one with the highest mean lp__. "map" and "pilot"
+        rank the models by the log density at the MAP estimate or the mean lp__ of a short
+        (single) chain, respectively, and only fit the best one. The batched models
+        always use "full".""", choices=['full', 'map', 'pilot'],
+                        default=translation_options['model_selection'])
+
+    parser.add_argument('--pilot-iterations', help="""The number of iterations of the
+        pilot chain, with --model-selection pilot""", type=int,
+                        default=translation_options['model_selection_pilot_iterations'])
+
+    parser.add_argument('--model-selection-audit-rate', help="""With --model-selection
+        map or pilot, all of the models are also fit for this fraction of the ORFs, and
+        the number of ORFs for which the approximate choice differs from that of the full
+        sampling is reported.""", type=float,
+                        default=translation_options['model_selection_audit_rate'])
+
+    parser.add_argument('--reuse-adaptation', help="""If this flag is present, then the
+        adaptation of each model starts from the step size and metric adapted on the
+        previous ORF of similar length in the same worker. N.B. The estimates then
+        depend on the order in which the ORFs are processed.""", action='store_true')
     
     # behavior options
     parser.add_argument('--num-orfs', help="If n>0, then only this many ORFs will be processed",
@@ -380,22 +1836,99 @@ def main():
                                                    "because of the parallel calls.",
                         type=int, default=default_num_groups)
 
+    parser.add_argument('--shard', help="""If given as i/N, then the filtered ORFs are
+        partitioned into N shards of (roughly) equal cost, and only the ORFs of shard i
+        (1 <= i <= N) are processed. The partition is deterministic, so the shards can
+        be run on different nodes, with the same options; merge-orf-bayes-factors then
+        validates and combines them. A description of the shard is written to
+        <out>.shard.json.""", default=None)
+
+    parser.add_argument('--checkpoint', help="""The file to which the results of each
+        completed group of ORFs are appended. If not given, this is <out>.checkpoint.tsv.
+        The checkpoint is removed once the output has been written, unless
+        --keep-checkpoint is given.""", default=None)
+
+    parser.add_argument('--resume', help="""If this flag is present, then the ORFs
+        already in the checkpoint are not processed again. The checkpoint is discarded
+        if it was written with other options (e.g., the seed or the MCMC options) or
+        input files (profiles, ORFs or models), or if this flag is not given.""",
+                        action='store_true')
+
+    parser.add_argument('--keep-checkpoint', help="""If this flag is present, the
+        checkpoint is not removed after the output has been written.""",
+                        action='store_true')
+
+    parser.add_argument('--write-timings', help="""If this flag is present, then the
+        wall time of each ORF, split into profile extraction, smoothing, sampling and
+        extraction of the posterior summaries, along with the number of leapfrog steps
+        and divergent transitions of each model, are written to <out>.timings.tsv. The
+        costs of a batch of short ORFs are shared equally by its ORFs. Please see
+        summarize-orf-timings for a breakdown by ORF type and length.""",
+                        action='store_true')
+
+    parser.add_argument('--start-method', help="""The multiprocessing start method
+        used for the workers. If not given, the platform default is used.""",
+                        choices=['fork', 'spawn', 'forkserver'], default=None)
+
+    parser.add_argument('--tmp', help="""The location for the temporary (binary)
+        profile files shared with the workers""", default=None)
+
     slurm.add_sbatch_options(parser)
     logging_utils.add_logging_options(parser)
-    args = parser.parse_args()
-    logging_utils.update_logging(args)
+    args = parser.parse_args(argv)
 
-    if args.use_slurm:
-        cmd = ' '.join(sys.argv)
-        slurm.check_sbatch(cmd, args=args)
-        return
+    return args
 
-    # read in the regions and apply the filters
+
+def run(args):
+    """ This function reads the ORFs and the profiles given in args (through
+        pipeline_runner, so they are shared with the other in-process steps)
+        and estimates the Bayes factors, see estimate_bayes_factors.
+    """
     msg = "Reading and filtering ORFs"
     logger.info(msg)
-    regions = bed_utils.read_bed(args.regions)
+    regions = pipeline_runner.read_bed(args.regions)
 
-    # by default, keep everything
+    if len(args.profiles) > 1:
+        msg = "Merging the profiles of {} replicates".format(len(args.profiles))
+        logger.info(msg)
+
+    # this is the last step which uses the (shared) profiles, and the profiles
+    # are only kept by estimate_bayes_factors, which drops them once they have
+    # been written for the workers
+    estimate_bayes_factors(regions, pipeline_runner.read_profiles(args.profiles, args.num_cpus,
+                                                                  release_after=True), args)
+
+
+def estimate_bayes_factors(regions, profiles, args):
+    """ This function filters the ORFs, and estimates the Bayes factors (or
+        only the chi-square values) of those in the shard given in args, if
+        any, with args.num_cpus workers. See the description of the script.
+
+        Args:
+            regions (pd.DataFrame): the ORFs (BED12+), as read from args.regions
+
+            profiles (scipy.sparse.csr_matrix): the (merged) profiles of the ORFs
+
+            args (namespace): the options, see parse_arguments
+
+        Returns:
+            None, but the Bayes factors are written to args.out
+    """
+    if (args.batch_max_length > 0) and not is_batched(args):
+        msg = ("--batch-max-length is given, but not --batched-translated-models "
+               "and --batched-untranslated-models. All ORFs will be fit one at a time.")
+        logger.warning(msg)
+
+    if (args.warmup is not None) and (args.warmup >= args.iterations):
+        msg = "The number of warmup iterations must be less than the number of iterations"
+        raise ValueError(msg)
+
+    if (args.model_selection_audit_rate < 0) or (args.model_selection_audit_rate > 1):
+        msg = "The model selection audit rate must be between 0 and 1"
+        raise ValueError(msg)
+
+    # apply the filters; by default, keep everything
     m_filters = np.array([True] * len(regions))
 
     if len(args.orf_types) > 0:
@@ -412,8 +1945,12 @@ def main():
         m_max_length = regions['orf_len'] <= args.max_length
         m_filters = m_max_length & m_filters
 
+    if args.write_merged_profiles is not None:
+        msg = "Writing merged profiles to disk"
+        logger.info(msg)
+        math_utils.write_sparse_matrix(args.write_merged_profiles, profiles)
+
     # min profile
-    profiles = scipy.io.mmread(args.profiles).tocsr()
     profiles_sums = profiles.sum(axis=1)
     good_orf_nums = np.where(profiles_sums >= args.min_profile)
     good_orf_nums = set(good_orf_nums[0])
@@ -430,30 +1967,197 @@ def main():
     msg = "Number of regions after filtering: {}".format(len(regions))
     logger.info(msg)
 
-    logger.debug("Reading models")
-    translated_models = [pickle.load(open(tm, 'rb')) for tm in args.translated_models]
-    untranslated_models = [pickle.load(open(bm, 'rb')) for bm in args.untranslated_models]
-    
-    profiles_data = multiprocessing.RawArray(ctypes.c_double, profiles.data.flat)
-    profiles_indices = multiprocessing.RawArray(ctypes.c_int, profiles.indices)
-    profiles_indptr = multiprocessing.RawArray(ctypes.c_int, profiles.indptr)
-    profiles_shape = multiprocessing.RawArray(ctypes.c_int, profiles.shape)
-    
-    with suppress_stdout_stderr():
-        
-        bfs_l = parallel.apply_parallel_split(
-            regions, 
-            args.num_cpus,
-            get_all_bayes_factors_args, 
-            num_groups=args.num_groups,
-            progress_bar=True,
-            backend='multiprocessing'
-        )
-
-    bfs = pd.concat(bfs_l)
-
-    # write the results as a bed12+ file
-    bed_utils.write_bed(bfs, args.out)
+    # the batches are assigned before the regions are sharded or grouped
+    if is_batched(args):
+        regions[batch_id_field] = get_batch_ids(regions, args.batch_max_length, args.batch_size)
+
+    # the partition is computed from all of the filtered regions, so every
+    # shard must use the same filters
+    shard_sidecar = None
+    if args.shard is not None:
+        shard, num_shards = parse_shard(args.shard)
+        regions, shard_sidecar = get_shard(regions, shard, num_shards, args.orf_num_field)
+
+        msg = "Number of regions in shard {}/{}: {}".format(shard, num_shards, len(regions))
+        logger.info(msg)
+
+    # the chi-square values are calculated for all ORFs at once, so we do not
+    # need the workers (nor the checkpoint)
+    if args.chi_square_only:
+        msg = "Calculating the chi-square values"
+        logger.info(msg)
+
+        bfs = get_all_chi_square_values(regions, profiles, args.orf_num_field)
+        bed_utils.write_bed(bfs, args.out)
+        write_shard_sidecar(shard_sidecar, args.out)
+        return
+
+    checkpoint = args.checkpoint
+    if checkpoint is None:
+        checkpoint = get_checkpoint_filename(args.out)
+
+    work_items = get_work_items(regions, args.num_groups)
+
+    # the results in the checkpoint are only used if they were calculated
+    # with the same options and inputs
+    fingerprint = get_checkpoint_fingerprint(args)
+    is_resumed = args.resume
+
+    if is_resumed and os.path.exists(checkpoint) and not is_checkpoint_compatible(checkpoint,
+                                                                                  fingerprint):
+        msg = ("The checkpoint was written with other options or input files. Removing "
+               "it: {}".format(checkpoint))
+        logger.warning(msg)
+        remove_checkpoint(checkpoint)
+        is_resumed = False
+
+    # skip the work items which were completed in a previous run
+    completed = None
+    if is_resumed and os.path.exists(checkpoint):
+        truncate_checkpoint(checkpoint)
+        completed = read_checkpoint(checkpoint)
+
+        if completed is not None:
+            completed = completed.drop_duplicates(subset=[args.orf_num_field], keep='last')
+            completed = completed.set_index(args.orf_num_field, drop=False)
+
+    elif os.path.exists(checkpoint):
+        msg = ("Removing existing checkpoint: {}. Use --resume to continue "
+               "from it.".format(checkpoint))
+        logger.warning(msg)
+        remove_checkpoint(checkpoint)
+
+    write_checkpoint_fingerprint(checkpoint, fingerprint)
+
+    # the timings of a resumed run are appended to those of the previous run
+    timings_file = get_timings_filename(args.out)
+    if args.write_timings and not is_resumed and os.path.exists(timings_file):
+        os.remove(timings_file)
+
+    # an item is complete if all of its ORFs (except those which are skipped
+    # because of their length) are in the checkpoint
+    completed_items = {}
+    remaining_items = []
+    for item_index, item in enumerate(work_items):
+        m_frame = (item['orf_len'] % 3) == 0
+        orf_nums = item.loc[m_frame, args.orf_num_field]
+
+        if (completed is not None) and orf_nums.isin(completed.index).all():
+            completed_items[item_index] = completed.loc[orf_nums.values]
+        else:
+            remaining_items.append((item_index, item))
+
+    if completed is not None:
+        msg = ("Resuming from checkpoint: {}. Number of completed groups: {}. "
+               "Number of remaining groups: {}".format(checkpoint, len(completed_items),
+                                                       len(remaining_items)))
+        logger.info(msg)
+
+    # the output is streamed, in the order of the work items, to a partial file
+    # which is renamed once it is complete
+    columns = [c for c in regions.columns if c != batch_id_field] + bayes_factor_fields
+    partial_out = get_partial_filename(args.out)
+    compress = args.out.endswith('.gz') and not args.do_not_compress
+
+    # the audit of the approximate model selection, summed over all work items
+    total_selection_audit = {}
+
+    # the workers only see the profiles through the memory-mapped files, so we
+    # do not need to keep our copy around while they run
+    profiles_dir = tempfile.mkdtemp(prefix="rpbp-profiles-", dir=args.tmp)
+
+    try:
+        profile_filenames, profiles_shape = write_profile_arrays(profiles, profiles_dir)
+        del profiles
+
+        smoothed_profile_filenames = None
+        if args.smoothed_profiles is not None:
+            msg = "Reading smoothed profiles"
+            logger.info(msg)
+
+            smoothed_profiles = scipy.io.mmread(args.smoothed_profiles).tocsr()
+
+            if smoothed_profiles.shape != profiles_shape:
+                msg = ("The smoothed profiles ({}) do not match the profiles ({})".format(
+                    smoothed_profiles.shape, profiles_shape))
+                raise ValueError(msg)
+
+            smoothed_profile_filenames, _ = write_profile_arrays(smoothed_profiles, profiles_dir,
+                                                                 name='smoothed-profiles')
+            del smoothed_profiles
+
+        ctx = multiprocessing.get_context(args.start_method)
+        init_args = (profile_filenames, profiles_shape, args, smoothed_profile_filenames)
+
+        with open_bed_stream(partial_out, compress) as out_f, suppress_stdout_stderr():
+            writer = OrderedBedWriter(out_f, columns)
+
+            for item_index, bfs in completed_items.items():
+                writer.add(item_index, bfs)
+
+            del completed, completed_items
+
+            window = max(1, default_reorder_window_per_cpu * args.num_cpus)
+
+            with ctx.Pool(args.num_cpus, initializer=init_worker, initargs=init_args) as pool:
+                bfs_iter = imap_windowed(pool, get_all_bayes_factors_item, remaining_items,
+                                         writer, window)
+
+                for item_index, bfs, orf_timings, selection_audit in tqdm.tqdm(
+                        bfs_iter, total=len(remaining_items)):
+
+                    for model_class, (num_audited, num_differ) in selection_audit.items():
+                        total_audit = total_selection_audit.setdefault(model_class, [0, 0])
+                        total_audit[0] += num_audited
+                        total_audit[1] += num_differ
+
+                    if len(bfs) > 0:
+                        append_to_checkpoint(bfs, checkpoint)
+
+                    if (orf_timings is not None) and (len(orf_timings) > 0):
+                        append_to_checkpoint(orf_timings, timings_file)
+
+                    writer.add(item_index, bfs)
+
+            writer.close()
+
+    finally:
+        shutil.rmtree(profiles_dir, ignore_errors=True)
+
+    os.replace(partial_out, args.out)
+    write_shard_sidecar(shard_sidecar, args.out)
+
+    for model_class, (num_audited, num_differ) in sorted(total_selection_audit.items()):
+        msg = ("Model selection ({}) audit, {} models: the approximate choice differed "
+               "from the full sampling for {} of {} audited ORFs".format(args.model_selection,
+                                                                         model_class,
+                                                                         num_differ,
+                                                                         num_audited))
+        logger.info(msg)
+
+    if not args.keep_checkpoint:
+        remove_checkpoint(checkpoint)
+
+    # the peak resident set size (in kB on Linux) of this process and of the
+    # largest worker, to benchmark the memory usage
+    self_max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    msg = "Peak RSS. main process: {} kB, largest worker: {} kB".format(self_max_rss,
+                                                                        children_max_rss)
+    logger.info(msg)
+
+
+def main():
+    args = parse_arguments()
+    logging_utils.update_logging(args)
+
+    if args.use_slurm:
+        cmd = ' '.join(sys.argv)
+        slurm.check_sbatch(cmd, args=args)
+        return
+
+    run(args)
 
 
 if __name__ == '__main__':
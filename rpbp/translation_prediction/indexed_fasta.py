@@ -0,0 +1,280 @@
+""" Random access to the sequences of an (uncompressed) genome fasta file.
+
+The file is memory-mapped and indexed with a samtools faidx-style index
+(<fasta>.fai), which is created if it does not exist. The exons of the ORFs
+are sliced directly from the memory-mapped file, so each ORF sequence is only
+copied once, when its exons are joined. If the genome cannot be indexed, e.g.,
+because it is compressed, the sequences are extracted with
+bed_utils.get_all_bed_sequences, as before.
+"""
+
+import collections
+import logging
+import mmap
+import os
+
+import numpy as np
+
+import Bio.Seq
+
+import pbio.utils.bed_utils as bed_utils
+
+logger = logging.getLogger(__name__)
+
+# the length of the sequence, the offset of its first base, and the number of
+# bases and bytes (including the newline) of each line, as in samtools faidx
+fai_entry = collections.namedtuple('fai_entry', 'length,offset,line_bases,line_bytes')
+
+# the complement of each (IUPAC) base, preserving its case
+complement_table = bytes.maketrans(b'ACGTURYKMBDHVNacgturykmbdhvn',
+                                   b'TGCAAYRMKVHDBNtgcaayrmkvhdbn')
+
+
+def get_fai_filename(fasta_file):
+    """ This function constructs the name of the index of the fasta file.
+    """
+    return "{}.fai".format(fasta_file)
+
+
+def read_fai(fai_file):
+    """ This function reads a samtools faidx-style index.
+
+        Returns:
+            OrderedDict: a mapping from each sequence name to its fai_entry
+    """
+    index = collections.OrderedDict()
+    with open(fai_file) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            index[fields[0]] = fai_entry(*[int(field) for field in fields[1:5]])
+
+    return index
+
+
+def write_fai(index, fai_file):
+    """ This function writes the index in the samtools faidx format.
+    """
+    with open(fai_file, 'w') as f:
+        for name, entry in index.items():
+            f.write("{}\t{}\t{}\t{}\t{}\n".format(name, *entry))
+
+
+def build_fai(fasta_file):
+    """ This function indexes the fasta file. As for samtools faidx, all lines
+        of a sequence, except the last one, must have the same length.
+
+        Returns:
+            OrderedDict: a mapping from each sequence name (up to the first
+                whitespace of the header) to its fai_entry, or None if the
+                lines of some sequence do not have the same length
+    """
+    index = collections.OrderedDict()
+
+    name = None
+    length = offset = line_bases = line_bytes = 0
+    is_last_line = False
+
+    def add_entry():
+        if name is not None:
+            index[name] = fai_entry(length, offset, line_bases, line_bytes)
+
+    position = 0
+    with open(fasta_file, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                add_entry()
+
+                name = line[1:].split()[0].decode()
+                length = line_bases = line_bytes = 0
+                offset = position + len(line)
+                is_last_line = False
+
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+
+                if bases > 0:
+                    # only the last line of the sequence may be shorter
+                    if is_last_line:
+                        return None
+
+                    if line_bases == 0:
+                        line_bases = bases
+                        line_bytes = len(line)
+                    elif (bases > line_bases) or ((bases == line_bases) and
+                                                  (len(line) != line_bytes)):
+                        return None
+
+                    is_last_line = bases < line_bases
+                    length += bases
+
+                else:
+                    # blank lines are only allowed after the sequence
+                    is_last_line = True
+
+            position += len(line)
+
+    add_entry()
+    return index
+
+
+def get_fasta_index(fasta_file):
+    """ This function reads the index of the fasta file, or creates it (and
+        writes it next to the fasta file, if possible) if it does not exist or
+        if it is older than the fasta file.
+
+        Returns:
+            OrderedDict: the index, see read_fai, or None if the fasta file
+                cannot be indexed
+    """
+    if fasta_file.endswith('.gz'):
+        return None
+
+    fai_file = get_fai_filename(fasta_file)
+    if os.path.exists(fai_file) and (os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file)):
+        return read_fai(fai_file)
+
+    msg = "Indexing the fasta file: {}".format(fasta_file)
+    logger.info(msg)
+
+    index = build_fai(fasta_file)
+    if index is None:
+        msg = "The lines of some sequences do not have the same length. Could not index the fasta file."
+        logger.warning(msg)
+        return None
+
+    try:
+        write_fai(index, fai_file)
+    except OSError as e:
+        msg = "Could not write the index: {}. Error: {}".format(fai_file, e)
+        logger.warning(msg)
+
+    return index
+
+
+class IndexedFasta(object):
+    """ This class gives random access to the sequences of a fasta file with
+        its index (see get_fasta_index) through a memory map.
+    """
+    def __init__(self, fasta_file, index):
+        self.index = index
+        self.f = open(fasta_file, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+        self.f.close()
+
+    def get_segments(self, seqname, start, end):
+        """ This function gives the bases [start, end) (base-0) of the sequence
+            as memoryviews of the fasta file, one for each line.
+        """
+        if seqname not in self.index:
+            msg = "Could not find the sequence in the fasta file: {}".format(seqname)
+            raise ValueError(msg)
+
+        entry = self.index[seqname]
+        if (start < 0) or (end > entry.length) or (start > end):
+            msg = "Invalid interval for the sequence {} (length {}): [{}, {})".format(
+                seqname, entry.length, start, end)
+            raise ValueError(msg)
+
+        position = start
+        while position < end:
+            line, column = divmod(position, entry.line_bases)
+            num_bases = min(entry.line_bases - column, end - position)
+
+            file_position = entry.offset + line * entry.line_bytes + column
+            yield self.view[file_position:file_position+num_bases]
+
+            position += num_bases
+
+    def get_bed_sequence(self, seqname, start, strand, exon_lengths, exon_relative_starts):
+        """ This function joins the exons of a (BED12) feature, and takes the
+            reverse complement for features on the reverse strand.
+
+            Returns:
+                bytes: the sequence of the feature
+        """
+        segments = []
+        for exon_length, exon_relative_start in zip(exon_lengths, exon_relative_starts):
+            exon_start = start + exon_relative_start
+            segments.extend(self.get_segments(seqname, exon_start, exon_start + exon_length))
+
+        sequence = b''.join(segments)
+
+        if strand == '-':
+            sequence = sequence.translate(complement_table)[::-1]
+
+        return sequence
+
+
+def get_all_bed_sequences(bed, fasta_file):
+    """ This function extracts the sequences of all (BED12) features in bed
+        from the genome, with their exons joined, as
+        bed_utils.get_all_bed_sequences with split_exons.
+
+        Args:
+            bed (pd.DataFrame): the features
+
+            fasta_file (string): the genome fasta file
+
+        Returns:
+            list of (id, sequence) tuples: the sequence of each feature, in
+                the order of bed
+    """
+    index = get_fasta_index(fasta_file)
+
+    if index is None:
+        msg = "Extracting the sequences without the index"
+        logger.warning(msg)
+
+        split_exons = True
+        return bed_utils.get_all_bed_sequences(bed, fasta_file, split_exons)
+
+    sequences = []
+    with IndexedFasta(fasta_file, index) as fasta:
+        features = zip(bed['id'], bed['seqname'], bed['start'], bed['strand'],
+                       bed['exon_lengths'], bed['exon_genomic_relative_starts'])
+
+        for (feature_id, seqname, start, strand, exon_lengths,
+             exon_relative_starts) in features:
+
+            exon_lengths = np.fromstring(exon_lengths, sep=',', dtype=int)
+            exon_relative_starts = np.fromstring(exon_relative_starts, sep=',', dtype=int)
+
+            sequence = fasta.get_bed_sequence(seqname, int(start), strand, exon_lengths,
+                                              exon_relative_starts)
+
+            sequences.append((feature_id, sequence.decode()))
+
+    return sequences
+
+
+def translate_sequences(sequences):
+    """ This function translates the (DNA) sequences into protein sequences.
+        Identical sequences, e.g., of the same ORF on different transcripts,
+        are only translated once.
+
+        Args:
+            sequences (iterable of (id, sequence) tuples): the DNA sequences
+
+        Returns:
+            list of (id, sequence) tuples: the protein sequences
+    """
+    translations = {}
+    protein_sequences = []
+    for sequence_id, sequence in sequences:
+        if sequence not in translations:
+            translations[sequence] = Bio.Seq.translate(sequence)
+
+        protein_sequences.append((sequence_id, translations[sequence]))
+
+    return protein_sequences
@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import pbio.misc.logging_utils as logging_utils
+
+import rpbp.translation_prediction.estimate_orf_bayes_factors as estimate_orf_bayes_factors
+
+logger = logging.getLogger(__name__)
+
+default_orf_num_field = 'orf_num'
+
+
+def read_shard_sidecar(shard_file):
+    """ This function reads the description of the shard written by
+        estimate-orf-bayes-factors --shard.
+    """
+    sidecar = estimate_orf_bayes_factors.get_shard_sidecar_filename(shard_file)
+
+    if not os.path.exists(sidecar):
+        msg = ("Could not find the description of the shard: {}. The shard may "
+               "not be complete.".format(sidecar))
+        raise ValueError(msg)
+
+    with open(sidecar) as f:
+        shard_sidecar = json.load(f)
+
+    return shard_sidecar
+
+
+def read_shard(shard_file):
+    """ This function reads the Bayes factors of a shard as text, so each value
+        is written to the merged file exactly as the shard wrote it. Parsing
+        and formatting the floats again may change their last digit, and the
+        merged file would then differ from the output without shards.
+    """
+    return pd.read_csv(shard_file, sep='\t', dtype=str, keep_default_na=False)
+
+
+def check_shards(shard_sidecars):
+    """ This function checks that the shards are all of the shards of the
+        same partition, each given exactly once.
+    """
+    num_shards = {s['num_shards'] for s in shard_sidecars}
+    fingerprints = {s['fingerprint'] for s in shard_sidecars}
+
+    if (len(num_shards) != 1) or (len(fingerprints) != 1):
+        msg = ("The shards are not from the same partition. Please ensure all "
+               "shards were created with the same ORFs, profiles and filters.")
+        raise ValueError(msg)
+
+    num_shards = num_shards.pop()
+    shards = sorted(s['shard'] for s in shard_sidecars)
+
+    if shards != list(range(1, num_shards+1)):
+        missing = sorted(set(range(1, num_shards+1)) - set(shards))
+        msg = ("Expected each of the {} shards exactly once. Found: {}. Missing: {}".format(
+            num_shards, shards, missing))
+        raise ValueError(msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script merges the shards created by
+        estimate-orf-bayes-factors --shard i/N. It checks that all N shards of the same
+        partition are given, and that each shard contains exactly the ORFs assigned to it.
+        The merged file has the same order as the output without shards, i.e., the order of
+        the work items (the ORFs which are not batched, followed by the batches).""")
+
+    parser.add_argument('shards', help="The Bayes' factors of all of the shards (BED12+)",
+                        nargs='+')
+
+    parser.add_argument('out', help="The output file for the Bayes' factors (BED12+)")
+
+    parser.add_argument('--orf-num-field', default=default_orf_num_field)
+
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args()
+    logging_utils.update_logging(args)
+
+    msg = "Reading the shard descriptions"
+    logger.info(msg)
+
+    shard_sidecars = [read_shard_sidecar(shard_file) for shard_file in args.shards]
+    check_shards(shard_sidecars)
+
+    msg = "Reading and checking the shards"
+    logger.info(msg)
+
+    all_bfs = []
+    all_output_positions = []
+
+    for shard_file, shard_sidecar in zip(args.shards, shard_sidecars):
+        bfs = read_shard(shard_file)
+
+        if 'output_positions' not in shard_sidecar:
+            msg = ("The description of the shard {} does not include the positions of its "
+                   "ORFs in the output. Please run the shard again.".format(shard_file))
+            raise ValueError(msg)
+
+        expected = pd.Series(shard_sidecar['output_positions'], index=shard_sidecar['orf_nums'])
+        orf_nums = bfs[args.orf_num_field].astype(int)
+
+        if (len(orf_nums) != len(expected)) or not orf_nums.isin(expected.index).all():
+            msg = ("The shard {} does not contain the expected ORFs. Expected: {}. "
+                   "Found: {}.".format(shard_file, len(expected), len(orf_nums)))
+            raise ValueError(msg)
+
+        if orf_nums.duplicated().any():
+            msg = "The shard {} contains duplicate ORFs.".format(shard_file)
+            raise ValueError(msg)
+
+        all_bfs.append(bfs)
+        all_output_positions.append(expected.reindex(orf_nums).values)
+
+    msg = "Merging the shards"
+    logger.info(msg)
+
+    bfs = pd.concat(all_bfs, ignore_index=True)
+    output_positions = np.concatenate(all_output_positions)
+
+    bfs = bfs.iloc[np.argsort(output_positions, kind='mergesort')]
+
+    msg = "Number of ORFs: {}".format(len(bfs))
+    logger.info(msg)
+
+    # the header is kept as is, i.e., starting with '#', as in bed_utils.write_bed
+    bfs.to_csv(args.out, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,371 @@
 #! /usr/bin/env python3
 
 import argparse
+import gzip
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
 import scipy.io
 
 import pbio.misc.logging_utils as logging_utils
 import pbio.misc.math_utils as math_utils
 
+from rpbp.defaults import default_num_cpus
+
 logger = logging.getLogger(__name__)
 
+# the number of entries read from each file at once when streaming
+default_chunk_size = 1000000
+
+
+class UnsortedProfilesError(Exception):
+    """ This exception is raised if the entries of a profile file are not
+        sorted by row, so the files cannot be merged as streams.
+    """
+    pass
+
+
+def open_text(filename, mode='rt'):
+    """ This function opens a (possibly gzipped) text file.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+def read_mtx_header(f):
+    """ This function reads the header and the size line of a matrix market
+        file, and leaves f at the first entry.
+
+        Returns:
+            tuple: the shape of the matrix and the number of entries, or None
+                if the file is not a general, real or integer, coordinate matrix
+    """
+    banner = f.readline().lower().split()
+    if (banner[2:3] != ['coordinate']) or (banner[3:4] not in [['real'], ['integer']]) or \
+            (banner[4:5] != ['general']):
+        return None
+
+    line = f.readline()
+    while line.startswith('%'):
+        line = f.readline()
+
+    num_rows, num_cols, num_entries = [int(field) for field in line.split()]
+    return (num_rows, num_cols), num_entries
+
+
+def iterate_mtx_chunks(profile_file, chunk_size=default_chunk_size):
+    """ This function reads the entries of a matrix market file in chunks, and
+        checks that they are sorted by row.
+
+        Yields:
+            tuple of np.arrays: the rows, columns and values (base-1 indices)
+    """
+    with open_text(profile_file) as f:
+        # skip the header; it is checked in main
+        read_mtx_header(f)
+
+        entries = pd.read_csv(f, delim_whitespace=True, header=None, comment='%',
+                              names=['row', 'col', 'value'], chunksize=chunk_size)
+
+        last_row = 0
+        for chunk in entries:
+            rows = chunk['row'].values
+            if len(rows) == 0:
+                continue
+
+            if (rows[0] < last_row) or np.any(np.diff(rows) < 0):
+                msg = "The entries are not sorted by row: {}".format(profile_file)
+                raise UnsortedProfilesError(msg)
+
+            last_row = rows[-1]
+            yield rows, chunk['col'].values, chunk['value'].values.astype(float)
+
+
+def merge_entries(entries, f):
+    """ This function sums the values of the entries with the same row and
+        column, and writes them, sorted by row and column, to f.
+
+        Args:
+            entries (list of tuples of np.arrays): the rows, columns and
+                (weighted) values
+
+            f (file-like): the (text) output
+
+        Returns:
+            int: the number of (non-zero) entries written
+    """
+    entries = [e for e in entries if len(e[0]) > 0]
+    if len(entries) == 0:
+        return 0
+
+    rows = np.concatenate([e[0] for e in entries])
+    cols = np.concatenate([e[1] for e in entries])
+    values = np.concatenate([e[2] for e in entries])
+
+    order = np.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    values = values[order]
+
+    m_first = np.ones(len(rows), dtype=bool)
+    m_first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    starts = np.where(m_first)[0]
+
+    rows = rows[starts]
+    cols = cols[starts]
+    values = np.add.reduceat(values, starts)
+
+    m_nonzero = values != 0
+    rows = rows[m_nonzero]
+    cols = cols[m_nonzero]
+    values = values[m_nonzero]
+
+    merged_entries = pd.DataFrame({
+        'row': rows,
+        'col': cols,
+        'value': values
+    }, columns=['row', 'col', 'value'])
+
+    merged_entries.to_csv(f, sep=' ', header=False, index=False, float_format='%.17g')
+
+    return len(merged_entries)
+
+
+def stream_merge(profile_files, weights, f, chunk_size=default_chunk_size):
+    """ This function merges the (row-sorted) profile files as a k-way merge of
+        blocks of rows: all of the entries in rows before the smallest last row
+        read from any file are complete, so they are merged and written, and
+        then more entries are read from the file(s) which limited the block.
+        Thus, at most about one chunk of each file is in memory at once.
+
+        Args:
+            profile_files (list of strings): the (mtx) profile files
+
+            weights (list of floats): the weight of each file
+
+            f (file-like): the (text) output for the merged entries
+
+            chunk_size (int): the number of entries read from a file at once
+
+        Returns:
+            int: the number of entries written
+
+        Raises:
+            UnsortedProfilesError: if the entries of any file are not sorted by row
+    """
+    readers = [iterate_mtx_chunks(profile_file, chunk_size) for profile_file in profile_files]
+    buffers = [(np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))] * len(readers)
+    is_exhausted = [False] * len(readers)
+
+    def read_chunk(k):
+        chunk = next(readers[k], None)
+        if chunk is None:
+            is_exhausted[k] = True
+            return
+
+        rows, cols, values = chunk
+        buffer_rows, buffer_cols, buffer_values = buffers[k]
+
+        buffers[k] = (
+            np.concatenate([buffer_rows, rows]),
+            np.concatenate([buffer_cols, cols]),
+            np.concatenate([buffer_values, weights[k] * values])
+        )
+
+    for k in range(len(readers)):
+        read_chunk(k)
+
+    num_entries = 0
+    while True:
+        last_rows = [
+            np.inf if is_exhausted[k] else buffers[k][0][-1] for k in range(len(readers))
+        ]
+        bound = min(last_rows)
+
+        block = []
+        for k, (rows, cols, values) in enumerate(buffers):
+            end = np.searchsorted(rows, bound, side='left')
+            block.append((rows[:end], cols[:end], values[:end]))
+            buffers[k] = (rows[end:], cols[end:], values[end:])
+
+        num_entries += merge_entries(block, f)
+
+        if bound == np.inf:
+            break
+
+        for k in range(len(readers)):
+            if last_rows[k] == bound:
+                read_chunk(k)
+
+    return num_entries
+
+
+def read_weighted_profiles(profile_file_and_weight):
+    """ This function reads a profile file and applies its weight.
+    """
+    profile_file, weight = profile_file_and_weight
+    profiles = scipy.io.mmread(profile_file).tocsr()
+
+    if weight != 1:
+        profiles = profiles.astype(float) * weight
+
+    return profiles
+
+
+def merge_in_memory(profile_files, weights, num_cpus):
+    """ This function reads the profile files in parallel, and adds each
+        matrix to the sum as soon as it has been read.
+
+        Returns:
+            scipy.sparse.csr_matrix: the merged profiles
+    """
+    merged_profiles = None
+    with multiprocessing.Pool(num_cpus) as pool:
+        all_profiles = pool.imap(read_weighted_profiles, zip(profile_files, weights))
+
+        for profile_file, profiles in zip(profile_files, all_profiles):
+            msg = "Adding file: {}".format(profile_file)
+            logger.info(msg)
+
+            if merged_profiles is None:
+                merged_profiles = profiles
+            else:
+                merged_profiles = merged_profiles + profiles
+
+    return merged_profiles
+
+
+def read_merged_profiles(profile_files, num_cpus=default_num_cpus, weights=None):
+    """ This function reads the profiles of one or more replicates and adds
+        them in memory, so the merged profiles do not have to be written to
+        disk (and read again) before they are used.
+
+        Args:
+            profile_files (list of strings): the (mtx) profile files
+
+            num_cpus (int): the number of files read in parallel
+
+            weights (list of floats): the weight of each file. If not given,
+                the profiles are simply added.
+
+        Returns:
+            scipy.sparse.csr_matrix: the merged profiles
+    """
+    if weights is None:
+        weights = [1] * len(profile_files)
+
+    if len(profile_files) == 1:
+        return read_weighted_profiles((profile_files[0], weights[0]))
+
+    shapes = set()
+    for profile_file in profile_files:
+        with open_text(profile_file) as f:
+            header = read_mtx_header(f)
+
+        if header is not None:
+            shapes.add(header[0])
+
+    if len(shapes) > 1:
+        msg = "The profile files do not have the same shape: {}".format(shapes)
+        raise ValueError(msg)
+
+    return merge_in_memory(profile_files, weights, num_cpus)
+
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      description="""This script adds the ORF profiles from a set
-        of profiles (presumably, each file corresponds to one replicate from a condition). 
-        The script keeps the profiles in sparse matrix format, so it is fairly efficient.""")
+        of profiles (presumably, each file corresponds to one replicate from a condition).
+        If the entries of each file are sorted by row (as written by the pipeline), the files
+        are merged as streams, so only a chunk of each file is in memory at once. Otherwise,
+        the files are read in parallel and the sparse matrices are added.""")
 
     parser.add_argument('profiles', help="The (mtx) files containing the ORF profiles", nargs='+')
 
     parser.add_argument('out', help="The (mtx.gz) output file containing the merged profiles")
-    
+
+    parser.add_argument('--weights', help="""The weight of each profile file, e.g., for
+        library-size-normalized merging. If not given, the profiles are simply added.""",
+                        type=float, nargs='+', default=None)
+
+    parser.add_argument('-p', '--num-cpus', help="""The number of files read in parallel,
+        if the files cannot be merged as streams""", type=int, default=default_num_cpus)
+
+    parser.add_argument('--chunk-size', help="""The number of entries read from a file
+        at once when merging the files as streams""", type=int, default=default_chunk_size)
+
     logging_utils.add_logging_options(parser)
     args = parser.parse_args()
     logging_utils.update_logging(args)
 
-    msg = "Reading first ORF profile"
-    logger.info(msg)
+    weights = args.weights
+    if weights is None:
+        weights = [1] * len(args.profiles)
+
+    if len(weights) != len(args.profiles):
+        msg = "The number of weights ({}) does not match the number of profile files ({})".format(
+            len(weights), len(args.profiles))
+        raise ValueError(msg)
 
-    merged_profiles = scipy.io.mmread(args.profiles[0]).tocsr()
+    # the shapes are taken from the headers, so the files are only merged as
+    # streams if they are all (real or integer) coordinate matrices
+    headers = []
+    for profile_file in args.profiles:
+        with open_text(profile_file) as f:
+            headers.append(read_mtx_header(f))
 
-    msg = "Adding each additional profile"
-    logger.info(msg)
+    is_streamable = all(header is not None for header in headers)
 
-    for profile_file in args.profiles[1:]:
-        msg = "Reading file: {}".format(profile_file)
+    if is_streamable:
+        shapes = {header[0] for header in headers}
+        if len(shapes) != 1:
+            msg = "The profile files do not have the same shape: {}".format(shapes)
+            raise ValueError(msg)
+
+        shape = shapes.pop()
+
+        msg = "Merging the profiles as streams"
+        logger.info(msg)
+
+        out_dir = os.path.dirname(os.path.abspath(args.out))
+        with tempfile.NamedTemporaryFile('w+', dir=out_dir, suffix='.entries', delete=False) as entries:
+            entries_file = entries.name
+
+        try:
+            with open(entries_file, 'w') as entries:
+                num_entries = stream_merge(args.profiles, weights, entries, args.chunk_size)
+
+            # the number of entries is only known now, so the header is written
+            # before copying the entries to the output
+            with open_text(args.out, 'wt') as out, open(entries_file) as entries:
+                out.write("%%MatrixMarket matrix coordinate real general\n")
+                out.write("{} {} {}\n".format(shape[0], shape[1], num_entries))
+                shutil.copyfileobj(entries, out)
+
+        except UnsortedProfilesError as e:
+            msg = "{}. Merging the profiles in memory.".format(e)
+            logger.warning(msg)
+            is_streamable = False
+
+        finally:
+            os.remove(entries_file)
+
+    if not is_streamable:
+        msg = "Reading and adding the profiles"
         logger.info(msg)
 
-        profiles = scipy.io.mmread(profile_file).tocsr()
-        merged_profiles = merged_profiles + profiles
+        merged_profiles = merge_in_memory(args.profiles, weights, args.num_cpus)
 
-    msg = "Writing merged profiles to disk"
-    logger.info(msg)
+        msg = "Writing merged profiles to disk"
+        logger.info(msg)
 
-    math_utils.write_sparse_matrix(args.out, merged_profiles)
+        math_utils.write_sparse_matrix(args.out, merged_profiles)
 
 
 if __name__ == '__main__':
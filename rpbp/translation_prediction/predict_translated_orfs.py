@@ -1,19 +1,23 @@
 #! /usr/bin/env python3
 
 import logging
+import os
+import shlex
+import subprocess
 import sys
 import argparse
 
-import yaml
-
 import pbio.misc.logging_utils as logging_utils
 import pbio.misc.shell_utils as shell_utils
+import pbio.misc.slurm as slurm
 import pbio.misc.utils as utils
 
-import pbio.ribo.ribo_utils as ribo_utils
 import pbio.ribo.ribo_filenames as filenames
 
-from rpbp.defaults import default_num_cpus, translation_options, metagene_options
+from rpbp.defaults import default_num_cpus, default_mem, translation_options, metagene_options
+
+import rpbp.pipeline_runner as pipeline_runner
+import rpbp.run_manifest as run_manifest
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +31,8 @@ def get_profile(name, config, args):
     # keep multimappers?
     is_unique = not ('keep_riboseq_multimappers' in config)
 
+    import pbio.ribo.ribo_utils as ribo_utils
+
     # get the lengths and offsets which meet the required criteria from the config file
     lengths, offsets = ribo_utils.get_periodic_lengths_and_offsets(config,
                                                                    name,
@@ -50,30 +56,140 @@ def get_profile(name, config, args):
     return profiles
 
 
+def estimate_sharded_bayes_factors(profiles, orfs_genomic, bayes_factors, estimate_options_str,
+                                   num_shards, args, call, merged_profiles=None):
+    """ This function runs the shards of estimate-orf-bayes-factors as local
+        processes, which share the available CPUs, and then merges them. With
+        --use-slurm, each shard is submitted as a separate job instead, and
+        the merge is submitted as a job which depends on them. If
+        merged_profiles is given, the first shard writes the merged profiles,
+        so it is only skipped if they also exist.
+
+        Returns:
+            list: the id of the (SLURM) job which merges the shards, or an
+                empty list if the shards are run locally or nothing is submitted
+    """
+    is_merged_profiles_missing = ((merged_profiles is not None) and
+                                  not os.path.exists(merged_profiles))
+
+    if os.path.exists(bayes_factors) and not is_merged_profiles_missing and not args.overwrite:
+        msg = "The Bayes factors already exist: {}. Skipping.".format(bayes_factors)
+        logger.warning(msg)
+        return []
+
+    import rpbp.translation_prediction.estimate_orf_bayes_factors as estimate_orf_bayes_factors
+
+    # the jobs do not share the CPUs
+    num_cpus = args.num_cpus
+    if not args.use_slurm:
+        num_cpus = max(1, args.num_cpus // num_shards)
+
+    shard_files = []
+    shard_cmds = []
+
+    for shard in range(1, num_shards+1):
+        shard_file = estimate_orf_bayes_factors.get_shard_filename(bayes_factors, shard, num_shards)
+        shard_files.append(shard_file)
+
+        sidecar = estimate_orf_bayes_factors.get_shard_sidecar_filename(shard_file)
+
+        # the first shard writes the merged profiles
+        writes_merged_profiles = (shard == 1) and (merged_profiles is not None)
+
+        # the sidecar is only written once the shard is complete
+        is_complete = os.path.exists(sidecar) and not (writes_merged_profiles and
+                                                       is_merged_profiles_missing)
+
+        if is_complete and not args.overwrite:
+            msg = "The shard already exists: {}. Skipping.".format(shard_file)
+            logger.warning(msg)
+            continue
+
+        cmd = "estimate-orf-bayes-factors {} {} {} {} --shard {}/{} --num-cpus {}".format(
+            profiles, orfs_genomic, shard_file, estimate_options_str, shard, num_shards, num_cpus)
+
+        if writes_merged_profiles:
+            cmd = "{} --write-merged-profiles {}".format(cmd, merged_profiles)
+
+        shard_cmds.append(cmd)
+
+    merge_cmd = "merge-orf-bayes-factors {} {} {}".format(
+        ' '.join(shard_files), bayes_factors, logging_utils.get_logging_options_string(args))
+
+    if args.use_slurm:
+        job_ids = [slurm.check_sbatch(cmd, args=args) for cmd in shard_cmds]
+        merge_job_id = slurm.check_sbatch(merge_cmd, args=args, dependencies=job_ids)
+        return [merge_job_id]
+
+    def run_shards():
+        processes = []
+        for cmd in shard_cmds:
+            logger.info(cmd)
+            if call:
+                processes.append((cmd, subprocess.Popen(shlex.split(cmd))))
+
+        for cmd, process in processes:
+            ret = run_manifest.wait(process)
+            if ret != 0:
+                raise subprocess.CalledProcessError(ret, cmd)
+
+    # the shards run at once, so they are recorded as a single step
+    if len(shard_cmds) > 0:
+        cmd = "estimate-orf-bayes-factors --shard (x{})".format(len(shard_cmds))
+        run_manifest.record_step(cmd, shard_files, run_shards, call=call)
+
+    file_checkers = {
+        bayes_factors: utils.check_gzip_file
+    }
+    pipeline_runner.call_if_not_exists(merge_cmd, [bayes_factors], in_files=shard_files,
+                                       file_checkers=file_checkers,
+                                       overwrite=args.overwrite, call=call)
+
+    return []
+
+
 def main():
     
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      description=""""This script runs the second part of the pipeline:
-        it estimate ORF Bayes factors using the ORF profiles, then make the final prediction set.""")
+        it estimate ORF Bayes factors using the ORF profiles, then make the final prediction set.
+        With --use-slurm, the estimation of the Bayes factors (each shard, if num_shards is
+        given in the config file, and their merge) and the selection of the prediction set are
+        submitted as jobs, each depending on the previous ones.""")
 
     parser.add_argument('config', help="The (yaml) config file")
 
     parser.add_argument('name', help="The name for the dataset, used in the created files")
 
-    parser.add_argument('-p', '--num-cpus', help="The number of processors to use",
-                        type=int, default=default_num_cpus)
-    
-    parser.add_argument('--do-not-call', action='store_true')
-
     parser.add_argument('--overwrite', help="If this flag is present, existing files will be overwritten.",
                         action='store_true')
 
+    parser.add_argument('--in-process', help="""If this flag is present, then the python
+        steps (e.g., estimate-orf-bayes-factors) are called in this process rather than in
+        new processes, and they share the config, ORFs and profiles once they are read.""",
+                        action='store_true')
+
     parser.add_argument('--merge-replicates', help="""If this flag is present, then the ORF profiles 
         will be merged for all replicates in the condition given by <name>. The filenames, etc., 
         will reflect the condition name, but not the lengths and offsets of the individual replicates.
-        N.B. If this flag is is present, the --overwrite flag will automatically be set!""",
+        The profiles are added in memory by estimate-orf-bayes-factors (and smooth-orf-profiles).""",
                         action='store_true')
         
+    parser.add_argument('--manifest', help="""The JSON run manifest, with the wall time,
+        CPU time, peak memory, I/O and output sizes of each step. If not given, this is
+        written to <riboseq_data>/manifests/<name>.predict-translated-orfs.<time>.json.""", default=None)
+
+    steps_group = parser.add_mutually_exclusive_group()
+
+    steps_group.add_argument('--bayes-factors-only', help="""If this flag is present, then
+        only the Bayes factors will be estimated""", action='store_true')
+
+    steps_group.add_argument('--predictions-only', help="""If this flag is present, then
+        only the prediction sets will be selected, from the existing Bayes factors. This
+        step is light, so it can run as a separate job with fewer resources.""",
+                             action='store_true')
+
+    slurm.add_sbatch_options(parser, num_cpus=default_num_cpus, mem=default_mem)
     logging_utils.add_logging_options(parser)
     args = parser.parse_args()
     logging_utils.update_logging(args)
@@ -83,7 +199,10 @@ def main():
 
     logging_str = logging_utils.get_logging_options_string(args)
 
-    config = yaml.load(open(args.config), Loader=yaml.FullLoader)
+    if args.in_process:
+        pipeline_runner.enable()
+
+    config = pipeline_runner.load_config(args.config)
     call = not args.do_not_call
 
     # check that all of the necessary programs are callable
@@ -101,6 +220,12 @@ def main():
     ]
     utils.check_keys_exist(config, required_keys)
 
+    manifest = args.manifest
+    if manifest is None:
+        manifest = run_manifest.get_manifest_filename(config['riboseq_data'], args.name,
+                                                      'predict-translated-orfs')
+    run_manifest.start_manifest('predict-translated-orfs', args.name)
+
     note_str = config.get('note', None)
 
     # we always need the ORFs
@@ -133,14 +258,15 @@ def main():
 
     # first, check if we are merging replicates
 
+    # ribo_utils (and estimate_orf_bayes_factors) import pandas, scipy, etc.,
+    # so they are only imported when they are needed
+    import pbio.ribo.ribo_utils as ribo_utils
+
     # either way, the following variables need to have values for the rest of
-    # the pipeline: lengths, offsets, smooth_profiles
+    # the pipeline: lengths, offsets, profile_files
+    merged_profiles = None
+    write_merged_profiles_str = ""
     if args.merge_replicates:
-        msg = "The --merge-replicates option was given, so --overwrite is being set to True."
-        logger.warning(msg)
-        args.overwrite = True
-
-        # now, actually merge the replicates
         riboseq_replicates = ribo_utils.get_riboseq_replicates(config)
 
         # we will not use the lengths and offsets in the filenames
@@ -152,30 +278,19 @@ def main():
             get_profile(name, config, args) for name in riboseq_replicates[args.name]
         ]
 
-        replicate_profiles_str = ' '.join(replicate_profiles)
+        # the replicate profiles are added when they are read, so the merged
+        # profiles are only written (from memory) for the analysis scripts
+        profile_files = replicate_profiles
 
-        profiles = filenames.get_riboseq_profiles(config['riboseq_data'],
-                                                  args.name,
-                                                  length=lengths,
-                                                  offset=offsets,
-                                                  is_unique=is_unique,
-                                                  note=note_str)
+        if 'skip_merged_profiles' not in config:
+            merged_profiles = filenames.get_riboseq_profiles(config['riboseq_data'],
+                                                             args.name,
+                                                             length=lengths,
+                                                             offset=offsets,
+                                                             is_unique=is_unique,
+                                                             note=note_str)
 
-        cmd = "merge-replicate-orf-profiles {} {} {}".format(replicate_profiles_str,
-                                                             profiles,
-                                                             logging_str)
-
-        in_files = replicate_profiles
-        out_files = [profiles]
-
-        # todo: implement file checker for mtx files
-        shell_utils.call_if_not_exists(
-            cmd, 
-            out_files, 
-            in_files=in_files, 
-            overwrite=args.overwrite, 
-            call=call
-        )
+            write_merged_profiles_str = "--write-merged-profiles {}".format(merged_profiles)
 
     else:
         # otherwise, just treat things as normal
@@ -187,8 +302,10 @@ def main():
                                                                        is_unique=is_unique,
                                                                        default_params=metagene_options)
         
-        profiles = get_profile(args.name, config, args)
-        
+        profile_files = [get_profile(args.name, config, args)]
+
+    profiles = ' '.join(profile_files)
+
     # estimate the bayes factors
     bayes_factors = filenames.get_riboseq_bayes_factors(
         config['riboseq_data'], 
@@ -229,8 +346,19 @@ def main():
     
     # parse out all of the options from the config file, if they are present
     models_base = config.get('models_base', default_models_base)
-    translated_models = filenames.get_models(models_base, 'translated')
-    untranslated_models = filenames.get_models(models_base, 'untranslated')
+
+    # the sufficient statistics variants of the models give the same Bayes
+    # factors, but the sampling cost does not depend on the ORF length
+    translated_model_type = 'translated'
+    untranslated_model_type = 'untranslated'
+    sufficient_statistics_str = ""
+    if 'use_sufficient_statistics' in config:
+        translated_model_type = 'translated_sufficient_statistics'
+        untranslated_model_type = 'untranslated_sufficient_statistics'
+        sufficient_statistics_str = "--use-sufficient-statistics"
+
+    translated_models = filenames.get_models(models_base, translated_model_type)
+    untranslated_models = filenames.get_models(models_base, untranslated_model_type)
 
     translated_models_str = ' '.join(translated_models)
     untranslated_models_str = ' '.join(untranslated_models)
@@ -239,6 +367,27 @@ def main():
         translated_models_str)
     untranslated_models_str = "--untranslated-models {}".format(
         untranslated_models_str)
+
+    # short ORFs are fit in batches with the batched variants of the models
+    batched_models = []
+    batched_models_str = ""
+    batch_max_length = config.get('orf_batch_max_length',
+                                  translation_options['orf_batch_max_length'])
+    if batch_max_length > 0:
+        batched_translated_models = filenames.get_models(models_base, 'translated_batched')
+        batched_untranslated_models = filenames.get_models(models_base, 'untranslated_batched')
+        batched_models = batched_translated_models + batched_untranslated_models
+
+        batch_size_str = utils.get_config_argument(config,
+                                                   'orf_batch_size',
+                                                   'batch-size',
+                                                   default=translation_options['orf_batch_size'])
+
+        batched_models_str = ("--batched-translated-models {} --batched-untranslated-models {} "
+                              "--batch-max-length {} {}".format(' '.join(batched_translated_models),
+                                                                ' '.join(batched_untranslated_models),
+                                                                batch_max_length,
+                                                                batch_size_str))
     
     orf_types_str = utils.get_config_argument(config,
                                               'orf_types',
@@ -257,45 +406,158 @@ def main():
                                                'iterations',
                                                default=translation_options['translation_iterations'])
 
-    cmd = ("estimate-orf-bayes-factors {} {} {} {} {} {} {} {} {} {} {} "
-           "{} {} {} {} {} --num-cpus {}".format(profiles,
-                                                 orfs_genomic,
-                                                 bayes_factors,
-                                                 translated_models_str,
-                                                 untranslated_models_str,
-                                                 logging_str,
-                                                 orf_types_str,
-                                                 min_length_str,
-                                                 max_length_str,
-                                                 min_profile_str,
-                                                 fraction_str,
-                                                 reweighting_iterations_str,
-                                                 seed_str,
-                                                 iterations_str,
-                                                 chains_str,
-                                                 chi_square_only_str,
-                                                 args.num_cpus))
+    warmup_str = utils.get_config_argument(config,
+                                           'translation_warmup',
+                                           'warmup',
+                                           default=translation_options['translation_warmup'])
+
+    init_from_moments_str = ""
+    if 'init_from_moments' in config:
+        init_from_moments_str = "--init-from-moments"
+
+    model_selection_str = utils.get_config_argument(config,
+                                                    'model_selection',
+                                                    default=translation_options['model_selection'])
+
+    pilot_iterations_str = utils.get_config_argument(
+        config,
+        'model_selection_pilot_iterations',
+        'pilot-iterations',
+        default=translation_options['model_selection_pilot_iterations']
+    )
+
+    audit_rate_str = utils.get_config_argument(
+        config,
+        'model_selection_audit_rate',
+        default=translation_options['model_selection_audit_rate']
+    )
+
+    write_timings_str = ""
+    if 'write_orf_timings' in config:
+        write_timings_str = "--write-timings"
+
+    # smooth all of the profiles once, so reruns do not need to smooth them again;
+    # they are not needed if only the predictions are selected
+    smoothed_profiles_str = ""
+    smoothed_profiles_files = []
+    is_smoothed = ('store_smoothed_profiles' in config) and not chi_square_only
+    if is_smoothed and not args.predictions_only:
+        smoothed_profiles = filenames.get_riboseq_profiles(
+            config['riboseq_data'],
+            args.name,
+            length=lengths,
+            offset=offsets,
+            is_unique=is_unique,
+            note=note_str,
+            is_smooth=True,
+            fraction=fraction_name,
+            reweighting_iterations=reweighting_iterations_name
+        )
+
+        cmd = "smooth-orf-profiles {} {} {} {} {} {}".format(profiles,
+                                                             orfs_genomic,
+                                                             smoothed_profiles,
+                                                             fraction_str,
+                                                             reweighting_iterations_str,
+                                                             logging_str)
+
+        in_files = profile_files + [orfs_genomic]
+        out_files = [smoothed_profiles]
+        pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                           overwrite=args.overwrite, call=call)
+
+        smoothed_profiles_str = "--smoothed-profiles {}".format(smoothed_profiles)
+        smoothed_profiles_files = [smoothed_profiles]
+
+    # continue from the checkpoint of an interrupted run, unless we overwrite;
+    # it is discarded if it was written with other options or input files
+    resume_str = ""
+    if not args.overwrite:
+        resume_str = "--resume"
+
+    estimate_options_str = ("{} {} {} {} {} {} {} {} {} {} {} {} "
+                            "{} {} {} {} {} {} {} {} {} {} {}".format(translated_models_str,
+                                                             untranslated_models_str,
+                                                             logging_str,
+                                                             orf_types_str,
+                                                             min_length_str,
+                                                             max_length_str,
+                                                             min_profile_str,
+                                                             fraction_str,
+                                                             reweighting_iterations_str,
+                                                             smoothed_profiles_str,
+                                                             seed_str,
+                                                             iterations_str,
+                                                             warmup_str,
+                                                             init_from_moments_str,
+                                                             model_selection_str,
+                                                             pilot_iterations_str,
+                                                             audit_rate_str,
+                                                             chains_str,
+                                                             chi_square_only_str,
+                                                             sufficient_statistics_str,
+                                                             batched_models_str,
+                                                             write_timings_str,
+                                                             resume_str))
     
-    in_files = [profiles, orfs_genomic]
+    in_files = profile_files + [orfs_genomic]
     in_files.extend(translated_models)
     in_files.extend(untranslated_models)
+    in_files.extend(batched_models)
+    in_files.extend(smoothed_profiles_files)
     out_files = [bayes_factors]
+    if merged_profiles is not None:
+        out_files.append(merged_profiles)
+
     file_checkers = {
         bayes_factors: utils.check_gzip_file
     }
     msg = "estimate-bayes-factors in_files: {}".format(in_files)
     logger.debug(msg)
-    shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                   file_checkers=file_checkers,
-                                   overwrite=args.overwrite, call=call)
 
+    # with --use-slurm, the (SLURM) jobs which create the Bayes factors
+    bayes_factors_job_ids = []
+
+    num_shards = config.get('num_shards', translation_options['num_shards'])
+    if args.predictions_only:
+        msg = "Using the existing Bayes factors: {}".format(bayes_factors)
+        logger.info(msg)
+
+    elif num_shards > 1:
+        bayes_factors_job_ids = estimate_sharded_bayes_factors(profiles, orfs_genomic,
+                                                               bayes_factors,
+                                                               estimate_options_str, num_shards,
+                                                               args, call,
+                                                               merged_profiles=merged_profiles)
+    else:
+        cmd = "estimate-orf-bayes-factors {} {} {} {} --num-cpus {} {}".format(
+            profiles, orfs_genomic, bayes_factors, estimate_options_str, args.num_cpus,
+            write_merged_profiles_str)
+
+        if not args.use_slurm:
+            pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                               file_checkers=file_checkers,
+                                               overwrite=args.overwrite, call=call)
+
+        elif args.overwrite or not all(os.path.exists(out_file) for out_file in out_files):
+            bayes_factors_job_ids = [slurm.check_sbatch(cmd, args=args)]
+
+    # the profiles are not used after the Bayes factors are estimated
+    pipeline_runner.release('profiles')
+
+    if args.bayes_factors_only:
+        run_manifest.write_manifest(manifest)
+
+        if args.in_process:
+            pipeline_runner.log_report()
+        return
+
+    # both the filtered (longest for each stop codon, best among overlapping ORFs)
+    # and the unfiltered ORFs which pass the prediction filters are selected
+    # with a single call, so the Bayes factors and sequences are only read once
+    prediction_files = {}
     for is_filtered in [True, False]:
-            
-        filtered_str = ""
-        if is_filtered:
-            filtered_str = "--select-longest-by-stop --select-best-overlapping"
 
-        # now, select the ORFs (longest for each stop codon) which pass the prediction filters
         predicted_orfs = filenames.get_riboseq_predicted_orfs(
             config['riboseq_data'], 
             args.name, 
@@ -335,66 +597,82 @@ def main():
             is_chisq=chi_square_only
         )
 
-        min_bf_mean_str = utils.get_config_argument(config,
-                                                    'min_bf_mean',
-                                                    default=translation_options['min_bf_mean'])
-
-        max_bf_var_str = utils.get_config_argument(config,
-                                                   'max_bf_var',
-                                                   default=translation_options['max_bf_var'])
-
-        min_bf_likelihood_str = utils.get_config_argument(config,
-                                                          'min_bf_likelihood',
-                                                          default=translation_options['min_bf_likelihood'])
-
-        min_profile_str = utils.get_config_argument(config,
-                                                    'orf_min_profile_count',
-                                                    'min-profile',
-                                                    default=translation_options['orf_min_profile_count'])
-
-        min_length_str = utils.get_config_argument(config,
-                                                   'orf_min_length',
-                                                   'min-length',
-                                                   default=translation_options['orf_min_length'])
-
-        chisq_significance_level_str = utils.get_config_argument(config,
-                                                                 'chisq_alpha',
-                                                                 'chisq-significance-level',
-                                                                 default=translation_options['chisq_alpha'])
-
-        cmd = "select-final-prediction-set {} {} {} {} {} {} {} {} {} {} {} {} {} {}".format(
-            bayes_factors, 
-            config['fasta'], 
-            predicted_orfs, 
-            predicted_orfs_dna, 
-            predicted_orfs_protein,
-            min_bf_mean_str, 
-            max_bf_var_str, 
-            min_bf_likelihood_str,
-            min_profile_str,
-            min_length_str,
-            logging_str, 
-            chi_square_only_str,
-            chisq_significance_level_str,
-            filtered_str
-        )
-
-        in_files = [bayes_factors, config['fasta']]
-        out_files = [
-            predicted_orfs, 
-            predicted_orfs_dna, 
+        prediction_files[is_filtered] = [
+            predicted_orfs,
+            predicted_orfs_dna,
             predicted_orfs_protein
         ]
 
-        file_checkers = {
-            predicted_orfs: utils.check_gzip_file
-        }
+    min_bf_mean_str = utils.get_config_argument(config,
+                                                'min_bf_mean',
+                                                default=translation_options['min_bf_mean'])
+
+    max_bf_var_str = utils.get_config_argument(config,
+                                               'max_bf_var',
+                                               default=translation_options['max_bf_var'])
+
+    min_bf_likelihood_str = utils.get_config_argument(config,
+                                                      'min_bf_likelihood',
+                                                      default=translation_options['min_bf_likelihood'])
 
+    min_profile_str = utils.get_config_argument(config,
+                                                'orf_min_profile_count',
+                                                'min-profile',
+                                                default=translation_options['orf_min_profile_count'])
+
+    min_length_str = utils.get_config_argument(config,
+                                               'orf_min_length',
+                                               'min-length',
+                                               default=translation_options['orf_min_length'])
+
+    chisq_significance_level_str = utils.get_config_argument(config,
+                                                             'chisq_alpha',
+                                                             'chisq-significance-level',
+                                                             default=translation_options['chisq_alpha'])
+
+    filtered_str = "--select-longest-by-stop --select-best-overlapping"
+    unfiltered_str = "--unfiltered-outputs {}".format(' '.join(prediction_files[False]))
+
+    cmd = "select-final-prediction-set {} {} {} {} {} {} {} {} {} {} {} {} {} {} {}".format(
+        bayes_factors, 
+        config['fasta'], 
+        prediction_files[True][0],
+        prediction_files[True][1],
+        prediction_files[True][2],
+        min_bf_mean_str, 
+        max_bf_var_str, 
+        min_bf_likelihood_str,
+        min_profile_str,
+        min_length_str,
+        logging_str, 
+        chi_square_only_str,
+        chisq_significance_level_str,
+        filtered_str,
+        unfiltered_str
+    )
+
+    in_files = [bayes_factors, config['fasta']]
+    out_files = prediction_files[True] + prediction_files[False]
+
+    file_checkers = {
+        prediction_files[True][0]: utils.check_gzip_file,
+        prediction_files[False][0]: utils.check_gzip_file
+    }
+
+    # the selection waits for the jobs which create the Bayes factors, if any
+    if len(bayes_factors_job_ids) > 0:
+        slurm.check_sbatch(cmd, args=args, dependencies=bayes_factors_job_ids)
+    else:
         # todo: implement file checker for fasta files
-        shell_utils.call_if_not_exists(cmd, out_files, in_files=in_files,
-                                       file_checkers=file_checkers,
-                                       overwrite=args.overwrite, call=call)
-    
+        pipeline_runner.call_if_not_exists(cmd, out_files, in_files=in_files,
+                                           file_checkers=file_checkers,
+                                           overwrite=args.overwrite, call=call)
+
+    run_manifest.write_manifest(manifest)
+
+    if args.in_process:
+        pipeline_runner.log_report()
+
 
 if __name__ == '__main__':
     main()
@@ -2,17 +2,17 @@
 
 import argparse
 import logging
+import numpy as np
 import pandas as pd
 
-import Bio.Seq
-
 import pbio.utils.bed_utils as bed_utils
 import pbio.utils.fastx_utils as fastx_utils
 import pbio.misc.logging_utils as logging_utils
-import pbio.misc.parallel as parallel
 
 import pbio.ribo.ribo_utils as ribo_utils
 
+import rpbp.translation_prediction.indexed_fasta as indexed_fasta
+
 from rpbp.defaults import translation_options
 
 logger = logging.getLogger(__name__)
@@ -28,21 +28,159 @@ default_profile_sum_field = 'profile_sum'
 # --filtered-orf-types is not used in the the Rp-Bp pipeline
 
 
-def get_best_overlapping_orf(merged_ids, predicted_orfs):
+def get_best_overlapping_orfs(predicted_orfs, merged_ids, bf_mean_field=default_bf_mean_field):
+    """ This function selects the ORF with the highest Bayes factor mean among
+        each set of overlapping ORFs. Each ORF is assigned the index of its set,
+        and all of the sets are handled with a single groupby. Ties are broken
+        in favor of the ORF which comes first in predicted_orfs.
 
-    if len(merged_ids) == 1:
-        m_id = predicted_orfs['id'] == merged_ids[0]
-        return predicted_orfs[m_id].iloc[0]
-    
-    m_orfs = predicted_orfs['id'].isin(merged_ids)
-    
-    sorted_orfs = predicted_orfs[m_orfs].sort_values('bayes_factor_mean', ascending=False)
-    best_overlapping_orf_id = sorted_orfs.iloc[0]
+        Args:
+            predicted_orfs (pd.DataFrame): the ORFs, including the id and
+                bf_mean_field columns
 
-    return best_overlapping_orf_id
+            merged_ids (iterable of lists): the ids of the ORFs in each set,
+                e.g., the merged_ids of bed_utils.merge_all_intervals
 
+            bf_mean_field (string): the name of the Bayes factor mean column
 
-def main():
+        Returns:
+            pd.DataFrame: the best ORF of each set, in the order of the sets
+    """
+    cluster_ids = []
+    clusters = []
+    for cluster, ids in enumerate(merged_ids):
+        cluster_ids.extend(ids)
+        clusters.extend([cluster] * len(ids))
+
+    cluster_orfs = pd.DataFrame({
+        'id': cluster_ids,
+        'cluster': clusters
+    })
+
+    orfs = pd.DataFrame({
+        'id': predicted_orfs['id'].values,
+        bf_mean_field: predicted_orfs[bf_mean_field].values,
+        'position': np.arange(len(predicted_orfs))
+    })
+
+    cluster_orfs = cluster_orfs.merge(orfs, on='id', how='inner')
+
+    # idxmax keeps the first maximum, so put the ORFs of each set in the order
+    # of predicted_orfs
+    cluster_orfs = cluster_orfs.sort_values(['cluster', 'position'], kind='mergesort')
+    cluster_orfs = cluster_orfs.reset_index(drop=True)
+
+    best = cluster_orfs.groupby('cluster')[bf_mean_field].idxmax()
+    best_positions = cluster_orfs.loc[best.values, 'position'].values
+
+    return predicted_orfs.iloc[best_positions]
+
+
+def get_prediction_mask(bayes_factors, args, chi_square_field=default_chi_square_field):
+    """ This function finds the ORFs which meet the prediction thresholds in
+        args: the length, profile and frame filters (ribo_utils.get_base_filter)
+        and either the Bayes factor filters (ribo_utils.get_bf_filter) or, if
+        args.chi_square_only, the chi-square significance level, Bonferroni
+        corrected by the number of ORFs which meet the base filters.
+
+        Returns:
+            np.array: the mask of the ORFs which meet the thresholds
+    """
+    m_base = ribo_utils.get_base_filter(bayes_factors, args.min_profile, args.min_length)
+
+    if args.chi_square_only:
+        M = max(np.sum(m_base), 1)
+        corrected_significance_level = args.chisq_significance_level / M
+
+        msg = "Corrected significance level: {}".format(corrected_significance_level)
+        logger.debug(msg)
+
+        m_predicted = m_base & (bayes_factors[chi_square_field] < corrected_significance_level)
+    else:
+        m_bf = ribo_utils.get_bf_filter(bayes_factors, args.min_bf_mean, args.max_bf_var,
+                                        args.min_bf_likelihood)
+        m_predicted = m_base & m_bf
+
+    return np.asarray(m_predicted, dtype=bool)
+
+
+def get_prediction_set(bayes_factors, m_predicted, select_longest_by_stop,
+                       select_best_overlapping):
+    """ This function selects the ORFs which meet the prediction thresholds,
+        as given by get_prediction_mask, and, optionally, only the longest of
+        them at each stop codon and the best among overlapping ORFs. Ties among
+        overlapping ORFs are broken in favor of the ORF which comes first in
+        bayes_factors (as in sweep-prediction-thresholds).
+
+        Returns:
+            pd.DataFrame: the (sorted) predicted ORFs
+    """
+    predicted_orfs = bayes_factors[m_predicted]
+
+    if select_longest_by_stop:
+        predicted_orfs = bed_utils.get_longest_features_by_end(predicted_orfs)
+
+        # keep the order of the Bayes factors, which breaks the ties below
+        positions = pd.Series(np.arange(len(bayes_factors)), index=bayes_factors['id'].values)
+        order = np.argsort(positions[predicted_orfs['id'].values].values, kind='mergesort')
+        predicted_orfs = predicted_orfs.iloc[order]
+
+    msg = "Number of selected ORFs: {}".format(len(predicted_orfs))
+    logger.info(msg)
+
+    if select_best_overlapping:
+
+        msg = "Finding overlapping ORFs"
+        logger.info(msg)
+
+        merged_intervals = bed_utils.merge_all_intervals(predicted_orfs)
+
+        msg = "Selecting best among overlapping ORFs"
+        logger.info(msg)
+
+        predicted_orfs = get_best_overlapping_orfs(predicted_orfs,
+                                                   merged_intervals['merged_ids'])
+
+    msg = "Sorting selected ORFs"
+    logger.info(msg)
+
+    predicted_orfs = bed_utils.sort(predicted_orfs)
+    return predicted_orfs
+
+
+def write_prediction_set(predicted_orfs, dna_sequences, protein_sequences, predicted_orfs_file,
+                         predicted_dna_sequences_file, predicted_protein_sequences_file):
+    """ This function writes the predicted ORFs (BED12+), and their DNA and
+        protein sequences (fasta), in the order of the ORFs.
+
+        Args:
+            predicted_orfs (pd.DataFrame): the predicted ORFs
+
+            dna_sequences, protein_sequences (dicts): a mapping from the id of
+                (at least) each of the predicted ORFs to its sequences
+
+            predicted_*_file (strings): the output files
+    """
+    bed_utils.write_bed(predicted_orfs, predicted_orfs_file)
+
+    orf_ids = predicted_orfs['id']
+
+    fastx_utils.write_fasta([(orf_id, dna_sequences[orf_id]) for orf_id in orf_ids],
+                            predicted_dna_sequences_file,
+                            compress=False)
+
+    fastx_utils.write_fasta([(orf_id, protein_sequences[orf_id]) for orf_id in orf_ids],
+                            predicted_protein_sequences_file,
+                            compress=False)
+
+
+def parse_arguments(argv=None):
+    """ This function parses the command line arguments of the script (or
+        argv, if given, without the program name).
+
+        Returns:
+            argparse.Namespace: the parsed arguments
+    """
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      description="""Given a list of ORFs with associated Bayes 
         factors and a fasta sequence file, this script extracts the sequences of the ORFs whose 
@@ -115,16 +253,43 @@ def main():
     parser.add_argument('--filtered-orf-types', help=""""A list of ORF types which will be
         removed before selecting the final prediction set.""", nargs='*', default=[])
 
+    parser.add_argument('--unfiltered-outputs', help="""If given, the ORFs which meet the
+        prediction thresholds are also written to these (BED12+, DNA fasta, protein fasta)
+        files, without --select-longest-by-stop and --select-best-overlapping. The Bayes
+        factors are only read once, and the sequence of each ORF in both sets is only
+        extracted once.""", nargs=3, metavar=('BED', 'DNA', 'PROTEIN'), default=None)
+
     logging_utils.add_logging_options(parser)
-    args = parser.parse_args()
-    logging_utils.update_logging(args)
+    args = parser.parse_args(argv)
+
+    return args
 
-    # first, extract all of the predictions which exceed the threshold
+
+def run(args):
+    """ This function reads the Bayes factors given in args and selects the
+        prediction sets, see select_prediction_sets.
+    """
     msg = "Reading Bayes factor information"
     logger.info(msg)
     
     bayes_factors = bed_utils.read_bed(args.bayes_factors)
+    select_prediction_sets(bayes_factors, args)
+
+
+def select_prediction_sets(bayes_factors, args):
+    """ This function selects the ORFs which meet the prediction thresholds
+        (the filtered set and, if args.unfiltered_outputs is given, the
+        unfiltered set), and writes them with their DNA and protein sequences.
+
+        Args:
+            bayes_factors (pd.DataFrame): the ORFs and Bayes factors (BED12+),
+                as read from args.bayes_factors
+
+            args (namespace): the options, see parse_arguments
 
+        Returns:
+            None, but the prediction sets are written to the files in args
+    """
     if len(args.filtered_orf_types) > 0:
         filtered_orf_types_str = ','.join(args.filtered_orf_types)
         msg = "Filtering these ORF types: {}".format(filtered_orf_types_str)
@@ -136,78 +301,53 @@ def main():
     msg = "Identifying ORFs which meet the prediction thresholds"
     logger.info(msg)
 
-    all_orfs, predicted_orfs = ribo_utils.get_predicted_orfs(
-        bayes_factors,
-        min_signal=args.min_profile,
-        min_length=args.min_length,
-        min_bf_mean=args.min_bf_mean, 
-        max_bf_var=args.max_bf_var, 
-        min_bf_likelihood=args.min_bf_likelihood,
-        chisq_alpha=args.chisq_significance_level,
-        select_longest_by_stop=args.select_longest_by_stop,
-        use_chi_square=args.chi_square_only
-    )
+    # the thresholds are applied once, and both sets are selected from the same ORFs
+    m_predicted = get_prediction_mask(bayes_factors, args)
 
-    msg = "Number of selected ORFs: {}".format(len(predicted_orfs))
+    msg = "Number of ORFs which meet the prediction thresholds: {}".format(np.sum(m_predicted))
     logger.info(msg)
 
-    if args.select_best_overlapping:
+    predicted_orfs = get_prediction_set(bayes_factors, m_predicted, args.select_longest_by_stop,
+                                        args.select_best_overlapping)
 
-        msg = "Finding overlapping ORFs"
-        logger.info(msg)
-
-        merged_intervals = bed_utils.merge_all_intervals(predicted_orfs)
+    prediction_sets = [predicted_orfs]
+    if args.unfiltered_outputs is not None:
+        unfiltered_orfs = get_prediction_set(bayes_factors, m_predicted, False, False)
+        prediction_sets.append(unfiltered_orfs)
 
-        msg = "Selecting best among overlapping ORFs"
-        logger.info(msg)
+    # now get the sequences of all selected ORFs, each only once
+    msg = "Extracting predicted ORFs DNA sequence"
+    logger.info(msg)
 
-        predicted_orfs = parallel.apply_iter_simple(
-            merged_intervals['merged_ids'], 
-            get_best_overlapping_orf, 
-            predicted_orfs, 
-            progress_bar=True
-        )
+    all_predicted_orfs = pd.concat(prediction_sets).drop_duplicates(subset=['id'])
 
-        predicted_orfs = pd.DataFrame(predicted_orfs)
+    # the exons are sliced from the (indexed, memory-mapped) genome
+    transcript_sequences = indexed_fasta.get_all_bed_sequences(all_predicted_orfs, args.fasta)
 
-    msg = "Sorting selected ORFs"
+    # translate the ORFs into protein sequences, in memory
+    msg = "Converting predicted ORF sequences to amino acids"
     logger.info(msg)
 
-    predicted_orfs = bed_utils.sort(predicted_orfs)
+    protein_sequences = dict(indexed_fasta.translate_sequences(transcript_sequences))
+    dna_sequences = dict(transcript_sequences)
 
     msg = "Writing selected ORFs to disk"
     logger.info(msg)
-    bed_utils.write_bed(predicted_orfs, args.predicted_orfs)
 
-    # now get the sequences
-    msg = "Extracting predicted ORFs DNA sequence"
-    logger.info(msg)
+    write_prediction_set(predicted_orfs, dna_sequences, protein_sequences,
+                         args.predicted_orfs, args.predicted_dna_sequences,
+                         args.predicted_protein_sequences)
 
-    split_exons = True
-    transcript_sequences = bed_utils.get_all_bed_sequences(
-        predicted_orfs, 
-        args.fasta, 
-        split_exons
-    )
+    if args.unfiltered_outputs is not None:
+        write_prediction_set(unfiltered_orfs, dna_sequences, protein_sequences,
+                             *args.unfiltered_outputs)
 
-    fastx_utils.write_fasta(transcript_sequences,
-                            args.predicted_dna_sequences,
-                            compress=False)
 
-    # translate the remaining ORFs into protein sequences
-    msg = "Converting predicted ORF sequences to amino acids"
-    logger.info(msg)
+def main():
+    args = parse_arguments()
+    logging_utils.update_logging(args)
 
-    records = fastx_utils.get_read_iterator(args.predicted_dna_sequences)
-    protein_records = {
-        r[0]: Bio.Seq.translate(r[1]) for r in records
-    }
-    
-    fastx_utils.write_fasta(
-        protein_records.items(), 
-        args.predicted_protein_sequences, 
-        compress=False
-    )
+    run(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,266 @@
+#! /usr/bin/env python3
+
+import argparse
+import logging
+import sys
+
+import numpy as np
+import scipy.sparse
+import tqdm
+
+import pbio.misc.logging_utils as logging_utils
+import pbio.misc.math_utils as math_utils
+import pbio.misc.slurm as slurm
+
+import pbio.ribo.ribo_utils as ribo_utils
+
+from rpbp.defaults import translation_options
+
+import rpbp.pipeline_runner as pipeline_runner
+
+logger = logging.getLogger(__name__)
+
+# Not passed as arguments, unlikely to be required
+
+default_orf_num_field = 'orf_num'
+
+# the smoothing matrix costs about as much to build (and check) as smoothing
+# a couple of profiles, so it is only used for larger groups of ORFs
+default_min_group_size = 3
+
+# the number of ORFs of the same length smoothed with one matrix product
+default_chunk_size = 1000
+
+
+def get_lowess_matrix(T, fraction):
+    """ This function constructs the matrix S such that S.dot(y) gives the
+        LOWESS fit (without reweighting iterations, and with delta=0) of y
+        at the equally-spaced points 0, ..., T-1, following the neighborhood,
+        tricube weight and local linear fit of statsmodels. Without the
+        reweighting iterations, the weights do not depend on y, so the fit
+        is linear in y.
+
+        Args:
+            T (int): the number of points (codons)
+
+            fraction (float): the fraction of points used for each local fit
+
+        Returns:
+            scipy.sparse.csr_matrix: the (T x T) smoothing matrix
+    """
+    x = np.arange(T, dtype=float)
+
+    k = int(fraction * T + 1e-10)
+    k = min(max(k, 2), T)
+
+    rows = []
+    cols = []
+    vals = []
+
+    left_end = 0
+    right_end = k
+
+    for i in range(T):
+        # shift the neighborhood until i is (just to the left of) its center
+        while (right_end < T) and (x[i] > (x[left_end] + x[right_end]) / 2.0):
+            left_end += 1
+            right_end += 1
+
+        x_j = x[left_end:right_end]
+        radius = max(x[i] - x[left_end], x[right_end-1] - x[i])
+
+        weights = np.zeros(len(x_j))
+        if radius > 0:
+            weights = (1 - (np.abs(x_j - x[i]) / radius)**3)**3
+
+        sum_weights = np.sum(weights)
+        if (sum_weights <= 0) or (np.count_nonzero(weights) == 1):
+            # the fit is just the value at i
+            rows.append(i)
+            cols.append(i)
+            vals.append(1.0)
+            continue
+
+        weights = weights / sum_weights
+
+        sum_weighted_x = np.sum(weights * x_j)
+        weighted_sqdev_x = np.sum(weights * (x_j - sum_weighted_x)**2)
+
+        p_i_j = weights * (1.0 + (x[i] - sum_weighted_x) * (x_j - sum_weighted_x) / weighted_sqdev_x)
+
+        rows.extend([i] * len(x_j))
+        cols.extend(range(left_end, right_end))
+        vals.extend(p_i_j)
+
+    S = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(T, T))
+    return S
+
+
+def check_lowess_matrix(S, fraction, reweighting_iterations, seed=8675309):
+    """ This function checks that smoothing a random profile with S gives the
+        same result as ribo_utils.smooth_profile.
+    """
+    T = S.shape[0]
+    random_state = np.random.RandomState(seed)
+    profile = random_state.poisson(5, size=3*T).astype(float)
+
+    expected = ribo_utils.smooth_profile(profile,
+                                         reweighting_iterations=reweighting_iterations,
+                                         fraction=fraction)
+
+    smoothed_profile = smooth_profiles(profile.reshape(1, -1), S)[0]
+
+    return np.allclose(smoothed_profile, expected, rtol=1e-8, atol=1e-10)
+
+
+def smooth_profiles(profiles, S):
+    """ This function smoothes each frame of each profile with the matrix S
+        from get_lowess_matrix.
+
+        Args:
+            profiles (np.array): a (num ORFs x 3T) array of profiles
+
+            S (scipy.sparse.csr_matrix): the (T x T) smoothing matrix
+
+        Returns:
+            np.array: the smoothed profiles
+    """
+    smoothed_profiles = np.zeros_like(profiles)
+    for frame in range(3):
+        # (S.dot(x.T)).T == x.dot(S.T), for each profile in the rows of x
+        x = profiles[:, frame::3]
+        smoothed_profiles[:, frame::3] = S.dot(x.T).T
+
+    return smoothed_profiles
+
+
+def smooth_orf_group(profiles, orf_nums, T, fraction, reweighting_iterations):
+    """ This function smoothes the profiles of the ORFs (all of length 3T).
+        Without reweighting iterations, all of the profiles are smoothed with
+        the same smoothing matrix; otherwise, or if the matrix does not match
+        ribo_utils.smooth_profile, each profile is smoothed separately.
+
+        Returns:
+            np.array: the (len(orf_nums) x 3T) smoothed profiles
+    """
+    orf_len = 3 * T
+
+    use_matrix = ((reweighting_iterations == 0) and
+                  (len(orf_nums) >= default_min_group_size))
+
+    if use_matrix:
+        S = get_lowess_matrix(T, fraction)
+        use_matrix = check_lowess_matrix(S, fraction, reweighting_iterations)
+
+        if not use_matrix:
+            msg = ("The smoothing matrix did not match the LOWESS fit for length: {}. "
+                   "Smoothing each profile separately.".format(orf_len))
+            logger.warning(msg)
+
+    smoothed_profiles = np.zeros((len(orf_nums), orf_len))
+
+    for start in range(0, len(orf_nums), default_chunk_size):
+        end = start + default_chunk_size
+        group_profiles = profiles[orf_nums[start:end], :orf_len].toarray()
+
+        if use_matrix:
+            smoothed_profiles[start:end] = smooth_profiles(group_profiles, S)
+        else:
+            smoothed_profiles[start:end] = [
+                ribo_utils.smooth_profile(profile,
+                                          reweighting_iterations=reweighting_iterations,
+                                          fraction=fraction)
+                for profile in group_profiles
+            ]
+
+    return smoothed_profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script smoothes the profiles of all ORFs
+        with reads using LOWESS (separately for each frame), exactly as they are smoothed by
+        estimate-orf-bayes-factors, and writes them as a sparse matrix with the same layout as
+        the (unsmoothed) ORF profiles. Without reweighting iterations, the LOWESS fit is linear
+        in the profile, so all ORFs of the same length are smoothed with a single matrix
+        product.""")
+
+    parser.add_argument('profiles', help="""The ORF profiles (counts) (mtx). If several
+        files are given, their profiles are added when they are read.""", nargs='+')
+
+    parser.add_argument('regions', help="The regions (ORFs) whose profiles will be smoothed (BED12+)")
+
+    parser.add_argument('out', help="The (mtx.gz) output file containing the smoothed profiles")
+
+    parser.add_argument('--fraction', help="The fraction of signal to use in LOWESS",
+                        type=float, default=translation_options['smoothing_fraction'])
+
+    parser.add_argument('--reweighting-iterations', help="The number of reweighting "
+                                                         "iterations to use in LOWESS. "
+                                                         "Please see the statsmodels documentation for a "
+                                                         "detailed description of this parameter.",
+                        type=int, default=translation_options['smoothing_reweighting_iterations'])
+
+    parser.add_argument('--orf-num-field', default=default_orf_num_field)
+
+    slurm.add_sbatch_options(parser)
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args()
+    logging_utils.update_logging(args)
+
+    if args.use_slurm:
+        cmd = ' '.join(sys.argv)
+        slurm.check_sbatch(cmd, args=args)
+        return
+
+    msg = "Reading profiles and ORFs"
+    logger.info(msg)
+
+    profiles = pipeline_runner.read_profiles(args.profiles)
+    regions = pipeline_runner.read_bed(args.regions)
+
+    # only the ORFs with reads need to be smoothed, and estimate-orf-bayes-factors
+    # skips the ORFs whose length is not 0 mod 3
+    profiles_sums = np.asarray(profiles.sum(axis=1)).ravel()
+    m_reads = profiles_sums[regions[args.orf_num_field].values] > 0
+    m_frame = (regions['orf_len'] % 3) == 0
+    regions = regions[m_reads & m_frame]
+
+    msg = "Number of ORFs to smooth: {}".format(len(regions))
+    logger.info(msg)
+
+    msg = "Smoothing the ORFs of each length"
+    logger.info(msg)
+
+    smoothed_rows = []
+    smoothed_cols = []
+    smoothed_vals = []
+
+    length_groups = regions.groupby('orf_len')
+    for orf_len, group in tqdm.tqdm(length_groups, total=len(length_groups)):
+        orf_nums = group[args.orf_num_field].values
+
+        smoothed_profiles = smooth_orf_group(profiles, orf_nums, orf_len // 3,
+                                             args.fraction, args.reweighting_iterations)
+
+        smoothed_profiles = scipy.sparse.coo_matrix(smoothed_profiles)
+        smoothed_rows.append(orf_nums[smoothed_profiles.row])
+        smoothed_cols.append(smoothed_profiles.col)
+        smoothed_vals.append(smoothed_profiles.data)
+
+    if len(smoothed_vals) > 0:
+        smoothed_rows = np.concatenate(smoothed_rows)
+        smoothed_cols = np.concatenate(smoothed_cols)
+        smoothed_vals = np.concatenate(smoothed_vals)
+
+    smoothed_profiles = scipy.sparse.csr_matrix((smoothed_vals, (smoothed_rows, smoothed_cols)),
+                                                shape=profiles.shape)
+
+    msg = "Writing smoothed profiles to disk"
+    logger.info(msg)
+
+    math_utils.write_sparse_matrix(args.out, smoothed_profiles)
+
+
+if __name__ == '__main__':
+    main()
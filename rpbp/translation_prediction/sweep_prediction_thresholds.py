@@ -0,0 +1,382 @@
+#! /usr/bin/env python3
+
+import argparse
+import itertools
+import logging
+
+import numpy as np
+import pandas as pd
+
+import pbio.utils.bed_utils as bed_utils
+import pbio.misc.logging_utils as logging_utils
+
+import rpbp.translation_prediction.select_final_prediction_set as select_final_prediction_set
+
+from rpbp.defaults import translation_options
+
+logger = logging.getLogger(__name__)
+
+default_orf_type_field = 'orf_type'
+default_num_checks = 3
+
+sweep_fields = [
+    'min_bf_mean',
+    'min_bf_likelihood',
+    'max_bf_var',
+    'chisq_significance_level',
+    'min_profile'
+]
+
+# the columns used by the prediction thresholds
+filter_fields = [
+    'orf_len',
+    'profile_sum',
+    'x_1_sum',
+    'x_2_sum',
+    'x_3_sum',
+    'bayes_factor_mean',
+    'bayes_factor_var',
+    'chi_square_p'
+]
+
+count_fields = [
+    'num_predicted',
+    'num_longest_by_stop',
+    'num_best_overlapping'
+]
+
+
+def get_optional_float(value):
+    """ This function parses a threshold for argparse; "none" (or "null")
+        disables the respective filter.
+    """
+    if value.lower() in ['none', 'null']:
+        return None
+    return float(value)
+
+
+class PredictionSweep(object):
+    """ This class holds everything about the ORFs which does not depend on the
+        thresholds: the columns used by the thresholds, and the order of the
+        ORFs for the selection of the longest ORF at each stop codon and of the
+        best among overlapping ORFs. For each setting, the ORFs which meet the
+        thresholds are found with select_final_prediction_set.get_prediction_mask
+        (i.e., the ribo_utils filters), and the selections are then vectorized
+        operations on them. Ties are broken in favor of the ORF which comes
+        first in bfs, as in select-final-prediction-set.
+    """
+    def __init__(self, bfs, orf_type_field=default_orf_type_field):
+        self.num_orfs = len(bfs)
+        position = np.arange(self.num_orfs)
+
+        self.filter_bfs = bfs[filter_fields].reset_index(drop=True)
+        self.bf_mean = bfs['bayes_factor_mean'].values.astype(float)
+
+        self.orf_type_codes, self.orf_types = pd.factorize(bfs[orf_type_field])
+
+        start = bfs['start'].values.astype(np.int64)
+        end = bfs['end'].values.astype(np.int64)
+        seqname_codes = pd.factorize(bfs['seqname'])[0]
+        is_positive = (bfs['strand'] == '+').values
+
+        # the ORFs with the same stop codon (end on the + strand, start on the -
+        # strand) are contiguous, and the longest (smallest start on the + strand,
+        # largest end on the - strand) is first
+        stop = np.where(is_positive, end, start)
+        length_key = np.where(is_positive, start, -end)
+        self.stop_order = np.lexsort((position, length_key, stop, is_positive, seqname_codes))
+
+        stop_keys = np.stack([seqname_codes, is_positive, stop])[:, self.stop_order]
+        m_new_stop = np.ones(self.num_orfs, dtype=bool)
+        m_new_stop[1:] = (stop_keys[:, 1:] != stop_keys[:, :-1]).any(axis=0)
+        self.stop_groups = np.cumsum(m_new_stop)
+
+        # the (strand-specific) coordinates are shifted so the ORFs on different
+        # chromosomes or strands can never overlap
+        chrom_codes = 2 * seqname_codes + is_positive
+        chrom_offset = chrom_codes * (np.max(end, initial=0) + 1)
+        self.linear_start = start + chrom_offset
+        self.linear_end = end + chrom_offset
+        self.overlap_order = np.lexsort((position, self.linear_start))
+
+    def get_longest_by_stop(self, m_predicted):
+        """ This function selects the longest of the predicted ORFs at each stop codon.
+
+            Returns:
+                np.array: the mask of the selected ORFs
+        """
+        m_sorted = m_predicted[self.stop_order]
+        selected = self.stop_order[m_sorted]
+        groups = self.stop_groups[m_sorted]
+
+        m_first = np.ones(len(selected), dtype=bool)
+        m_first[1:] = groups[1:] != groups[:-1]
+
+        m_longest = np.zeros(self.num_orfs, dtype=bool)
+        m_longest[selected[m_first]] = True
+        return m_longest
+
+    def get_best_overlapping(self, m_predicted):
+        """ This function selects the predicted ORF with the highest Bayes factor
+            mean among each set of overlapping ORFs. Ties are broken in favor of
+            the ORF which comes first, as in select-final-prediction-set.
+
+            Returns:
+                np.array: the mask of the selected ORFs
+        """
+        selected = self.overlap_order[m_predicted[self.overlap_order]]
+
+        m_best = np.zeros(self.num_orfs, dtype=bool)
+        if len(selected) == 0:
+            return m_best
+
+        starts = self.linear_start[selected]
+        ends = np.maximum.accumulate(self.linear_end[selected])
+
+        m_new_cluster = np.ones(len(selected), dtype=bool)
+        m_new_cluster[1:] = starts[1:] >= ends[:-1]
+        clusters = np.cumsum(m_new_cluster)
+
+        best_order = np.lexsort((selected, -self.bf_mean[selected], clusters))
+        clusters = clusters[best_order]
+
+        m_first = np.ones(len(selected), dtype=bool)
+        m_first[1:] = clusters[1:] != clusters[:-1]
+
+        m_best[selected[best_order][m_first]] = True
+        return m_best
+
+    def get_counts(self, m_selected):
+        """ This function counts the selected ORFs of each type.
+        """
+        return np.bincount(self.orf_type_codes[m_selected], minlength=len(self.orf_types))
+
+    def get_selection_masks(self, setting_args):
+        """ This function selects the ORFs which meet the thresholds in
+            setting_args (see get_setting_args), the longest of them at each
+            stop codon and, of those, the best among overlapping ORFs.
+
+            Returns:
+                tuple of np.arrays: the masks of the three sets
+        """
+        m_predicted = select_final_prediction_set.get_prediction_mask(self.filter_bfs,
+                                                                      setting_args)
+        m_longest = self.get_longest_by_stop(m_predicted)
+        m_best = self.get_best_overlapping(m_longest)
+
+        return m_predicted, m_longest, m_best
+
+    def sweep(self, settings, args):
+        """ This function evaluates each setting of the thresholds.
+
+            Args:
+                settings (list of dicts): the thresholds (sweep_fields) of each
+                    setting, see get_settings
+
+                args (namespace): the other options of the selection, see
+                    get_setting_args
+
+            Returns:
+                pd.DataFrame: the thresholds (sweep_fields) of each setting, and
+                    the number of predicted ORFs of each type (count_fields)
+        """
+        rows = []
+        for setting, thresholds in enumerate(settings):
+            setting_args = get_setting_args(thresholds, args)
+            masks = self.get_selection_masks(setting_args)
+
+            counts = zip(self.orf_types, *[self.get_counts(m) for m in masks])
+            for orf_type, num_predicted, num_longest, num_best in counts:
+                rows.append([setting] + [thresholds[field] for field in sweep_fields] +
+                            [orf_type, num_predicted, num_longest, num_best])
+
+        columns = ['setting'] + sweep_fields + ['orf_type'] + count_fields
+        return pd.DataFrame(rows, columns=columns)
+
+
+def get_settings(args):
+    """ This function gives each combination of the thresholds in args: the
+        Bayes factor thresholds or, with --chi-square-only, the chi-square
+        significance levels, and the profile counts. The thresholds which do
+        not apply are None.
+
+        Returns:
+            list of dicts: the thresholds (sweep_fields) of each setting
+    """
+    if args.chi_square_only:
+        combinations = itertools.product([None], [None], [None],
+                                         args.chisq_significance_level, args.min_profile)
+    else:
+        combinations = itertools.product(args.min_bf_mean, args.min_bf_likelihood,
+                                         args.max_bf_var, [None], args.min_profile)
+
+    settings = [dict(zip(sweep_fields, combination)) for combination in combinations]
+    return settings
+
+
+def get_setting_args(thresholds, args):
+    """ This function constructs the options of select-final-prediction-set
+        for the thresholds of a setting (see get_settings).
+    """
+    setting_args = argparse.Namespace(
+        min_profile=thresholds['min_profile'],
+        min_length=args.min_length,
+        min_bf_mean=thresholds['min_bf_mean'],
+        max_bf_var=thresholds['max_bf_var'],
+        min_bf_likelihood=thresholds['min_bf_likelihood'],
+        chisq_significance_level=thresholds['chisq_significance_level'],
+        chi_square_only=args.chi_square_only
+    )
+
+    return setting_args
+
+
+def check_setting(prediction_sweep, bayes_factors, setting_args, setting):
+    """ This function checks that the ORFs selected by the sweep for the
+        setting are the same as those selected by select-final-prediction-set,
+        for both the unfiltered and the filtered prediction sets.
+
+        Raises:
+            ValueError: if the sets differ
+    """
+    m_sweep_predicted, m_sweep_longest, m_sweep_best = \
+        prediction_sweep.get_selection_masks(setting_args)
+
+    m_predicted = select_final_prediction_set.get_prediction_mask(bayes_factors, setting_args)
+
+    for select_filtered, m_selected in [(False, m_sweep_predicted), (True, m_sweep_best)]:
+        predicted_orfs = select_final_prediction_set.get_prediction_set(
+            bayes_factors, m_predicted, select_filtered, select_filtered)
+
+        sweep_ids = set(bayes_factors.loc[m_selected, 'id'])
+        selected_ids = set(predicted_orfs['id'])
+
+        if sweep_ids != selected_ids:
+            msg = ("Setting {}: the sweep selects {} ORFs, but select-final-prediction-set "
+                   "selects {} ORFs (filtered: {}). ORFs which differ: {}".format(
+                       setting, len(sweep_ids), len(selected_ids), select_filtered,
+                       ','.join(sorted(sweep_ids ^ selected_ids)[:10])))
+            raise ValueError(msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="""This script evaluates all combinations of
+        the given prediction thresholds for a Bayes factor file, and counts the ORFs of each
+        type which are predicted (num_predicted), which are the longest at their stop codon
+        (num_longest_by_stop), and which are also the best among overlapping ORFs
+        (num_best_overlapping, the filtered prediction set). The Bayes factors are only read
+        once. Use "none" to disable min_bf_likelihood or max_bf_var. With --chi-square-only,
+        the chi-square significance levels are evaluated instead of the Bayes factor
+        thresholds.""")
+
+    parser.add_argument('bayes_factors', help="""The file containing the ORFs and Bayes'
+        factors (BED12+).""")
+
+    parser.add_argument('out', help="The (csv.gz) output file containing the counts of each setting")
+
+    parser.add_argument('--min-bf-mean', help="The values of min_bf_mean", type=float,
+                        nargs='+', default=[translation_options['min_bf_mean']])
+
+    parser.add_argument('--min-bf-likelihood', help="The values of min_bf_likelihood",
+                        type=get_optional_float, nargs='+',
+                        default=[translation_options['min_bf_likelihood']])
+
+    parser.add_argument('--max-bf-var', help="The values of max_bf_var",
+                        type=get_optional_float, nargs='+',
+                        default=[translation_options['max_bf_var']])
+
+    parser.add_argument('--min-profile', help="The values of orf_min_profile_count", type=float,
+                        nargs='+', default=[translation_options['orf_min_profile_count']])
+
+    parser.add_argument('--chi-square-only', help="""If this flag is present, then the
+        chi square value will be used to predict ORFs rather than the Bayes' factor, as for
+        select-final-prediction-set, e.g., for the Bayes factor files of Rp-chi""",
+                        action='store_true')
+
+    parser.add_argument('--chisq-significance-level', help="""The values of the (Bonferroni
+        corrected) significance level, if --chi-square-only is given""", type=float,
+                        nargs='+', default=[translation_options['chisq_alpha']])
+
+    parser.add_argument('--min-length', help="The minimum length to predict an ORF as translated",
+                        type=int, default=translation_options['orf_min_length'])
+
+    parser.add_argument('--orf-type-field', default=default_orf_type_field)
+
+    parser.add_argument('--filtered-orf-types', help="""A list of ORF types which will be
+        removed before selecting the prediction sets.""", nargs='*', default=[])
+
+    parser.add_argument('--write-bed', help="""The settings (as given in the output) for
+        which the filtered prediction set is written to <bed-prefix>.setting-<i>.bed.gz,
+        using select-final-prediction-set.""", type=int, nargs='*', default=[])
+
+    parser.add_argument('--bed-prefix', help="The prefix of the files of --write-bed",
+                        default="predicted-orfs")
+
+    parser.add_argument('--num-checks', help="""The number of (evenly spaced) settings for
+        which the selected ORFs are checked against select-final-prediction-set. The script
+        fails if they differ.""", type=int, default=default_num_checks)
+
+    logging_utils.add_logging_options(parser)
+    args = parser.parse_args()
+    logging_utils.update_logging(args)
+
+    msg = "Reading Bayes factor information"
+    logger.info(msg)
+
+    bayes_factors = bed_utils.read_bed(args.bayes_factors)
+
+    if len(args.filtered_orf_types) > 0:
+        m_orf_types = bayes_factors[args.orf_type_field].isin(args.filtered_orf_types)
+        bayes_factors = bayes_factors[~m_orf_types]
+
+    bayes_factors = bayes_factors.reset_index(drop=True)
+
+    # the Bayes factors of Rp-chi are not estimated
+    if (not args.chi_square_only) and np.isneginf(bayes_factors['bayes_factor_mean']).all():
+        msg = ("None of the ORFs has an estimated Bayes factor. Use --chi-square-only for "
+               "the Bayes factor files of Rp-chi.")
+        logger.warning(msg)
+
+    msg = "Sweeping the thresholds"
+    logger.info(msg)
+
+    settings = get_settings(args)
+
+    prediction_sweep = PredictionSweep(bayes_factors, args.orf_type_field)
+    sweep_results = prediction_sweep.sweep(settings, args)
+
+    msg = "Number of settings: {}".format(len(settings))
+    logger.info(msg)
+
+    sweep_results.to_csv(args.out, index=False)
+
+    # the selections of the sweep are checked against the (much slower)
+    # selection of select-final-prediction-set
+    num_checks = min(args.num_checks, len(settings))
+    check_settings = np.unique(np.linspace(0, len(settings)-1, num_checks).astype(int))
+
+    for setting in check_settings:
+        setting_args = get_setting_args(settings[setting], args)
+        check_setting(prediction_sweep, bayes_factors, setting_args, setting)
+
+    if len(check_settings) > 0:
+        msg = "The sweep selects the same ORFs as select-final-prediction-set for settings: {}"
+        msg = msg.format(','.join(str(s) for s in check_settings))
+        logger.info(msg)
+
+    for setting in args.write_bed:
+        setting_args = get_setting_args(settings[setting], args)
+        m_predicted = select_final_prediction_set.get_prediction_mask(bayes_factors, setting_args)
+        predicted_orfs = select_final_prediction_set.get_prediction_set(
+            bayes_factors, m_predicted, True, True)
+
+        bed_file = "{}.setting-{}.bed.gz".format(args.bed_prefix, setting)
+        bed_utils.write_bed(predicted_orfs, bed_file)
+
+        msg = "Wrote setting {} ({} ORFs) to: {}".format(setting, len(predicted_orfs), bed_file)
+        logger.info(msg)
+
+
+if __name__ == '__main__':
+    main()
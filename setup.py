@@ -19,7 +19,11 @@ stan_model_files = [
     os.path.join("nonperiodic", "start-high-low-high.stan"),
     os.path.join("periodic", "start-high-low-low.stan"),
     os.path.join("untranslated", "gaussian-naive-bayes.stan"),
-    os.path.join("translated", "periodic-gaussian-mixture.stan")
+    os.path.join("translated", "periodic-gaussian-mixture.stan"),
+    os.path.join("untranslated_sufficient_statistics", "gaussian-naive-bayes.stan"),
+    os.path.join("translated_sufficient_statistics", "periodic-gaussian-mixture.stan"),
+    os.path.join("untranslated_batched", "gaussian-naive-bayes.stan"),
+    os.path.join("translated_batched", "periodic-gaussian-mixture.stan")
 ]
 
 
@@ -29,7 +33,11 @@ stan_pickle_files = [
     os.path.join("nonperiodic", "start-high-low-high.pkl"),
     os.path.join("periodic", "start-high-low-low.pkl"),
     os.path.join("untranslated", "gaussian-naive-bayes.pkl"),
-    os.path.join("translated", "periodic-gaussian-mixture.pkl")
+    os.path.join("translated", "periodic-gaussian-mixture.pkl"),
+    os.path.join("untranslated_sufficient_statistics", "gaussian-naive-bayes.pkl"),
+    os.path.join("translated_sufficient_statistics", "periodic-gaussian-mixture.pkl"),
+    os.path.join("untranslated_batched", "gaussian-naive-bayes.pkl"),
+    os.path.join("translated_batched", "periodic-gaussian-mixture.pkl")
 ]
 
 
@@ -0,0 +1,280 @@
+""" Check that the Bayes factors written by estimate-orf-bayes-factors are
+identical for all parallel layouts: the number of workers, --num-groups and
+the number of shards (merged with merge-orf-bayes-factors). The script is
+run as from the command line, through the workers and the streaming writer,
+with stub models (see StubModel) whose draws depend on the random seed and
+on the data, so the check does not need pystan.
+"""
+
+import collections
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.io
+import scipy.sparse
+
+import pbio.utils.bed_utils as bed_utils
+
+import rpbp.translation_prediction.estimate_orf_bayes_factors as estimate_orf_bayes_factors
+import rpbp.translation_prediction.merge_orf_bayes_factors as merge_orf_bayes_factors
+
+seed = 8675309
+
+num_orfs = 200
+
+batch_max_length = 150
+batch_size = 4
+
+num_workers = [1, 4, 16]
+num_groups = [1, 3, 7, 100]
+num_shards = [1, 2, 5]
+
+
+class StubFit(object):
+    """ The draws of a fit, with the layout of pystan.StanFit4Model.sim.
+    """
+    def __init__(self, draws, warmup):
+        chains = len(next(iter(draws.values())))
+
+        self.sim = {
+            'samples': [
+                {'chains': collections.OrderedDict(
+                    (name, chain_draws[chain]) for name, chain_draws in draws.items())}
+                for chain in range(chains)
+            ],
+            'warmup2': [warmup] * chains,
+            'fnames_oi': list(draws.keys())
+        }
+
+
+class StubModel(object):
+    """ A stand-in for the (pickled) translated and untranslated models. The
+        draws of each parameter are normal, with a location and scale which
+        depend on the profile, and are generated from the seed of the fit, so
+        the estimates change if the seed of an ORF changes.
+    """
+    def __init__(self, is_translated, is_batched, index):
+        self.is_translated = is_translated
+        self.is_batched = is_batched
+        self.index = index
+
+    def get_profile_draws(self, x_1, x_2, x_3, random_state, shape):
+        x = x_1
+        if not self.is_translated:
+            x = np.concatenate([x_1, x_2, x_3])
+
+        location = np.mean(x)
+        scale = np.std(x) + 1
+        lp = -np.var(x) * (1 + self.index) + self.index * location
+
+        draws = [
+            lp + random_state.normal(size=shape),
+            location + random_state.normal(size=shape),
+            scale * np.exp(random_state.normal(scale=0.1, size=shape))
+        ]
+        return draws
+
+    def sampling(self, data, iter, chains, seed, warmup=None, **kwargs):
+        random_state = np.random.RandomState(seed)
+        shape = (chains, iter)
+
+        if warmup is None:
+            warmup = iter // 2
+
+        names = ['orf_lp', 'background_location', 'background_scale']
+        draws = collections.OrderedDict()
+
+        if self.is_batched:
+            orf_draws = []
+            for start, T in zip(data['start'], data['T']):
+                x = [data[x_i][start-1:start-1+T] for x_i in ['x_1', 'x_2', 'x_3']]
+                orf_draws.append(self.get_profile_draws(*x, random_state, shape))
+
+            for j, name in enumerate(names):
+                for i in range(data['N']):
+                    draws["{}[{}]".format(name, i+1)] = orf_draws[i][j]
+
+            draws['lp__'] = sum(d[0] for d in orf_draws)
+
+        else:
+            lp, location, scale = self.get_profile_draws(data['x_1'], data['x_2'], data['x_3'],
+                                                         random_state, shape)
+
+            # the untranslated models use positive_ordered[1] for the scale
+            scale_name = 'background_scale'
+            if not self.is_translated:
+                scale_name = 'background_scale[1]'
+
+            draws['background_location'] = location
+            draws[scale_name] = scale
+            draws['lp__'] = lp
+
+        return StubFit(draws, warmup)
+
+
+def write_inputs(base_path):
+    """ This function writes random ORFs, some short enough to be batched and
+        some not 0 mod 3, their profiles and the (pickled) stub models.
+
+        Returns:
+            list of strings: the arguments for the inputs and the models
+    """
+    random_state = np.random.RandomState(1)
+
+    orf_lens = random_state.randint(10, 200, size=num_orfs) * 3
+    m_off_frame = random_state.rand(num_orfs) < 0.05
+    orf_lens[m_off_frame] += 1
+
+    starts = random_state.randint(0, 10**6, size=num_orfs)
+    regions = pd.DataFrame({
+        'seqname': 'chr1',
+        'start': starts,
+        'end': starts + orf_lens,
+        'id': ["orf_{}".format(i) for i in random_state.permutation(num_orfs)],
+        'score': 0,
+        'strand': '+',
+        'thick_start': starts,
+        'thick_end': starts + orf_lens,
+        'color': 0,
+        'num_exons': 1,
+        'exon_lengths': orf_lens.astype(str),
+        'exon_genomic_relative_starts': '0',
+        'orf_num': np.arange(num_orfs),
+        'orf_len': orf_lens,
+        'orf_type': 'canonical'
+    })
+
+    regions_file = os.path.join(base_path, 'orfs.bed')
+    bed_utils.write_bed(regions, regions_file)
+
+    # mostly in the first frame, so most ORFs are fit
+    counts = random_state.poisson(0.3, size=(num_orfs, orf_lens.max()))
+    counts[:, 0::3] += random_state.poisson(1, size=counts[:, 0::3].shape)
+    counts[np.arange(orf_lens.max()) >= orf_lens[:, np.newaxis]] = 0
+
+    profiles_file = os.path.join(base_path, 'profiles.mtx')
+    scipy.io.mmwrite(profiles_file, scipy.sparse.coo_matrix(counts))
+
+    model_args = []
+    for option, is_translated, is_batched in [('--translated-models', True, False),
+                                              ('--untranslated-models', False, False),
+                                              ('--batched-translated-models', True, True),
+                                              ('--batched-untranslated-models', False, True)]:
+        model_args.append(option)
+
+        for index in range(2):
+            model_file = os.path.join(base_path, "{}-{}.pkl".format(option.strip('-'), index))
+            with open(model_file, 'wb') as f:
+                pickle.dump(StubModel(is_translated, is_batched, index), f)
+
+            model_args.append(model_file)
+
+    args = [profiles_file, regions_file] + model_args
+    return args
+
+
+def call_main(main, argv):
+    """ This function calls the main function of a script with the given
+        command line arguments.
+    """
+    saved_argv = sys.argv
+    try:
+        sys.argv = argv
+        main()
+    finally:
+        sys.argv = saved_argv
+
+
+def get_bayes_factors(base_path, input_args, workers, groups, shards, orf_seed=seed):
+    """ This function runs estimate-orf-bayes-factors with the given layout,
+        merging the shards if there is more than one.
+
+        Returns:
+            string: the Bayes factors (BED12+)
+    """
+    name = "bfs.workers-{}.groups-{}.shards-{}.seed-{}".format(workers, groups, shards, orf_seed)
+    out = os.path.join(base_path, "{}.bed".format(name))
+
+    profiles_file, regions_file = input_args[:2]
+    options = input_args[2:] + [
+        '--batch-max-length', str(batch_max_length),
+        '--batch-size', str(batch_size),
+        '--seed', str(orf_seed),
+        '--num-cpus', str(workers),
+        '--num-groups', str(groups),
+        '--tmp', base_path
+    ]
+
+    if shards == 1:
+        argv = ['estimate-orf-bayes-factors', profiles_file, regions_file, out] + options
+        call_main(estimate_orf_bayes_factors.main, argv)
+        return out
+
+    shard_files = []
+    for shard in range(1, shards+1):
+        shard_file = estimate_orf_bayes_factors.get_shard_filename(out, shard, shards)
+        shard_files.append(shard_file)
+
+        argv = ['estimate-orf-bayes-factors', profiles_file, regions_file, shard_file,
+                '--shard', "{}/{}".format(shard, shards)] + options
+        call_main(estimate_orf_bayes_factors.main, argv)
+
+    argv = ['merge-orf-bayes-factors'] + shard_files + [out]
+    call_main(merge_orf_bayes_factors.main, argv)
+
+    return out
+
+
+class TestOrfSeeds(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp(prefix="rpbp-test-orf-seeds-")
+        self.input_args = write_inputs(self.base_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path, ignore_errors=True)
+
+    def test_bayes_factors_do_not_depend_on_layout(self):
+        expected_file = get_bayes_factors(self.base_path, self.input_args, 1, 1, 1)
+        expected = bed_utils.read_bed(expected_file)
+
+        with open(expected_file, 'rb') as f:
+            expected_bytes = f.read()
+
+        # the layout is not trivial: some ORFs are batched, some are not,
+        # and the estimates depend on the seed
+        m_batched = expected['orf_len'] <= batch_max_length
+        m_fit = expected['bayes_factor_mean'] > float('-inf')
+        self.assertGreater((m_batched & m_fit).sum(), batch_size)
+        self.assertGreater((~m_batched & m_fit).sum(), 0)
+
+        other_seed = get_bayes_factors(self.base_path, self.input_args, 1, 1, 1,
+                                       orf_seed=seed+1)
+        other_seed = bed_utils.read_bed(other_seed)
+        self.assertFalse(np.array_equal(expected.loc[m_fit, 'bayes_factor_mean'],
+                                        other_seed.loc[m_fit, 'bayes_factor_mean']))
+
+        for workers in num_workers:
+            for groups in num_groups:
+                for shards in num_shards:
+                    layout = "workers: {}, groups: {}, shards: {}".format(workers, groups, shards)
+
+                    bfs_file = get_bayes_factors(self.base_path, self.input_args, workers,
+                                                 groups, shards)
+                    bfs = bed_utils.read_bed(bfs_file)
+
+                    pd.testing.assert_frame_equal(bfs, expected, check_exact=True, obj=layout)
+
+                    # the merged shards keep the values as written, so the files are identical
+                    with open(bfs_file, 'rb') as f:
+                        self.assertEqual(f.read(), expected_bytes, layout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+""" Check the startup budget of the console scripts (entry points) in
+setup.cfg, as benchmark-rpbp-startup does: each module is imported in a new
+interpreter with "python -X importtime", and the test fails if any entry
+point imports a deferred package at startup or exceeds its import time
+budget (see benchmark_startup.check_budget).
+"""
+
+import sys
+import unittest
+
+import rpbp.benchmark_startup as benchmark_startup
+
+
+class TestStartupBudget(unittest.TestCase):
+
+    def test_entry_points_are_within_budget(self):
+        args = benchmark_startup.parse_arguments([])
+        entry_points = benchmark_startup.get_entry_points(args.setup_cfg)
+        self.assertGreater(len(entry_points), 0)
+
+        violations = []
+        for name, module in entry_points:
+            record = benchmark_startup.measure_startup(module, sys.executable, args.repeats)
+            for violation in benchmark_startup.check_budget(name, record, {}, args):
+                violations.append("{}: {}".format(name, violation))
+
+        self.assertEqual(violations, [], "\n".join(violations))
+
+
+if __name__ == '__main__':
+    unittest.main()